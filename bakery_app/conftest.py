@@ -1,4 +1,5 @@
 import pytest
+from django.core.cache import cache
 
 from bakery_app.users.models import User
 from bakery_app.users.tests.factories import UserFactory
@@ -12,3 +13,9 @@ def media_storage(settings, tmpdir):
 @pytest.fixture
 def user(db) -> User:
     return UserFactory()
+
+
+@pytest.fixture(autouse=True)
+def clear_cache():
+    # Fragment cache entries and generation counters would otherwise outlive each test's data
+    cache.clear()
@@ -1,40 +1,81 @@
 from django.contrib import admin
-from .models import Supplier, Ingredient, Recipe, RecipeIngredient, Product, ProductVariation
+from . import search
+from .models import Supplier, Ingredient, Recipe, RecipeIngredient, Product, ProductVariation, ProductionPlan, ProductionPlanLine
 
 class RecipeIngredientInline(admin.TabularInline):
     model = RecipeIngredient
+    fk_name = 'recipe'
     extra = 1
+
+class TrigramSearchAdmin(admin.ModelAdmin):
+    """Searches search_fields with management.search, ranking results by trigram similarity."""
+
+    def get_search_results(self, request, queryset, search_term):
+        if not search_term.strip():
+            return super().get_search_results(request, queryset, search_term)
+        # No joins, so no duplicates; the changelist keeps the rank ordering unless a column is sorted
+        return search.ranked(queryset, self.get_search_fields(request), search_term), False
+
 @admin.register(Supplier)
-class SupplierAdmin(admin.ModelAdmin):
+class SupplierAdmin(TrigramSearchAdmin):
     list_display = ('name', 'ruc', 'email', 'phone', 'address')
     search_fields = ('name', 'ruc')
 
 @admin.register(Ingredient)
-class IngredientAdmin(admin.ModelAdmin):
+class IngredientAdmin(TrigramSearchAdmin):
     list_display = ('name', 'price_per_gram', 'supplier')
     list_filter = ('supplier',)
+    list_select_related = ('supplier',)
     search_fields = ('name',)
 
 @admin.register(Recipe)
-class RecipeAdmin(admin.ModelAdmin):
+class RecipeAdmin(TrigramSearchAdmin):
     list_display = ('name', 'description', 'shape')
     search_fields = ('name',)
     inlines = [RecipeIngredientInline,]
 
 @admin.register(RecipeIngredient)
 class RecipeIngredientAdmin(admin.ModelAdmin):
-    list_display = ('recipe', 'ingredient', 'quantity_in_grams')
+    list_display = ('recipe', 'ingredient', 'sub_recipe', 'quantity_in_grams')
     list_filter = ('recipe', 'ingredient')
     search_fields = ('recipe__name', 'ingredient__name')
 
 @admin.register(Product)
-class ProductAdmin(admin.ModelAdmin):
-    list_display = ('product_type', 'sale_price', 'recipe')
+class ProductAdmin(TrigramSearchAdmin):
+    list_display = ('product_type', 'sale_price', 'recipe', 'total_cost', 'profit', 'margin_percentage')
     list_filter = ('product_type', 'recipe')
+    list_select_related = ('recipe',)
     search_fields = ('product_type',)
 
+    def get_queryset(self, request):
+        return super().get_queryset(request).with_costing()
+
+    @admin.display(description='Total Cost $USD', ordering='total_cost')
+    def total_cost(self, obj):
+        return obj.total_cost
+
+    @admin.display(description='Profit $USD', ordering='profit')
+    def profit(self, obj):
+        return obj.profit
+
+    @admin.display(description='Margin (%)', ordering='margin_percentage')
+    def margin_percentage(self, obj):
+        return obj.margin_percentage
+
 @admin.register(ProductVariation)
 class ProductVariationAdmin(admin.ModelAdmin):
     list_display = ('product', 'diameter', 'length', 'width', 'main_variation')
     list_filter = ('product', 'main_variation')
+    list_select_related = ('product',)
     search_fields = ('product__product_type',)
+
+class ProductionPlanLineInline(admin.TabularInline):
+    model = ProductionPlanLine
+    raw_id_fields = ('variation',)
+    extra = 1
+
+@admin.register(ProductionPlan)
+class ProductionPlanAdmin(admin.ModelAdmin):
+    list_display = ('__str__', 'bake_date')
+    list_filter = ('bake_date',)
+    inlines = [ProductionPlanLineInline,]
@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class AManagementConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "bakery_app.management"
+
+    def ready(self):
+        import bakery_app.management.signals  # noqa: F401
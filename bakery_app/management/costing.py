@@ -0,0 +1,424 @@
+"""
+Whole-catalog costing on NumPy arrays.
+
+Prices, quantities, dimensions and results are int64 fixed-point hundredths, so every
+value rounds exactly like the Decimal properties on Product and ProductVariation.
+The recipe x ingredient quantity matrix is kept in sparse coordinate form, and sub-recipe
+lines are rolled up level by level so each sub-recipe is costed once.
+"""
+from decimal import Decimal
+from functools import cached_property
+
+import numpy as np
+from django.db.models import BigIntegerField, Case, F, IntegerField, Value, When
+from django.db.models.functions import Cast, Coalesce
+
+from . import fixedpoint, fragments
+from .models import Ingredient, IngredientPrice, Product, ProductVariation, Recipe, RecipeIngredient
+
+CIRCULAR = 1
+RECTANGULAR = 2
+
+
+def hundredths(field):
+    return Cast(Coalesce(F(field), Value(0)) * 100, BigIntegerField())
+
+
+def divide_half_even(numerator, denominator):
+    """Integer division rounding half to even, like Decimal.quantize(); denominator must be positive."""
+    quotient, remainder = np.divmod(numerator, denominator)
+    twice = remainder * 2
+    return quotient + ((twice > denominator) | ((twice == denominator) & (quotient % 2 == 1)))
+
+
+def as_decimal(value):
+    return Decimal(int(value)).scaleb(-2)
+
+
+def _columns(queryset, *fields):
+    rows = np.array(list(queryset.values_list(*fields)), dtype=np.int64)
+    return rows.reshape(-1, len(fields)).T
+
+
+def to_hundredths(value):
+    """Decimal-compatible value as int hundredths, rounding half to even like a DecimalField save."""
+    return int(Decimal(value).quantize(Decimal('.01')).scaleb(2))
+
+
+def sub_recipe_levels(recipe_count, sr_recipe, sr_sub):
+    """
+    Group sub-recipe line indexes by the dependency level of the recipe using them, so every
+    sub-recipe is fully costed before any line priced from it is added.
+    """
+    waiting_on = np.zeros(recipe_count, dtype=np.int64)
+    np.add.at(waiting_on, sr_recipe, 1)
+    lines_by_sub = {}
+    for line, sub in enumerate(sr_sub.tolist()):
+        lines_by_sub.setdefault(sub, []).append(line)
+    level_of = np.full(recipe_count, -1, dtype=np.int64)
+    current = np.flatnonzero(waiting_on == 0).tolist()
+    depth = 0
+    while current:
+        level_of[current] = depth
+        following = []
+        for sub in current:
+            for line in lines_by_sub.get(sub, ()):
+                recipe = int(sr_recipe[line])
+                waiting_on[recipe] -= 1
+                if not waiting_on[recipe]:
+                    following.append(recipe)
+        current = following
+        depth += 1
+    # Recipes on a cycle written without validation are costed last, from whatever is known
+    level_of[level_of < 0] = depth
+    line_levels = level_of[sr_recipe]
+    return [np.flatnonzero(line_levels == level) for level in np.unique(line_levels)]
+
+
+class Catalog:
+    """Array snapshot of the catalog, with foreign keys resolved to row indexes."""
+
+    def __init__(self, *, ingredient_ids, ingredient_prices, ingredient_suppliers, recipe_ids, recipe_shapes,
+                 ri_recipe, ri_ingredient, ri_quantity, product_ids, product_recipe, product_sale_price,
+                 variation_ids, variation_product, variation_main, variation_diameter, variation_length,
+                 variation_width, recipe_weight=None, sr_recipe=None, sr_sub=None, sr_quantity=None):
+        self.ingredient_ids = ingredient_ids
+        self.ingredient_prices = ingredient_prices
+        # Supplier primary keys are strings, so this one is an object array
+        self.ingredient_suppliers = ingredient_suppliers
+        self.recipe_ids = recipe_ids
+        self.recipe_shapes = recipe_shapes
+        self.ri_recipe = ri_recipe
+        self.ri_ingredient = ri_ingredient
+        self.ri_quantity = ri_quantity
+        self.product_ids = product_ids
+        self.product_recipe = product_recipe
+        self.product_sale_price = product_sale_price
+        self.variation_ids = variation_ids
+        self.variation_product = variation_product
+        self.variation_main = variation_main
+        self.variation_diameter = variation_diameter
+        self.variation_length = variation_length
+        self.variation_width = variation_width
+        # Sub-recipe lines, and each recipe's weight in grams per batch for pricing them per gram
+        empty = np.zeros(0, dtype=np.int64)
+        self.recipe_weight = np.zeros(len(recipe_ids), dtype=np.int64) if recipe_weight is None else recipe_weight
+        self.sr_recipe = empty if sr_recipe is None else sr_recipe
+        self.sr_sub = empty if sr_sub is None else sr_sub
+        self.sr_quantity = empty if sr_quantity is None else sr_quantity
+        self.sr_levels = sub_recipe_levels(len(recipe_ids), self.sr_recipe, self.sr_sub)
+
+    @cached_property
+    def costing(self):
+        """Costing at the current prices, computed once per snapshot."""
+        return compute(self)
+
+
+def load_catalog():
+    """Load the whole catalog in five queries."""
+    ingredients = list(
+        Ingredient.objects.order_by('pk')
+        .annotate(price=hundredths('price_per_gram'))
+        .values_list('pk', 'price', 'supplier_id')
+    )
+    ingredient_ids = np.array([row[0] for row in ingredients], dtype=np.int64)
+    ingredient_prices = np.array([row[1] for row in ingredients], dtype=np.int64)
+    ingredient_suppliers = np.array([row[2] for row in ingredients], dtype=object)
+    recipe_ids, recipe_shapes = _columns(
+        Recipe.objects.order_by('pk').annotate(
+            shape_code=Case(
+                When(shape='C', then=Value(CIRCULAR)),
+                When(shape='R', then=Value(RECTANGULAR)),
+                default=Value(0),
+                output_field=IntegerField(),
+            )
+        ),
+        'pk', 'shape_code',
+    )
+    line_recipe, line_ingredient, line_sub, line_quantity = _columns(
+        RecipeIngredient.objects.annotate(
+            component=Coalesce('ingredient_id', Value(-1)),
+            sub_component=Coalesce('sub_recipe_id', Value(-1)),
+            quantity=hundredths('quantity_in_grams'),
+        ),
+        'recipe_id', 'component', 'sub_component', 'quantity',
+    )
+    line_recipe = np.searchsorted(recipe_ids, line_recipe)
+    recipe_weight = np.zeros(len(recipe_ids), dtype=np.int64)
+    np.add.at(recipe_weight, line_recipe, line_quantity)
+    uses_ingredient = line_ingredient >= 0
+    uses_sub = line_sub >= 0
+    product_ids, product_recipe, product_sale_price = _columns(
+        Product.objects.order_by('pk').annotate(price=hundredths('sale_price')), 'pk', 'recipe_id', 'price'
+    )
+    variation_ids, variation_product, variation_main, diameter, length, width = _columns(
+        ProductVariation.objects.order_by('pk').annotate(
+            d=hundredths('diameter'), l=hundredths('length'), w=hundredths('width')
+        ),
+        'pk', 'product_id', 'main_variation', 'd', 'l', 'w',
+    )
+    return Catalog(
+        ingredient_ids=ingredient_ids,
+        ingredient_prices=ingredient_prices,
+        ingredient_suppliers=ingredient_suppliers,
+        recipe_ids=recipe_ids,
+        recipe_shapes=recipe_shapes,
+        ri_recipe=line_recipe[uses_ingredient],
+        ri_ingredient=np.searchsorted(ingredient_ids, line_ingredient[uses_ingredient]),
+        ri_quantity=line_quantity[uses_ingredient],
+        product_ids=product_ids,
+        product_recipe=np.searchsorted(recipe_ids, product_recipe),
+        product_sale_price=product_sale_price,
+        variation_ids=variation_ids,
+        variation_product=np.searchsorted(product_ids, variation_product),
+        variation_main=variation_main.astype(bool),
+        variation_diameter=diameter,
+        variation_length=length,
+        variation_width=width,
+        recipe_weight=recipe_weight,
+        sr_recipe=line_recipe[uses_sub],
+        sr_sub=np.searchsorted(recipe_ids, line_sub[uses_sub]),
+        sr_quantity=line_quantity[uses_sub],
+    )
+
+
+def recipe_costs(catalog, ingredient_prices=None):
+    """
+    Unrounded cost of every recipe in ten-thousandths (quantity hundredths x price hundredths).
+    ``ingredient_prices`` overrides catalog.ingredient_prices, e.g. for what-if pricing.
+    """
+    prices = catalog.ingredient_prices if ingredient_prices is None else ingredient_prices
+    costs = np.zeros(len(catalog.recipe_ids), dtype=np.int64)
+    np.add.at(costs, catalog.ri_recipe, catalog.ri_quantity * prices[catalog.ri_ingredient])
+    for lines in catalog.sr_levels:
+        # A sub-recipe line costs quantity x rounded batch cost / batch weight, rounded to 1e-4 like the SQL
+        sub = catalog.sr_sub[lines]
+        weight = catalog.recipe_weight[sub]
+        weighed = weight > 0
+        contribution = np.zeros(len(lines), dtype=np.int64)
+        contribution[weighed] = divide_half_even(
+            catalog.sr_quantity[lines][weighed] * divide_half_even(costs[sub][weighed], 100) * 100, weight[weighed]
+        )
+        np.add.at(costs, catalog.sr_recipe[lines], contribution)
+    return costs
+
+
+def surface_areas(catalog):
+    """Surface area of every variation in hundredths, as ProductVariation.calculate_surface_area()."""
+    shapes = catalog.recipe_shapes[catalog.product_recipe[catalog.variation_product]]
+    diameter, length, width = catalog.variation_diameter, catalog.variation_length, catalog.variation_width
+
+    # pi * r**2 overflows int64, so it is rounded with Python ints once per distinct diameter
+    diameters, inverse = np.unique(diameter, return_inverse=True)
+    circle_areas = np.array(
+        [fixedpoint.circle_area(int(d) * 10**4) // 10**4 for d in diameters],
+        dtype=np.int64,
+    )
+    areas = np.zeros(len(catalog.variation_ids), dtype=np.int64)
+    circular = (shapes == CIRCULAR) & (diameter != 0)
+    rectangular = (shapes == RECTANGULAR) & (length != 0) & (width != 0)
+    areas[circular] = circle_areas[inverse.reshape(-1)[circular]]
+    areas[rectangular] = divide_half_even(length[rectangular] * width[rectangular], 100)
+    return areas
+
+
+def main_variations(catalog):
+    """Index of each product's main variation (lowest pk), or -1 when it has none."""
+    main_positions = np.flatnonzero(catalog.variation_main)
+    products, first = np.unique(catalog.variation_product[main_positions], return_index=True)
+    mains = np.full(len(catalog.product_ids), -1, dtype=np.int64)
+    mains[products] = main_positions[first]
+    return mains
+
+
+class CatalogCosting:
+    """Costing results in hundredths, aligned with the catalog's product and variation arrays."""
+
+    def __init__(self, catalog, recipe_cost, product_cost, product_profit, product_margin, variation_area,
+                 variation_factor, variation_cost, variation_profit, variation_margin):
+        self.catalog = catalog
+        self.recipe_cost = recipe_cost
+        self.product_cost = product_cost
+        self.product_profit = product_profit
+        # Margin is undefined for a zero sale price; those entries are masked
+        self.product_margin = product_margin
+        self.variation_area = variation_area
+        self.variation_factor = variation_factor
+        self.variation_cost = variation_cost
+        self.variation_profit = variation_profit
+        self.variation_margin = variation_margin
+
+    def recipes(self):
+        for i, pk in enumerate(self.catalog.recipe_ids):
+            yield {'id': int(pk), 'cost': as_decimal(self.recipe_cost[i])}
+
+    def products(self):
+        for i, pk in enumerate(self.catalog.product_ids):
+            yield {
+                'id': int(pk),
+                'total_cost': as_decimal(self.product_cost[i]),
+                'profit': as_decimal(self.product_profit[i]),
+                'margin_percentage': _masked_decimal(self.product_margin[i]),
+            }
+
+    def variations(self):
+        for i, pk in enumerate(self.catalog.variation_ids):
+            yield {
+                'id': int(pk),
+                'surface_area': as_decimal(self.variation_area[i]),
+                'area_factor': as_decimal(self.variation_factor[i]),
+                'variation_cost': as_decimal(self.variation_cost[i]),
+                'variation_profit': as_decimal(self.variation_profit[i]),
+                'variation_margin': as_decimal(self.variation_margin[i]),
+            }
+
+
+def compute(catalog, ingredient_prices=None):
+    """Cost, profit and margin for every product and variation in one batched pass."""
+    sale_price = catalog.product_sale_price
+    recipe_cost = divide_half_even(recipe_costs(catalog, ingredient_prices), 100)
+    product_cost = recipe_cost[catalog.product_recipe]
+    product_profit = sale_price - product_cost
+    sign = np.sign(sale_price)
+    product_margin = np.ma.masked_array(
+        divide_half_even(product_profit * 10000 * sign, np.where(sign == 0, 1, sale_price * sign)),
+        mask=sign == 0,
+    )
+
+    areas = surface_areas(catalog)
+    mains = main_variations(catalog)[catalog.variation_product]
+    main_area = np.where(mains >= 0, areas[mains], 0)
+    scaled = (mains >= 0) & (mains != np.arange(len(areas))) & (main_area > 0)
+    factor = np.full(len(areas), 100, dtype=np.int64)
+    factor[scaled] = divide_half_even(areas[scaled] * 100, main_area[scaled])
+
+    variation_sale_price = sale_price[catalog.variation_product]
+    variation_cost = divide_half_even(product_cost[catalog.variation_product] * factor, 100)
+    variation_profit = variation_sale_price - variation_cost
+    positive = variation_sale_price > 0
+    variation_margin = np.zeros(len(areas), dtype=np.int64)
+    variation_margin[positive] = divide_half_even(variation_profit[positive] * 10000, variation_sale_price[positive])
+
+    return CatalogCosting(
+        catalog, recipe_cost, product_cost, product_profit, product_margin, areas, factor,
+        variation_cost, variation_profit, variation_margin,
+    )
+
+
+def catalog_costing():
+    return compute(load_catalog())
+
+
+# Models load_catalog() reads; a committed write to any of them bumps its fragment generation
+CATALOG_MODELS = (Ingredient, Recipe, RecipeIngredient, Product, ProductVariation)
+_snapshot = None
+
+
+def cached_catalog():
+    """
+    The catalog as of the current fragment generations of CATALOG_MODELS, loaded again only
+    after a committed write to one of them, so repeated simulations only pay for compute().
+    """
+    global _snapshot
+    key = tuple(fragments.generations(CATALOG_MODELS))
+    snapshot = _snapshot
+    if snapshot is None or snapshot[0] != key:
+        snapshot = _snapshot = (key, load_catalog())
+    return snapshot[1]
+
+
+def simulated_prices(catalog, ingredient_prices=None, supplier_percentages=None):
+    """
+    Ingredient price array with hypothetical changes applied, without touching the database.
+    ``supplier_percentages`` maps supplier ids to a percentage change for all their ingredients;
+    ``ingredient_prices`` maps ingredient ids to a new price per gram and wins over supplier changes.
+    """
+    prices = catalog.ingredient_prices.copy()
+    for supplier_id, percentage in (supplier_percentages or {}).items():
+        supplied = catalog.ingredient_suppliers == str(supplier_id)
+        prices[supplied] = divide_half_even(prices[supplied] * (10000 + to_hundredths(percentage)), 10000)
+    for ingredient_id, price in (ingredient_prices or {}).items():
+        index = np.searchsorted(catalog.ingredient_ids, int(ingredient_id))
+        if index < len(catalog.ingredient_ids) and catalog.ingredient_ids[index] == int(ingredient_id):
+            prices[index] = to_hundredths(price)
+    return prices
+
+
+def historical_prices(catalog, timestamp):
+    """
+    Ingredient price array as recorded in the price history at ``timestamp``, in one query.
+    Ingredients with no recorded price at that instant keep their current price.
+    """
+    prices = catalog.ingredient_prices.copy()
+    ingredient_ids, history = _columns(
+        Ingredient.objects.annotate(
+            historical_price=Coalesce(IngredientPrice.objects.price_at(timestamp), F('price_per_gram'))
+        ).annotate(price=hundredths('historical_price')),
+        'pk', 'price',
+    )
+    # Ingredients created after the catalog was loaded are ignored
+    indexes = np.searchsorted(catalog.ingredient_ids, ingredient_ids)
+    known = indexes < len(catalog.ingredient_ids)
+    known[known] = catalog.ingredient_ids[indexes[known]] == ingredient_ids[known]
+    prices[indexes[known]] = history[known]
+    return prices
+
+
+def as_of(timestamp, catalog=None):
+    """
+    Costing at a past instant: current recipes, products and sale prices, with ingredients
+    priced from the price history.
+    """
+    catalog = catalog or load_catalog()
+    return compute(catalog, historical_prices(catalog, timestamp))
+
+
+class PriceSimulation:
+    """Current versus hypothetical costing, ranked by margin delta (largest drop first)."""
+
+    def __init__(self, current, simulated):
+        self.current = current
+        self.simulated = simulated
+
+    def products(self, limit=None, target_margin=None):
+        delta = self.simulated.product_margin - self.current.product_margin
+        # Products without a margin (zero sale price) sort last
+        order = np.ma.argsort(delta, kind='stable', endwith=True)
+        if target_margin is not None:
+            below = (self.simulated.product_margin < to_hundredths(target_margin)).filled(False)
+            order = order[below[order]]
+        for i in order[:limit]:
+            yield {
+                'id': int(self.current.catalog.product_ids[i]),
+                'total_cost': as_decimal(self.current.product_cost[i]),
+                'new_total_cost': as_decimal(self.simulated.product_cost[i]),
+                'margin_percentage': _masked_decimal(self.current.product_margin[i]),
+                'new_margin_percentage': _masked_decimal(self.simulated.product_margin[i]),
+                'margin_delta': _masked_decimal(delta[i]),
+            }
+
+    def variations(self, limit=None, target_margin=None):
+        delta = self.simulated.variation_margin - self.current.variation_margin
+        order = np.argsort(delta, kind='stable')
+        if target_margin is not None:
+            order = order[self.simulated.variation_margin[order] < to_hundredths(target_margin)]
+        for i in order[:limit]:
+            yield {
+                'id': int(self.current.catalog.variation_ids[i]),
+                'product_id': int(self.current.catalog.product_ids[self.current.catalog.variation_product[i]]),
+                'variation_cost': as_decimal(self.current.variation_cost[i]),
+                'new_variation_cost': as_decimal(self.simulated.variation_cost[i]),
+                'variation_margin': as_decimal(self.current.variation_margin[i]),
+                'new_variation_margin': as_decimal(self.simulated.variation_margin[i]),
+                'margin_delta': as_decimal(delta[i]),
+            }
+
+
+def _masked_decimal(value):
+    return None if value is np.ma.masked else as_decimal(value)
+
+
+def simulate(ingredient_prices=None, supplier_percentages=None, catalog=None):
+    catalog = catalog or load_catalog()
+    prices = simulated_prices(catalog, ingredient_prices, supplier_percentages)
+    return PriceSimulation(catalog.costing, compute(catalog, prices))
@@ -1,8 +1,42 @@
 # management/filters.py
 import django_filters
-from .models import Product
+from . import search
+from .models import Ingredient, Product, ProductVariation
 
 class ProductFilter(django_filters.FilterSet):
+    search = django_filters.CharFilter(method='filter_search', label='Search')
+    # Filter on ProductQuerySet.with_costing() annotations, so they run in SQL
+    total_cost = django_filters.RangeFilter(label='Total Cost $USD')
+    profit = django_filters.RangeFilter(label='Profit $USD')
+    margin_percentage = django_filters.RangeFilter(label='Margin (%)')
+
     class Meta:
         model = Product
         fields = ['product_type', 'sale_price']
+
+    def filter_search(self, queryset, name, value):
+        # Best trigram match first, unless the table is sorted on a column
+        return search.ranked(queryset, search.SEARCH_FIELDS['products'], value)
+
+
+class IngredientFilter(django_filters.FilterSet):
+    search = django_filters.CharFilter(method='filter_search', label='Search')
+    price_per_gram = django_filters.RangeFilter(label='Price per gram $USD')
+
+    class Meta:
+        model = Ingredient
+        fields = ['supplier']
+
+    def filter_search(self, queryset, name, value):
+        return search.ranked(queryset, search.SEARCH_FIELDS['ingredients'], value)
+
+
+class ProductVariationFilter(django_filters.FilterSet):
+    # ProductVariationQuerySet.with_adjusted_costing() annotations
+    adjusted_cost = django_filters.RangeFilter(field_name='variation_cost', label='Adjusted Cost $USD')
+    adjusted_profit = django_filters.RangeFilter(field_name='variation_profit', label='Profit $USD')
+    adjusted_margin = django_filters.RangeFilter(field_name='variation_margin', label='Margin (%)')
+
+    class Meta:
+        model = ProductVariation
+        fields = ['product']
@@ -0,0 +1,92 @@
+"""
+Fixed-point integer costing.
+
+Amounts are plain ints in micro-units (millionths). Every rounding step is done once on the
+exact rational value, half to even, which gives the same results as the Decimal properties on
+Product and ProductVariation: their 28-digit context never lands close enough to a rounding
+boundary to round differently. The NumPy engine (costing.py) takes its circle areas from here.
+
+Converting Decimal inputs costs more than it saves, so this only pays off for values that are
+loaded and kept as integers; the model properties stay on Decimal.
+"""
+from decimal import ROUND_HALF_EVEN, Decimal
+from math import pi as math_pi
+
+MICRO = 10**6
+# math.pi is the value behind models.pi = Decimal(math_pi), exactly
+PI_NUMERATOR, PI_DENOMINATOR = math_pi.as_integer_ratio()
+_PLACES = {places: Decimal(1).scaleb(-places) for places in range(7)}
+_POW10 = [10**n for n in range(7)]
+MICRO_SQUARED = MICRO * MICRO
+_CIRCLE_DENOMINATOR = PI_DENOMINATOR * 4 * MICRO_SQUARED
+
+
+def to_micro(value):
+    """Decimal, int or numeric string as micro-units, rounding half to even; ``None`` counts as zero."""
+    if value is None:
+        return 0
+    if not isinstance(value, Decimal):
+        value = Decimal(value)
+    return int((value * MICRO).to_integral_value(ROUND_HALF_EVEN))
+
+
+def to_decimal(micro, places=2):
+    """Micro-units as a Decimal with ``places`` decimal places, the way the Decimal properties return them."""
+    return Decimal(micro).scaleb(-6).quantize(_PLACES[places])
+
+
+def divide_half_even(numerator, denominator):
+    """Integer division rounding half to even; ``denominator`` must be positive."""
+    quotient, remainder = divmod(numerator, denominator)
+    twice = remainder * 2
+    if twice > denominator or (twice == denominator and quotient % 2):
+        quotient += 1
+    return quotient
+
+
+def round_to(numerator, denominator, places=2):
+    """numerator / denominator rounded half to even to ``places`` decimals, in micro-units."""
+    # divide_half_even() inlined: this is the innermost call of every property
+    quotient, remainder = divmod(numerator * _POW10[places], denominator)
+    twice = remainder * 2
+    if twice > denominator or (twice == denominator and quotient % 2):
+        quotient += 1
+    return quotient * _POW10[6 - places]
+
+
+def circle_area(diameter):
+    """pi * (diameter / 2) ** 2 rounded to cents, for ``diameter`` in micro-units."""
+    return round_to(PI_NUMERATOR * diameter * diameter, _CIRCLE_DENOMINATOR)
+
+
+def rectangle_area(length, width):
+    return round_to(length * width, MICRO_SQUARED)
+
+
+def surface_area(shape, diameter, length, width):
+    """ProductVariation.calculate_surface_area() for a recipe shape key ('C' or 'R')."""
+    if shape == 'C' and diameter:
+        return circle_area(diameter)
+    if shape == 'R' and length and width:
+        return rectangle_area(length, width)
+    return 0
+
+
+def adjustment_factor(area, main_area):
+    return round_to(area, main_area) if main_area > 0 else MICRO
+
+
+def sub_recipe_line_cost(quantity, cost, weight):
+    """``quantity`` grams of a sub-recipe priced per gram from its batch cost, rounded to four decimals."""
+    return round_to(quantity * cost, weight * MICRO, places=4) if cost and weight else 0
+
+
+def adjusted_cost(cost, factor):
+    return round_to(cost * factor, MICRO_SQUARED)
+
+
+def margin(profit, sale_price):
+    """Profit as a percentage of ``sale_price``, rounded to cents. A zero sale price raises ZeroDivisionError."""
+    if sale_price < 0:
+        profit, sale_price = -profit, -sale_price
+    return round_to(profit * 100, sale_price)
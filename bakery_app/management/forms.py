@@ -1,6 +1,15 @@
+import json
+
 from django import forms
-from django.forms import inlineformset_factory, ModelChoiceField
-from .models import Supplier, Ingredient, Recipe, RecipeIngredient, Product, ProductVariation
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.urls import reverse
+from django.utils import timezone
+from django.forms import formset_factory, inlineformset_factory, ModelChoiceField
+from decimal import Decimal
+from . import fragments
+from .models import CYCLE_MESSAGE, Supplier, Ingredient, Recipe, RecipeCost, RecipeIngredient, Product, ProductVariation
+from .typeahead import LazyModelChoiceField, LazySelect, SharedChoicesInlineFormSet, SharedLookupModelForm, valid_keys
 
 class SupplierForm(forms.ModelForm):
     class Meta:
@@ -51,18 +60,91 @@ class RecipeForm(forms.ModelForm):
             self.fields['length'].required = True
             self.fields['width'].required = True
 
-class RecipeIngredientForm(forms.ModelForm):
-    ingredient = ModelChoiceField(queryset=Ingredient.objects.all(), widget=forms.Select(attrs={'class': 'form-control'}))
+class RecipeIngredientForm(SharedLookupModelForm):
+    ingredient = LazyModelChoiceField(queryset=Ingredient.objects.all(), required=False, widget=LazySelect('ingredients', attrs={'class': 'form-control'}))
+    sub_recipe = LazyModelChoiceField(queryset=Recipe.objects.all(), required=False, widget=LazySelect('recipes', attrs={'class': 'form-control'}))
     quantity_in_grams = forms.DecimalField(widget=forms.NumberInput(attrs={'class': 'form-control'}))
 
     class Meta:
         model = RecipeIngredient
-        fields = ['ingredient', 'quantity_in_grams']
+        fields = ['ingredient', 'sub_recipe', 'quantity_in_grams']
+
+    def clean(self):
+        cleaned_data = super().clean()
+        if bool(cleaned_data.get('ingredient')) == bool(cleaned_data.get('sub_recipe')):
+            raise forms.ValidationError("Choose either an ingredient or a sub-recipe.")
+        return cleaned_data
+
+
+class BaseRecipeIngredientFormSet(SharedChoicesInlineFormSet):
+    """
+    The lines of a recipe, validated together and saved in bulk. Their ingredients and
+    sub-recipes come from the shared lookups, cycles are checked for every line in one query,
+    and save() writes only the changed rows with bulk_create(), bulk_update() and one DELETE,
+    so a recipe saves in the same number of queries however many lines it has.
+    """
+
+    def clean(self):
+        super().clean()
+        uses = [
+            form for form in self.forms
+            if form.is_valid() and form.has_changed() and not self._should_delete_form(form) and form.cleaned_data.get('sub_recipe')
+        ]
+        # A new recipe is nobody's sub-recipe yet, so its lines cannot close a cycle
+        if not uses or self.instance.pk is None:
+            return
+        # The recipe itself and every recipe that uses it: none of them can be one of its lines
+        ancestors = Recipe.objects.ancestor_ids([self.instance.pk])
+        for form in uses:
+            if form.cleaned_data['sub_recipe'].pk in ancestors:
+                form.add_error('sub_recipe', CYCLE_MESSAGE)
+
+    @transaction.atomic
+    def save(self, commit=True):
+        if not commit:
+            return super().save(commit=False)
+        self.new_objects, self.changed_objects, self.deleted_objects = [], [], []
+        for form in self.initial_forms:
+            line = form.instance
+            if line.pk is None:
+                continue
+            if self.can_delete and self._should_delete_form(form):
+                self.deleted_objects.append(line)
+            elif form.has_changed():
+                self.changed_objects.append((line, form.changed_data))
+        for form in self.extra_forms:
+            if form.has_changed() and not (self.can_delete and self._should_delete_form(form)):
+                setattr(form.instance, self.fk.name, self.instance)
+                self.new_objects.append(form.instance)
+
+        # The model signals would have marked the cost dirty and bumped the fragments for every row.
+        # Nothing references recipe lines, so they are deleted without the collector and its signals
+        if self.deleted_objects:
+            deleted = RecipeIngredient.objects.filter(
+                recipe_id=self.instance.pk, pk__in=[line.pk for line in self.deleted_objects]
+            )
+            deleted._raw_delete(deleted.db)
+        if self.changed_objects:
+            now = timezone.now()
+            for line, _ in self.changed_objects:
+                line.updated_at = now
+            RecipeIngredient.objects.bulk_update(
+                [line for line, _ in self.changed_objects], [*self.form._meta.fields, 'updated_at'],
+            )
+        if self.new_objects:
+            RecipeIngredient.objects.bulk_create(self.new_objects)
+        if self.deleted_objects or self.changed_objects or self.new_objects:
+            RecipeCost.objects.mark_dirty([self.instance.pk])
+            fragments.bump(RecipeIngredient)
+        return [line for line, _ in self.changed_objects] + self.new_objects
+
 
 RecipeIngredientFormSet = inlineformset_factory(
     Recipe, RecipeIngredient,
     form=RecipeIngredientForm,
-    fields=['ingredient', 'quantity_in_grams'],
+    formset=BaseRecipeIngredientFormSet,
+    fk_name='recipe',
+    fields=['ingredient', 'sub_recipe', 'quantity_in_grams'],
     extra=1,
     can_delete=True
 )
@@ -72,10 +154,11 @@ class ProductForm(forms.ModelForm):
     class Meta:
         model = Product
         fields = ['product_type', 'sale_price', 'recipe']
+        field_classes = {'recipe': LazyModelChoiceField}
         widgets = {
             'product_type': forms.TextInput(attrs={'class': 'form-control'}),
             'sale_price': forms.NumberInput(attrs={'class': 'form-control'}),
-            'recipe': forms.Select(attrs={'class': 'form-control'}),
+            'recipe': LazySelect('recipes', attrs={'class': 'form-control'}),
         }
 
     def save(self, commit=True):
@@ -97,13 +180,32 @@ class ProductForm(forms.ModelForm):
         return product_instance
 
 
+class ProductShapeSelect(LazySelect):
+    """
+    Product typeahead that embeds the shape map of the products it renders, so switching between
+    them needs no request; product_shapes.js fetches those of later options in batches.
+    """
+
+    def __init__(self, attrs=None):
+        super().__init__('products', attrs)
+
+    def get_context(self, name, value, attrs):
+        context = super().get_context(name, value, attrs)
+        ids = valid_keys(self.choices.field, context['widget']['value'])
+        shapes = Product.objects.filter(pk__in=ids).shapes() if ids else {}
+        context['widget']['attrs']['data-shapes'] = json.dumps(shapes, cls=DjangoJSONEncoder)
+        context['widget']['attrs']['data-shapes-url'] = reverse('management:product-shapes')
+        return context
+
+
 class ProductVariationForm(forms.ModelForm):
 
     class Meta:
         model = ProductVariation
         fields = ['product', 'diameter', 'length', 'width']
+        field_classes = {'product': LazyModelChoiceField}
         widgets = {
-            'product': forms.Select(attrs={'class': 'form-control', 'onchange': 'updateFormFields();'}),
+            'product': ProductShapeSelect(attrs={'class': 'form-control', 'onchange': 'updateFormFields(this);'}),
             'diameter': forms.NumberInput(attrs={'class': 'form-control'}),
             'length': forms.NumberInput(attrs={'class': 'form-control'}),
             'width': forms.NumberInput(attrs={'class': 'form-control'}),
@@ -117,3 +219,36 @@ class ProductVariationForm(forms.ModelForm):
         return instance
 
 ProductVariationFormSet = inlineformset_factory(Product, ProductVariation, form=ProductVariationForm, extra=1, can_delete=True)
+
+
+class IngredientPriceChangeForm(forms.Form):
+    ingredient = ModelChoiceField(queryset=Ingredient.objects.all(), widget=forms.Select(attrs={'class': 'form-control'}))
+    price_per_gram = forms.DecimalField(
+        max_digits=10, decimal_places=2, min_value=Decimal('0.01'), widget=forms.NumberInput(attrs={'class': 'form-control'})
+    )
+
+
+class SupplierPriceChangeForm(forms.Form):
+    supplier = ModelChoiceField(queryset=Supplier.objects.all(), widget=forms.Select(attrs={'class': 'form-control'}))
+    percentage = forms.DecimalField(
+        max_digits=5, decimal_places=2, min_value=Decimal('-99.99'), widget=forms.NumberInput(attrs={'class': 'form-control'})
+    )
+
+
+class PriceSimulationForm(forms.Form):
+    target_margin = forms.DecimalField(
+        required=False, max_digits=5, decimal_places=2, widget=forms.NumberInput(attrs={'class': 'form-control'})
+    )
+
+class PriceListImportForm(forms.Form):
+    file = forms.FileField(widget=forms.ClearableFileInput(attrs={'class': 'form-control', 'accept': '.csv,text/csv'}))
+    supplier = forms.ModelChoiceField(
+        queryset=Supplier.objects.order_by('name'),
+        required=False,
+        help_text='For price lists without a RUC or supplier column.',
+        widget=forms.Select(attrs={'class': 'form-control'}),
+    )
+    dry_run = forms.BooleanField(required=False, label='Preview only')
+
+IngredientPriceChangeFormSet = formset_factory(IngredientPriceChangeForm, extra=3)
+SupplierPriceChangeFormSet = formset_factory(SupplierPriceChangeForm, extra=2)
@@ -0,0 +1,158 @@
+"""
+Versioned fragment cache and conditional responses for the HTMX table partials.
+
+Each model the tables read has a generation counter in the cache, bumped after every committed
+save or delete. A fragment's key includes the generations of the models it was rendered from,
+so a write makes the old fragments unreachable instead of having to find and delete them. The
+same generations make the ETags of conditional() views, which are checked without a query.
+"""
+import hashlib
+import time
+from datetime import datetime, timezone
+from functools import wraps
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.http import HttpResponse
+from django.utils.cache import patch_vary_headers
+from django.views.decorators.http import condition
+
+from . import instrumentation
+
+GENERATION_KEY = 'fragments:generation:{}'
+MODIFIED_KEY = 'fragments:modified:{}'
+HITS_KEY, MISSES_KEY = 'fragments:hits', 'fragments:misses'
+
+
+def _label(model):
+    return model._meta.label_lower
+
+
+def _incr(key, initial=0):
+    try:
+        return cache.incr(key)
+    except ValueError:
+        cache.add(key, initial, timeout=None)
+        return cache.incr(key)
+
+
+def _seed():
+    # A missing generation starts from the clock, never from a value an evicted counter could
+    # have held, so fragments keyed on the old generations stay unreachable
+    return time.time_ns()
+
+
+def bump(*models):
+    """Advance the generation of ``models`` once the current transaction commits."""
+    def advance():
+        for model in models:
+            _incr(GENERATION_KEY.format(_label(model)), _seed())
+        cache.set_many({MODIFIED_KEY.format(_label(model)): time.time() for model in models}, timeout=None)
+
+    transaction.on_commit(advance)
+
+
+def generations(models):
+    keys = [GENERATION_KEY.format(_label(model)) for model in models]
+    found = cache.get_many(keys)
+    for key in keys:
+        if key not in found:
+            cache.add(key, _seed(), timeout=None)
+            found[key] = cache.get(key)
+    return [found[key] for key in keys]
+
+
+def last_modified(models):
+    """When any of ``models`` was last written, if a write has been recorded since the cache was filled."""
+    times = cache.get_many([MODIFIED_KEY.format(_label(model)) for model in models]).values()
+    return datetime.fromtimestamp(max(times), tz=timezone.utc) if times else None
+
+
+def _digest(name, request, models, extra=''):
+    query = urlencode(sorted((key, value) for key, values in request.GET.lists() for value in values))
+    generation = '.'.join(str(value) for value in generations(models))
+    return hashlib.md5(f'{name}|{query}|{extra}|{generation}'.encode(), usedforsecurity=False).hexdigest()
+
+
+def fragment_key(name, request, models):
+    """Key for fragment ``name`` rendered for the request's query string (filters, sort, cursor)."""
+    return f'fragments:{name}:{_digest(name, request, models)}'
+
+
+def etag(name, request, models, **kwargs):
+    """Strong ETag for view ``name``: its URL arguments, query string and HTMX-ness, and the generations of ``models``."""
+    return _digest(name, request, models, extra=f'{sorted(kwargs.items())}|{bool(request.htmx)}')
+
+
+def conditional(name, models, htmx_only=False):
+    """
+    View decorator: django's condition() with etag() and last_modified(), so an unchanged response
+    is a 304 before the view runs. HTMX requests get their own ETag, and responses vary on HX-Request.
+
+    With ``htmx_only``, full pages skip it: they render the layout with the user, messages and CSRF
+    token, which the model generations know nothing about.
+    """
+    def decorator(view):
+        conditional_view = condition(
+            etag_func=lambda request, *args, **kwargs: etag(name, request, models, **kwargs),
+            last_modified_func=lambda request, *args, **kwargs: last_modified(models),
+        )(view)
+
+        @wraps(view)
+        def inner(request, *args, **kwargs):
+            if htmx_only and not request.htmx:
+                response = view(request, *args, **kwargs)
+            else:
+                response = conditional_view(request, *args, **kwargs)
+            patch_vary_headers(response, ('HX-Request',))
+            return response
+
+        return inner
+
+    return decorator
+
+
+def cached_fragment(name, request, models, render):
+    """The cached HTML for ``name``, calling ``render()`` to produce it on a miss."""
+    key = fragment_key(name, request, models)
+    html = cache.get(key)
+    instrumentation.record_cache_lookup(html is not None)
+    if html is not None:
+        _incr(HITS_KEY)
+        return html
+    _incr(MISSES_KEY)
+    html = render()
+    cache.set(key, html, timeout=settings.FRAGMENT_CACHE_TIMEOUT)
+    return html
+
+
+def stats():
+    counts = cache.get_many([HITS_KEY, MISSES_KEY])
+    hits, misses = counts.get(HITS_KEY, 0), counts.get(MISSES_KEY, 0)
+    lookups = hits + misses
+    return {'hits': hits, 'misses': misses, 'hit_rate': round(hits / lookups, 4) if lookups else None}
+
+
+class FragmentCacheMixin:
+    """
+    For table views: answer unchanged HTMX requests with a 304 and the others from the fragment
+    cache. The view's get() only runs, and its queryset is only evaluated, on a miss. Full pages
+    are always rendered.
+    """
+
+    fragment_models = ()
+
+    def dispatch(self, request, *args, **kwargs):
+        view = conditional(type(self).__name__, self.fragment_models, htmx_only=True)(super().dispatch)
+        return view(request, *args, **kwargs)
+
+    def get(self, request, *args, **kwargs):
+        if not request.htmx:
+            return super().get(request, *args, **kwargs)
+
+        def render():
+            return super(FragmentCacheMixin, self).get(request, *args, **kwargs).render().content.decode()
+
+        return HttpResponse(cached_fragment(type(self).__name__, request, self.fragment_models, render))
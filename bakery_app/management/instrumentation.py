@@ -0,0 +1,149 @@
+"""
+Per-request instrumentation: SQL queries and database time, fragment cache hits and misses, and
+template render time, reported in a structured log line and, where enabled, a Server-Timing
+header. A request that runs more queries than its view's budget (settings.QUERY_BUDGETS, keyed
+by URL name) also logs a warning naming its most repeated statements, which is how an N+1 shows.
+
+Templates are timed by the TimedDjangoTemplates backend, which settings.TEMPLATES lists in place
+of Django's own; templates from any other backend are not counted.
+
+Queries a StreamingHttpResponse runs while streaming happen after the middleware has returned and
+are not counted.
+"""
+import json
+import logging
+import time
+from collections import Counter
+from contextlib import ExitStack
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import connections
+from django.template.backends.django import DjangoTemplates, Template
+
+logger = logging.getLogger(__name__)
+
+_current = ContextVar('request_stats', default=None)
+
+# Savepoints (ATOMIC_REQUESTS inside an outer transaction, nested atomic blocks) add to the
+# database time but are not queries a view could batch, so they are left out of the counts
+TRANSACTION_CONTROL = ('SAVEPOINT', 'RELEASE SAVEPOINT', 'ROLLBACK TO SAVEPOINT')
+
+
+class RequestStats:
+    def __init__(self):
+        self.queries = 0
+        self.db_time = 0.0
+        self.statements = Counter()
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.template_time = 0.0
+        self.rendering = False
+
+    def execute(self, execute, sql, params, many, context):
+        """connection.execute_wrapper() hook."""
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.db_time += time.perf_counter() - started
+            if not sql.startswith(TRANSACTION_CONTROL):
+                self.queries += 1
+                self.statements[sql] += 1
+
+    def repeated(self, limit=5):
+        """The ``limit`` statements run most often, if more than once, with their counts."""
+        return [(sql, count) for sql, count in self.statements.most_common(limit) if count > 1]
+
+
+def current():
+    """The RequestStats of the request being handled, if any."""
+    return _current.get()
+
+
+def record_cache_lookup(hit):
+    stats = _current.get()
+    if stats is None:
+        return
+    if hit:
+        stats.cache_hits += 1
+    else:
+        stats.cache_misses += 1
+
+
+class TimedTemplate(Template):
+    def render(self, context=None, request=None):
+        stats = _current.get()
+        # Templates rendered from inside another (render_table, includes) are part of its time
+        if stats is None or stats.rendering:
+            return super().render(context, request)
+        stats.rendering = True
+        started = time.perf_counter()
+        try:
+            return super().render(context, request)
+        finally:
+            stats.template_time += time.perf_counter() - started
+            stats.rendering = False
+
+
+class TimedDjangoTemplates(DjangoTemplates):
+    """The Django template backend, with each render's time added to the request's stats."""
+
+    def from_string(self, template_code):
+        return TimedTemplate(super().from_string(template_code).template, self)
+
+    def get_template(self, template_name):
+        return TimedTemplate(super().get_template(template_name).template, self)
+
+
+def server_timing(stats, total):
+    return ', '.join([
+        f'db;desc="{stats.queries} queries";dur={stats.db_time * 1000:.1f}',
+        f'cache;desc="{stats.cache_hits} hits {stats.cache_misses} misses"',
+        f'template;dur={stats.template_time * 1000:.1f}',
+        f'total;dur={total * 1000:.1f}',
+    ])
+
+
+class QueryBudgetMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        stats = RequestStats()
+        token = _current.set(stats)
+        started = time.perf_counter()
+        try:
+            with ExitStack() as wrappers:
+                for connection in connections.all():
+                    wrappers.enter_context(connection.execute_wrapper(stats.execute))
+                response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        total = time.perf_counter() - started
+
+        view = request.resolver_match.view_name if request.resolver_match else None
+        budget = settings.QUERY_BUDGETS.get(view, settings.QUERY_BUDGET_DEFAULT)
+        record = {
+            'method': request.method,
+            'path': request.path,
+            'view': view,
+            'status': response.status_code,
+            'queries': stats.queries,
+            'db_ms': round(stats.db_time * 1000, 2),
+            'cache_hits': stats.cache_hits,
+            'cache_misses': stats.cache_misses,
+            'template_ms': round(stats.template_time * 1000, 2),
+            'total_ms': round(total * 1000, 2),
+            'budget': budget,
+        }
+        logger.info('request %s', json.dumps(record), extra={'request_stats': record})
+        if budget is not None and stats.queries > budget:
+            logger.warning(
+                'query budget exceeded: %s ran %d queries (budget %d); most repeated: %s',
+                view or request.path, stats.queries, budget, json.dumps(stats.repeated()),
+                extra={'request_stats': record},
+            )
+        if settings.SERVER_TIMING_HEADER:
+            response['Server-Timing'] = server_timing(stats, total)
+        return response
@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from bakery_app.management.models import Ingredient, IngredientPrice
+
+
+class Command(BaseCommand):
+    help = "Record the current price of every ingredient that has no price history yet."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=5000,
+            help="Number of history rows inserted per query.",
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options["batch_size"]
+        missing = (
+            Ingredient.objects.filter(price_history__isnull=True)
+            .order_by("pk")
+            .values_list("pk", "price_per_gram", "created_at")
+        )
+        created = 0
+        batch = []
+        with transaction.atomic():
+            # The current price is the only one known, so it is assumed to hold since the ingredient was created
+            for pk, price, created_at in missing.iterator(chunk_size=batch_size):
+                batch.append(IngredientPrice(ingredient_id=pk, price_per_gram=price, effective_at=created_at))
+                if len(batch) >= batch_size:
+                    created += len(IngredientPrice.objects.bulk_create(batch))
+                    batch = []
+            created += len(IngredientPrice.objects.bulk_create(batch))
+        self.stdout.write(self.style.SUCCESS(f"Recorded {created} ingredient price(s)."))
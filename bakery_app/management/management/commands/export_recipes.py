@@ -0,0 +1,30 @@
+import json
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from bakery_app.management import recipebook
+from bakery_app.management.models import Recipe
+
+
+class Command(BaseCommand):
+    help = "Write recipes, with their sub-recipes, ingredients, suppliers and products, as a JSON document."
+
+    def add_arguments(self, parser):
+        parser.add_argument("recipe_ids", nargs="*", type=int, help="Recipes to export; all of them if none are given.")
+        parser.add_argument("--output", "-o", default="-", help="File to write, or - for standard output.")
+
+    def handle(self, *args, **options):
+        recipes = Recipe.objects.all()
+        if options["recipe_ids"]:
+            recipes = recipes.filter(pk__in=options["recipe_ids"])
+            missing = set(options["recipe_ids"]) - set(recipes.values_list("pk", flat=True))
+            if missing:
+                raise CommandError(f"No recipe with id {', '.join(map(str, sorted(missing)))}.")
+        document = recipebook.export_recipes(recipes)
+        if options["output"] == "-":
+            json.dump(document, sys.stdout, separators=(",", ":"))
+            return
+        with open(options["output"], "w", encoding="utf-8") as output:
+            json.dump(document, output, separators=(",", ":"))
+        self.stderr.write(self.style.SUCCESS(f"Exported {len(document['recipes'])} recipe(s) to {options['output']}."))
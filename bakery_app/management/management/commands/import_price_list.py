@@ -0,0 +1,66 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Q
+
+from bakery_app.management import pricelists
+from bakery_app.management.models import Supplier
+
+
+class Command(BaseCommand):
+    help = "Update ingredient prices from a supplier's CSV price list, or report what would change with --dry-run."
+
+    def add_arguments(self, parser):
+        parser.add_argument("path", help="CSV file to import, or - for standard input.")
+        parser.add_argument(
+            "--supplier",
+            help="RUC or name of the supplier the list belongs to, for files without a ruc or supplier column.",
+        )
+        parser.add_argument("--dry-run", action="store_true", help="Report the changes without writing them.")
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=pricelists.BATCH_SIZE,
+            help="Number of rows written per query.",
+        )
+
+    def handle(self, *args, **options):
+        supplier = None
+        if options["supplier"]:
+            value = options["supplier"].strip()
+            matches = Supplier.objects.filter(Q(ruc=value) | Q(name__iexact=value)).values_list("pk", flat=True)[:2]
+            if len(matches) != 1:
+                raise CommandError(f"No single supplier has the RUC or name {value!r}.")
+            supplier = matches[0]
+
+        if options["path"] == "-":
+            report = self._import(sys.stdin, supplier, options)
+        else:
+            with open(options["path"], newline="", encoding="utf-8-sig") as lines:
+                report = self._import(lines, supplier, options)
+
+        if options["verbosity"] >= 2:
+            for entry in report.changes:
+                self.stdout.write(
+                    f"{entry['supplier']} / {entry['ingredient']}: {entry['old_price']} -> {entry['new_price']}"
+                )
+            for entry in report.created:
+                self.stdout.write(f"{entry['supplier']} / {entry['ingredient']}: new at {entry['new_price']}")
+        for line, message in report.errors:
+            self.stderr.write(f"Line {line}: {message}")
+        if not report.valid:
+            raise CommandError(f"{report.error_count} row(s) have errors; nothing was imported.")
+
+        summary = (
+            f"{report.rows} row(s): {len(report.changes)} price(s) changed, {report.unchanged} unchanged, "
+            f"{len(report.created)} new ingredient(s)"
+        )
+        if report.applied:
+            self.stdout.write(self.style.SUCCESS(f"Imported {summary}."))
+        else:
+            self.stdout.write(f"Dry run, nothing written. {summary}.")
+
+    def _import(self, lines, supplier, options):
+        return pricelists.import_price_list(
+            lines, supplier=supplier, dry_run=options["dry_run"], batch_size=options["batch_size"]
+        )
@@ -0,0 +1,44 @@
+import json
+import sys
+
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand, CommandError
+
+from bakery_app.management import recipebook
+
+
+class Command(BaseCommand):
+    help = "Create the recipes, ingredients, suppliers and products of a JSON document written by export_recipes."
+
+    def add_arguments(self, parser):
+        parser.add_argument("path", help="JSON file to import, or - for standard input.")
+        parser.add_argument("--dry-run", action="store_true", help="Validate the document without writing it.")
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=recipebook.BATCH_SIZE,
+            help="Number of suppliers and ingredients inserted per query.",
+        )
+
+    def handle(self, *args, **options):
+        try:
+            if options["path"] == "-":
+                document = json.load(sys.stdin)
+            else:
+                with open(options["path"], encoding="utf-8") as source:
+                    document = json.load(source)
+        except ValueError as error:
+            raise CommandError(f"Not a JSON document: {error}")
+
+        try:
+            imported = recipebook.import_recipes(document, dry_run=options["dry_run"], batch_size=options["batch_size"])
+        except ValidationError as error:
+            for message in error.messages:
+                self.stderr.write(message)
+            raise CommandError(f"{len(error.messages)} problem(s) found; nothing was imported.")
+
+        counts = ", ".join(f"{count} {name}" for name, count in imported.counts.items())
+        if options["dry_run"]:
+            self.stdout.write(f"Dry run, nothing written. Would create {counts}.")
+        else:
+            self.stdout.write(self.style.SUCCESS(f"Created {counts}."))
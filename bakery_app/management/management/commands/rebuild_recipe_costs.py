@@ -0,0 +1,42 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from bakery_app.management import costing
+from bakery_app.management.models import RecipeCost
+
+
+class Command(BaseCommand):
+    help = "Rebuild the RecipeCost cache and verify it against a fresh computation."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--check",
+            action="store_true",
+            help="Only verify the cache, without rebuilding it.",
+        )
+
+    def handle(self, *args, **options):
+        if not options["check"]:
+            with transaction.atomic():
+                written = RecipeCost.objects.rebuild()
+            self.stdout.write(f"Rebuilt {written} recipe cost(s).")
+
+        # The array engine rolls sub-recipes up from ingredient prices, independently of the cache
+        fresh = costing.compute(costing.load_catalog()).recipes()
+        cached = dict(RecipeCost.objects.values_list("recipe_id", "cost"))
+        # Dirty rows are expected to be stale until the next refresh
+        dirty = set(RecipeCost.objects.filter(is_dirty=True).values_list("recipe_id", flat=True))
+
+        mismatches = 0
+        for row in fresh:
+            pk, fresh_cost = row["id"], row["cost"]
+            if pk in dirty:
+                continue
+            cached_cost = cached.get(pk)
+            if cached_cost != fresh_cost:
+                mismatches += 1
+                self.stderr.write(f"Recipe {pk}: cached {cached_cost}, expected {fresh_cost}")
+
+        if mismatches:
+            raise CommandError(f"{mismatches} recipe cost(s) differ from a fresh computation ({len(dirty)} marked dirty).")
+        self.stdout.write(self.style.SUCCESS(f"Recipe cost cache verified ({len(dirty)} marked dirty)."))
@@ -0,0 +1,64 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from bakery_app.management import seeding
+
+
+class Command(BaseCommand):
+    help = "Fill the catalog with deterministic synthetic suppliers, ingredients, recipes, products and variations."
+
+    def add_arguments(self, parser):
+        defaults = seeding.Ratios()
+        parser.add_argument("--products", type=int, default=10000, help="Number of products to create.")
+        parser.add_argument("--seed", type=int, default=0, help="Random seed; the same seed writes the same catalog.")
+        parser.add_argument(
+            "--suppliers-per-product", type=float, default=defaults.suppliers, help="Suppliers per product."
+        )
+        parser.add_argument(
+            "--ingredients-per-product", type=float, default=defaults.ingredients, help="Ingredients per product."
+        )
+        parser.add_argument("--recipes-per-product", type=float, default=defaults.recipes, help="Recipes per product.")
+        parser.add_argument("--lines-per-recipe", type=int, default=defaults.lines, help="Ingredient lines per recipe.")
+        parser.add_argument(
+            "--variations-per-product",
+            type=int,
+            default=defaults.variations,
+            help="Variations per product, counting the main variation.",
+        )
+        parser.add_argument(
+            "--method",
+            choices=[seeding.COPY, seeding.BULK],
+            default=seeding.COPY,
+            help="Write with PostgreSQL COPY or with batched bulk_create().",
+        )
+        parser.add_argument(
+            "--batch-size", type=int, default=5000, help="Rows per INSERT when writing with bulk_create()."
+        )
+
+    def handle(self, *args, **options):
+        if options["products"] < 1:
+            raise CommandError("--products must be at least 1.")
+        ratios = seeding.Ratios(
+            suppliers=options["suppliers_per_product"],
+            ingredients=options["ingredients_per_product"],
+            recipes=options["recipes_per_product"],
+            lines=options["lines_per_recipe"],
+            variations=options["variations_per_product"],
+        )
+        started = time.perf_counter()
+        with transaction.atomic():
+            written = seeding.seed(
+                options["products"],
+                ratios,
+                seed=options["seed"],
+                method=options["method"],
+                batch_size=options["batch_size"],
+            )
+        elapsed = time.perf_counter() - started
+        for table, count in written.items():
+            self.stdout.write(f"{table}: {count}")
+        self.stdout.write(
+            self.style.SUCCESS(f"Wrote {sum(written.values())} row(s) in {elapsed:.1f}s with {options['method']}.")
+        )
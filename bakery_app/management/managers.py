@@ -0,0 +1,510 @@
+from decimal import Decimal
+
+from django.db import connections, models, transaction
+from django.db.models import Case, DecimalField, ExpressionWrapper, F, Func, OuterRef, Q, Subquery, Sum, Value, When
+from django.db.models.expressions import RawSQL
+from django.db.models.functions import Coalesce, NullIf
+
+
+class RoundHalfEven(Func):
+    """
+    round_half_even() SQL function (migration 0012), so annotated values agree with
+    Python's round(Decimal, 2) used by the model properties.
+    """
+
+    function = 'round_half_even'
+    output_field = DecimalField(max_digits=20, decimal_places=2)
+
+    def __init__(self, expression, places=2, **extra):
+        super().__init__(expression, Value(places), **extra)
+
+
+def money(expression):
+    return ExpressionWrapper(expression, output_field=DecimalField(max_digits=20, decimal_places=4))
+
+
+def sub_recipe_line_cost(quantity, cost, weight):
+    """Cost of ``quantity`` grams of a sub-recipe, priced per gram from its batch cost and weight."""
+    return RoundHalfEven(
+        money(quantity * cost / NullIf(weight, Value(Decimal('0')))),
+        places=4,
+        output_field=DecimalField(max_digits=20, decimal_places=4),
+    )
+
+
+class RecipeBatchCost(Func):
+    """
+    Cost of one batch of the recipe whose id is the argument: its RecipeCost row when that is
+    fresh, otherwise priced live, sub-recipes included (recipe_batch_cost(), migration 0020).
+    """
+
+    function = 'recipe_batch_cost'
+    output_field = DecimalField(max_digits=20, decimal_places=2)
+
+
+def recipe_cost(recipe_ref):
+    """
+    Rounded cost of the recipe referenced by ``recipe_ref``, as a correlated subquery. Sub-recipe
+    lines are priced per gram from the sub-recipe's batch cost, read from its RecipeCost row only
+    while that is fresh, and its live batch weight.
+    """
+    from .models import RecipeIngredient
+
+    cost = (
+        RecipeIngredient.objects.filter(recipe=recipe_ref)
+        .order_by()
+        .values('recipe')
+        .annotate(
+            cost=Coalesce(Sum(money(F('quantity_in_grams') * F('ingredient__price_per_gram'))), Value(Decimal('0')))
+            + Coalesce(
+                Sum(
+                    sub_recipe_line_cost(
+                        F('quantity_in_grams'), RecipeBatchCost('sub_recipe'), recipe_weight(OuterRef('sub_recipe'))
+                    )
+                ),
+                Value(Decimal('0')),
+            )
+        )
+        .values('cost')
+    )
+    return RoundHalfEven(Coalesce(Subquery(cost), Value(Decimal('0.00'))))
+
+
+def recipe_weight(recipe_ref):
+    """Grams per batch of the recipe referenced by ``recipe_ref``: the sum of its line quantities."""
+    from .models import RecipeIngredient
+
+    weight = (
+        RecipeIngredient.objects.filter(recipe=recipe_ref)
+        .order_by()
+        .values('recipe')
+        .annotate(weight=Sum('quantity_in_grams'))
+        .values('weight')
+    )
+    return Coalesce(Subquery(weight), Value(Decimal('0.00')))
+
+
+ANCESTOR_STEP = 'SELECT ri.recipe_id FROM {lines} ri JOIN closure c ON ri.sub_recipe_id = c.id'
+MAX_SUB_RECIPE_DEPTH = 100
+
+
+class IngredientCost(Func):
+    """
+    Cost of ``ingredient`` in one batch of the recipe whose id is ``recipe``, counting what reaches
+    it through sub-recipes: each sub-recipe line brings its quantity over the sub-recipe's batch
+    weight of whatever the sub-recipe uses. Priced live from the lines and current prices.
+    """
+
+    output_field = DecimalField(max_digits=20, decimal_places=4)
+
+    def __init__(self, recipe, ingredient, **extra):
+        super().__init__(recipe, **extra)
+        self.ingredient = getattr(ingredient, 'pk', ingredient)
+
+    def as_sql(self, compiler, connection, **extra_context):
+        from .models import Ingredient, RecipeIngredient
+
+        recipe, params = compiler.compile(self.source_expressions[0])
+        quote = connection.ops.quote_name
+        lines = quote(RecipeIngredient._meta.db_table)
+        sql = f"""(
+            WITH RECURSIVE tree(recipe_id, factor, depth) AS (
+                SELECT {recipe}, 1::numeric, 0
+                UNION ALL
+                SELECT ri.sub_recipe_id,
+                       tree.factor * ri.quantity_in_grams
+                       / NULLIF(
+                           (SELECT SUM(w.quantity_in_grams) FROM {lines} w WHERE w.recipe_id = ri.sub_recipe_id), 0
+                       ),
+                       tree.depth + 1
+                FROM tree JOIN {lines} ri ON ri.recipe_id = tree.recipe_id
+                WHERE ri.sub_recipe_id IS NOT NULL AND tree.depth < %s
+            )
+            SELECT round_half_even(SUM(tree.factor * ri.quantity_in_grams * i.price_per_gram), 4)
+            FROM tree
+            JOIN {lines} ri ON ri.recipe_id = tree.recipe_id
+            JOIN {quote(Ingredient._meta.db_table)} i ON i.id = ri.ingredient_id
+            WHERE ri.ingredient_id = %s
+        )"""
+        return sql, [*params, MAX_SUB_RECIPE_DEPTH, self.ingredient]
+
+
+class RecipeQuerySet(models.QuerySet):
+    def ancestor_ids(self, recipe_ids):
+        """``recipe_ids`` plus every recipe that uses one of them, directly or through sub-recipes."""
+        return self._closure(recipe_ids, ANCESTOR_STEP)
+
+    def descendant_ids(self, recipe_ids):
+        """``recipe_ids`` plus every sub-recipe they use, directly or indirectly."""
+        return self._closure(
+            recipe_ids,
+            'SELECT ri.sub_recipe_id FROM {lines} ri JOIN closure c ON ri.recipe_id = c.id '
+            'WHERE ri.sub_recipe_id IS NOT NULL',
+        )
+
+    def ancestor_ids_query(self, recipe_ids):
+        """ancestor_ids() as a subquery, for ``__in`` filters that should not run a query of their own."""
+        return RawSQL(*self._closure_sql(recipe_ids, ANCESTOR_STEP))
+
+    def _closure(self, recipe_ids, step):
+        with connections[self.db].cursor() as cursor:
+            cursor.execute(*self._closure_sql(recipe_ids, step))
+            return {row[0] for row in cursor.fetchall()}
+
+    def _closure_sql(self, recipe_ids, step):
+        # UNION (not UNION ALL) drops revisited recipes, so shared sub-recipes are walked once and
+        # a cycle written by a bulk insert cannot recurse forever
+        from .models import RecipeIngredient
+
+        if isinstance(recipe_ids, models.QuerySet):
+            seed, params = recipe_ids.query.sql_with_params()
+        else:
+            seed, params = 'SELECT unnest(%s::bigint[])', [list(recipe_ids)]
+        lines = connections[self.db].ops.quote_name(RecipeIngredient._meta.db_table)
+        sql = f"WITH RECURSIVE closure(id) AS (({seed}) UNION {step.format(lines=lines)}) SELECT id FROM closure"
+        return sql, params
+
+
+RecipeManager = models.Manager.from_queryset(RecipeQuerySet)
+
+
+def cached_recipe_cost(recipe):
+    """
+    Cost of the recipe at lookup path ``recipe``: the RecipeCost row when it is fresh,
+    otherwise a correlated aggregate over its ingredients.
+    """
+    return Case(
+        When(**{f'{recipe}__cost_cache__is_dirty': False}, then=F(f'{recipe}__cost_cache__cost')),
+        default=recipe_cost(OuterRef(recipe)),
+        output_field=DecimalField(max_digits=20, decimal_places=2),
+    )
+
+
+class ProductQuerySet(models.QuerySet):
+    def with_costing(self):
+        """
+        Annotate total_cost, profit and margin_percentage.
+        total_cost comes from the RecipeCost cache and is only recomputed for recipes whose
+        cache row is dirty or missing. Values match Product.calculate_cost / calculate_profit /
+        calculate_margin; margin_percentage is NULL when the sale price is zero.
+        """
+        return self.annotate(
+            total_cost=cached_recipe_cost('recipe'),
+        ).annotate(
+            # Both operands already have two decimal places, so no rounding is needed
+            profit=ExpressionWrapper(
+                F('sale_price') - F('total_cost'), output_field=DecimalField(max_digits=20, decimal_places=2)
+            ),
+        ).annotate(
+            margin_percentage=RoundHalfEven(money(F('profit') / NullIf(F('sale_price'), Value(Decimal('0'))) * 100)),
+        )
+
+    def shapes(self):
+        """
+        ``{pk: {'shape', 'diameter', 'length', 'width'}}`` for the products, from their recipes in one
+        query. The dimensions are the recipe's, which a product's main variation starts from.
+        """
+        rows = self.order_by().values_list(
+            'pk', 'recipe__shape', 'recipe__diameter', 'recipe__length', 'recipe__width'
+        )
+        return {
+            pk: {'shape': shape, 'diameter': diameter, 'length': length, 'width': width}
+            for pk, shape, diameter, length, width in rows
+        }
+
+    def using_ingredient(self, ingredient):
+        """
+        Products whose recipe uses ``ingredient``, directly or through sub-recipes, annotated with
+        ingredient_cost, ingredient_share and cost_change_per_percent (the cost change for a 1%
+        move in the ingredient's price).
+        """
+        return self.filter(recipe__in=recipes_using(ingredient)).annotate(
+            ingredient_cost=IngredientCost('recipe', ingredient),
+        ).annotate(
+            ingredient_share=cost_share(F('ingredient_cost'), cached_recipe_cost('recipe')),
+            cost_change_per_percent=money(F('ingredient_cost') / 100),
+        )
+
+
+ProductManager = models.Manager.from_queryset(ProductQuerySet)
+
+
+def surface_area():
+    """SQL counterpart of ProductVariation.calculate_surface_area()."""
+    from .models import pi
+
+    return Case(
+        When(
+            Q(product__recipe__shape='C', diameter__isnull=False) & ~Q(diameter=0),
+            then=RoundHalfEven(Value(pi) * (F('diameter') / 2) * (F('diameter') / 2)),
+        ),
+        When(
+            Q(product__recipe__shape='R', length__isnull=False, width__isnull=False) & ~Q(length=0) & ~Q(width=0),
+            then=RoundHalfEven(F('length') * F('width')),
+        ),
+        default=Value(Decimal('0.00')),
+        output_field=DecimalField(max_digits=20, decimal_places=2),
+    )
+
+
+class ProductVariationQuerySet(models.QuerySet):
+    def with_area_factor(self):
+        """
+        Annotate surface_area, main_surface_area and area_factor, matching calculate_surface_area() and
+        adjustment_factor(). The main variation is looked up per product with a correlated subquery.
+        """
+        main_variation = self.model.objects.filter(product=OuterRef('product'), main_variation=True).order_by('pk')
+        return self.annotate(
+            surface_area=surface_area(),
+            main_variation_id=Subquery(main_variation.values('pk')[:1]),
+            main_surface_area=Subquery(main_variation.annotate(area=surface_area()).values('area')[:1]),
+        ).annotate(
+            area_factor=Case(
+                When(
+                    Q(main_surface_area__gt=0) & ~Q(pk=F('main_variation_id')),
+                    then=RoundHalfEven(money(F('surface_area') / F('main_surface_area'))),
+                ),
+                default=Value(Decimal('1.00')),
+                output_field=DecimalField(max_digits=20, decimal_places=2),
+            ),
+        )
+
+    def with_adjusted_costing(self):
+        """
+        with_area_factor() plus variation_cost, variation_profit and variation_margin, matching the
+        adjusted_* properties.
+        """
+        two_places = DecimalField(max_digits=20, decimal_places=2)
+        return self.with_area_factor().annotate(
+            variation_cost=RoundHalfEven(money(cached_recipe_cost('product__recipe') * F('area_factor'))),
+        ).annotate(
+            variation_profit=ExpressionWrapper(
+                F('product__sale_price') - F('variation_cost'), output_field=two_places
+            ),
+        ).annotate(
+            variation_margin=Case(
+                When(
+                    product__sale_price__gt=0,
+                    then=RoundHalfEven(money(F('variation_profit') / F('product__sale_price') * 100)),
+                ),
+                default=Value(Decimal('0')),
+                output_field=two_places,
+            ),
+        )
+
+    def using_ingredient(self, ingredient):
+        return self.filter(product__recipe__in=recipes_using(ingredient))
+
+
+ProductVariationManager = models.Manager.from_queryset(ProductVariationQuerySet)
+
+
+class RecipeIngredientQuerySet(models.QuerySet):
+    def for_ingredient(self, ingredient):
+        """
+        Recipe lines using ``ingredient``, or a sub-recipe that uses it, annotated with
+        ingredient_cost (what the ingredient costs in the line) and ingredient_share (of the recipe
+        cost), heaviest share first.
+        """
+        # A sub-recipe line brings its quantity over the sub-recipe's batch weight of what the sub-recipe uses
+        through_sub_recipe = money(
+            F('quantity_in_grams') * IngredientCost('sub_recipe', ingredient)
+            / NullIf(recipe_weight(OuterRef('sub_recipe')), Value(Decimal('0')))
+        )
+        return (
+            self.filter(Q(ingredient=ingredient) | Q(sub_recipe__in=recipes_using(ingredient)))
+            .annotate(
+                ingredient_cost=Case(
+                    When(ingredient=ingredient, then=money(F('quantity_in_grams') * F('ingredient__price_per_gram'))),
+                    default=RoundHalfEven(through_sub_recipe, places=4),
+                    output_field=DecimalField(max_digits=20, decimal_places=4),
+                ),
+            )
+            .annotate(ingredient_share=cost_share(F('ingredient_cost'), cached_recipe_cost('recipe')))
+            .select_related('recipe', 'sub_recipe')
+            .order_by(F('ingredient_share').desc(nulls_last=True))
+        )
+
+
+RecipeIngredientManager = models.Manager.from_queryset(RecipeIngredientQuerySet)
+
+
+def recipes_using(ingredient):
+    """Ids of the recipes using ``ingredient``, directly or through sub-recipes, as a subquery."""
+    from .models import Recipe, RecipeIngredient
+
+    return Recipe.objects.ancestor_ids_query(RecipeIngredient.objects.filter(ingredient=ingredient).values('recipe'))
+
+
+def cost_share(part, total):
+    return RoundHalfEven(money(part / NullIf(total, Value(Decimal('0')))), places=6)
+
+
+class IngredientPriceQuerySet(models.QuerySet):
+    def as_of(self, timestamp):
+        """The price row in effect for each ingredient at ``timestamp``, via DISTINCT ON (ingredient_id)."""
+        return (
+            self.filter(effective_at__lte=timestamp)
+            .order_by('ingredient_id', '-effective_at')
+            .distinct('ingredient_id')
+        )
+
+    def price_at(self, timestamp, ingredient=OuterRef('pk')):
+        """
+        Correlated subquery for the price of ``ingredient`` at ``timestamp``. Each lookup is a single
+        backward scan of the (ingredient, effective_at) index, so it beats DISTINCT ON when the
+        history is long.
+        """
+        return Subquery(
+            self.filter(ingredient=ingredient, effective_at__lte=timestamp)
+            .order_by('-effective_at')
+            .values('price_per_gram')[:1]
+        )
+
+
+IngredientPriceManager = models.Manager.from_queryset(IngredientPriceQuerySet)
+
+
+class ProductionPlanLineQuerySet(models.QuerySet):
+    def recipe_batches(self):
+        """
+        Recipe batches needed for these lines, one row per recipe: the sum of each line's quantity
+        times its variation's area factor.
+        """
+        from .models import ProductVariation
+
+        area_factor = (
+            ProductVariation.objects.with_area_factor().filter(pk=OuterRef('variation_id')).values('area_factor')[:1]
+        )
+        return (
+            self.annotate(area_factor=Subquery(area_factor))
+            .order_by()
+            .values(recipe_id=F('variation__product__recipe'))
+            .annotate(batches=Sum(money(F('quantity') * F('area_factor'))))
+        )
+
+    def ingredient_demand(self):
+        """
+        Grams and cost of every ingredient needed for these lines, one row per (supplier, ingredient),
+        in a single query. The area factor is evaluated once per line in the recipe_batches() CTE,
+        not once per line and ingredient as a plain join would. Sub-recipes are exploded recursively
+        into their own ingredients, scaled by the grams used over the sub-recipe's live batch weight.
+        """
+        from .models import Ingredient, RecipeIngredient, Supplier
+
+        batches_sql, params = self.recipe_batches().query.sql_with_params()
+        connection = connections[self.db]
+        quote = connection.ops.quote_name
+        lines = quote(RecipeIngredient._meta.db_table)
+        sql = f"""
+            WITH RECURSIVE batches(recipe_id, batches, depth) AS (
+                SELECT plan.recipe_id, plan.batches, 0 FROM ({batches_sql}) plan
+                UNION ALL
+                SELECT ri.sub_recipe_id,
+                       b.batches * ri.quantity_in_grams
+                       / (SELECT SUM(w.quantity_in_grams) FROM {lines} w WHERE w.recipe_id = ri.sub_recipe_id),
+                       b.depth + 1
+                FROM batches b
+                JOIN {lines} ri ON ri.recipe_id = b.recipe_id
+                WHERE ri.sub_recipe_id IS NOT NULL AND b.depth < %s
+            )
+            SELECT i.supplier_id, s.name, i.id, i.name,
+                   round_half_even(SUM(ri.quantity_in_grams * b.batches), 2),
+                   round_half_even(SUM(ri.quantity_in_grams * b.batches * i.price_per_gram), 2)
+            FROM batches b
+            JOIN {lines} ri ON ri.recipe_id = b.recipe_id
+            JOIN {quote(Ingredient._meta.db_table)} i ON i.id = ri.ingredient_id
+            LEFT JOIN {quote(Supplier._meta.db_table)} s ON s.id = i.supplier_id
+            GROUP BY i.supplier_id, s.name, i.id, i.name
+            ORDER BY s.name NULLS LAST, i.supplier_id, i.name, i.id
+        """
+        fields = ('supplier_id', 'supplier_name', 'ingredient_id', 'ingredient_name', 'grams', 'cost')
+        with connection.cursor() as cursor:
+            # The depth limit only matters for a cycle written without validation
+            cursor.execute(sql, [*params, MAX_SUB_RECIPE_DEPTH])
+            return [dict(zip(fields, row)) for row in cursor.fetchall()]
+
+
+ProductionPlanLineManager = models.Manager.from_queryset(ProductionPlanLineQuerySet)
+
+
+def refresh_recipe_costs():
+    from .models import RecipeCost
+
+    RecipeCost.objects.refresh_dirty()
+
+
+class RecipeCostQuerySet(models.QuerySet):
+    def mark_dirty(self, recipe_ids):
+        """
+        Flag the cached cost of ``recipe_ids`` (ids or a values() queryset), and of every recipe using
+        them as a sub-recipe, as stale and recompute every stale row in bulk once the current
+        transaction commits.
+        """
+        from .models import Recipe
+
+        recipe_ids = Recipe.objects.using(self.db).ancestor_ids(recipe_ids)
+        self.filter(recipe_id__in=recipe_ids, is_dirty=False).update(is_dirty=True)
+        connection = connections[self.db]
+        # One refresh per transaction is enough, however many rows were marked dirty
+        if not any(entry[1] is refresh_recipe_costs for entry in connection.run_on_commit):
+            transaction.on_commit(refresh_recipe_costs, using=self.db)
+
+    def refresh_dirty(self):
+        """Recompute dirty rows and create rows for recipes that have none. Returns the number of rows written."""
+        return self._recompute(self.filter(is_dirty=True))
+
+    def rebuild(self):
+        """Recompute every cached cost from scratch."""
+        return self._recompute(self.all())
+
+    def _recompute(self, queryset):
+        from .models import Recipe
+
+        # Recipes created through bulk_create() skip the post_save handler and have no row yet
+        missing = Recipe.objects.filter(cost_cache__isnull=True).values_list('pk', flat=True)
+        self.bulk_create([self.model(recipe_id=pk, is_dirty=True) for pk in missing], ignore_conflicts=True)
+        recipe_ids = list(queryset.values_list('recipe_id', flat=True))
+        written = 0
+        # Sub-recipes are costed before the recipes using them, each exactly once, one level per UPDATE
+        for level in self._dependency_levels(recipe_ids):
+            written += self.filter(recipe_id__in=level).update(
+                cost=recipe_cost(OuterRef('recipe_id')), weight=recipe_weight(OuterRef('recipe_id')), is_dirty=False
+            )
+        return written
+
+    def _dependency_levels(self, recipe_ids):
+        """Split ``recipe_ids`` into levels whose sub-recipes among ``recipe_ids`` all sit in earlier levels."""
+        from .models import RecipeIngredient
+
+        pending = set(recipe_ids)
+        if not pending:
+            return []
+        edges = RecipeIngredient.objects.filter(recipe_id__in=pending, sub_recipe_id__in=pending).values_list(
+            'recipe_id', 'sub_recipe_id'
+        )
+        waiting_on = {}
+        parents = {}
+        for recipe_id, sub_recipe_id in edges.distinct():
+            if recipe_id != sub_recipe_id:
+                waiting_on[recipe_id] = waiting_on.get(recipe_id, 0) + 1
+                parents.setdefault(sub_recipe_id, []).append(recipe_id)
+        levels = []
+        level = [pk for pk in pending if pk not in waiting_on]
+        while level:
+            levels.append(level)
+            pending.difference_update(level)
+            next_level = []
+            for sub_recipe_id in level:
+                for recipe_id in parents.get(sub_recipe_id, ()):
+                    waiting_on[recipe_id] -= 1
+                    if not waiting_on[recipe_id]:
+                        next_level.append(recipe_id)
+            level = next_level
+        if pending:
+            # Only reachable through a cycle written without validation; cost what is left once
+            levels.append(list(pending))
+        return levels
+
+
+RecipeCostManager = models.Manager.from_queryset(RecipeCostQuerySet)
@@ -0,0 +1,30 @@
+from django.db import migrations
+
+
+# Banker's rounding, matching Python's round(Decimal, places) used by the costing properties.
+# PostgreSQL's ROUND() rounds half away from zero.
+CREATE_ROUND_HALF_EVEN = """
+CREATE OR REPLACE FUNCTION round_half_even(value numeric, places integer) RETURNS numeric AS $$
+    SELECT round(
+        CASE
+            WHEN abs(value * power(10::numeric, places) - trunc(value * power(10::numeric, places))) = 0.5
+            THEN (trunc(value * power(10::numeric, places)) + mod(trunc(value * power(10::numeric, places)), 2))
+                 / power(10::numeric, places)
+            ELSE value
+        END,
+        places
+    )
+$$ LANGUAGE SQL IMMUTABLE STRICT PARALLEL SAFE;
+"""
+
+DROP_ROUND_HALF_EVEN = "DROP FUNCTION IF EXISTS round_half_even(numeric, integer);"
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("management", "0011_alter_product_recipe"),
+    ]
+
+    operations = [
+        migrations.RunSQL(CREATE_ROUND_HALF_EVEN, DROP_ROUND_HALF_EVEN),
+    ]
@@ -0,0 +1,49 @@
+# Generated by Django 4.2.9 on 2026-10-18 11:55
+
+from decimal import Decimal
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+POPULATE_RECIPE_COSTS = """
+INSERT INTO management_recipecost (recipe_id, cost, is_dirty, updated_at)
+SELECT r.id, round_half_even(COALESCE(SUM(ri.quantity_in_grams * i.price_per_gram), 0), 2), false, now()
+FROM management_recipe r
+LEFT JOIN management_recipeingredient ri ON ri.recipe_id = r.id
+LEFT JOIN management_ingredient i ON i.id = ri.ingredient_id
+GROUP BY r.id;
+"""
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("management", "0012_round_half_even_function"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="RecipeCost",
+            fields=[
+                (
+                    "recipe",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        primary_key=True,
+                        related_name="cost_cache",
+                        serialize=False,
+                        to="management.recipe",
+                    ),
+                ),
+                ("cost", models.DecimalField(decimal_places=2, default=Decimal("0.00"), max_digits=12)),
+                ("is_dirty", models.BooleanField(default=False)),
+                ("updated_at", models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                "indexes": [
+                    models.Index(
+                        condition=models.Q(("is_dirty", True)), fields=["recipe"], name="recipecost_dirty_idx"
+                    )
+                ],
+            },
+        ),
+        migrations.RunSQL(POPULATE_RECIPE_COSTS, migrations.RunSQL.noop),
+    ]
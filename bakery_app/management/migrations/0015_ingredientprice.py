@@ -0,0 +1,33 @@
+# Generated by Django 4.2.9 on 2026-10-18 12:05
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("management", "0013_recipecost"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="IngredientPrice",
+            fields=[
+                ("id", models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                ("price_per_gram", models.DecimalField(decimal_places=2, max_digits=10)),
+                ("effective_at", models.DateTimeField(default=django.utils.timezone.now)),
+                (
+                    "ingredient",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="price_history",
+                        to="management.ingredient",
+                    ),
+                ),
+            ],
+            options={
+                "indexes": [models.Index(fields=["ingredient", "effective_at"], name="ingredientprice_asof_idx")],
+            },
+        ),
+    ]
@@ -0,0 +1,51 @@
+# Generated by Django 4.2.9 on 2026-10-18 12:16
+
+from decimal import Decimal
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+POPULATE_RECIPE_WEIGHTS = """
+UPDATE management_recipecost rc
+SET weight = COALESCE((SELECT SUM(ri.quantity_in_grams) FROM management_recipeingredient ri WHERE ri.recipe_id = rc.recipe_id), 0);
+"""
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("management", "0016_productionplan"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="recipecost",
+            name="weight",
+            field=models.DecimalField(decimal_places=2, default=Decimal("0.00"), max_digits=14),
+        ),
+        migrations.AddField(
+            model_name="recipeingredient",
+            name="sub_recipe",
+            field=models.ForeignKey(
+                blank=True,
+                null=True,
+                on_delete=django.db.models.deletion.PROTECT,
+                related_name="used_in",
+                to="management.recipe",
+            ),
+        ),
+        migrations.AlterField(
+            model_name="recipeingredient",
+            name="ingredient",
+            field=models.ForeignKey(
+                blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to="management.ingredient"
+            ),
+        ),
+        migrations.AddConstraint(
+            model_name="recipeingredient",
+            constraint=models.CheckConstraint(
+                check=models.Q(("ingredient__isnull", True), ("sub_recipe__isnull", True), _connector="OR"),
+                name="recipeingredient_single_component",
+            ),
+        ),
+        migrations.RunSQL(POPULATE_RECIPE_WEIGHTS, migrations.RunSQL.noop),
+    ]
@@ -0,0 +1,49 @@
+# Generated by Django 4.2.9 on 2026-10-18 13:00
+
+import django.contrib.postgres.indexes
+from django.db import migrations
+
+
+TRIGRAM_INDEXES = [
+    ('ingredient', django.contrib.postgres.indexes.GinIndex(fields=['name'], name='ingredient_name_trgm', opclasses=['gin_trgm_ops'])),
+    ('product', django.contrib.postgres.indexes.GinIndex(fields=['product_type'], name='product_type_trgm', opclasses=['gin_trgm_ops'])),
+    ('recipe', django.contrib.postgres.indexes.GinIndex(fields=['name'], name='recipe_name_trgm', opclasses=['gin_trgm_ops'])),
+    ('supplier', django.contrib.postgres.indexes.GinIndex(fields=['name'], name='supplier_name_trgm', opclasses=['gin_trgm_ops'])),
+    ('supplier', django.contrib.postgres.indexes.GinIndex(fields=['ruc'], name='supplier_ruc_trgm', opclasses=['gin_trgm_ops'])),
+]
+
+
+def trigram_installable(schema_editor):
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute("SELECT 1 FROM pg_available_extensions WHERE name = 'pg_trgm'")
+        return cursor.fetchone() is not None
+
+
+def create_trigram_indexes(apps, schema_editor):
+    # pg_trgm ships with contrib, which not every server has; search falls back to icontains without it
+    if not trigram_installable(schema_editor):
+        return
+    schema_editor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    for model_name, index in TRIGRAM_INDEXES:
+        schema_editor.add_index(apps.get_model('management', model_name), index)
+
+
+def drop_trigram_indexes(apps, schema_editor):
+    for model_name, index in TRIGRAM_INDEXES:
+        schema_editor.execute(f'DROP INDEX IF EXISTS {schema_editor.quote_name(index.name)}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('management', '0017_sub_recipes'),
+    ]
+
+    operations = [
+        migrations.SeparateDatabaseAndState(
+            database_operations=[migrations.RunPython(create_trigram_indexes, drop_trigram_indexes)],
+            state_operations=[
+                migrations.AddIndex(model_name=model_name, index=index) for model_name, index in TRIGRAM_INDEXES
+            ],
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 4.2.9 on 2026-10-18 13:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("management", "0018_trigram_search"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="ingredient",
+            index=models.Index(fields=["name", "id"], name="ingredient_name_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="product",
+            index=models.Index(fields=["product_type", "id"], name="product_type_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="recipe",
+            index=models.Index(fields=["name", "id"], name="recipe_name_idx"),
+        ),
+    ]
@@ -0,0 +1,48 @@
+from django.db import migrations
+
+
+# Cost of one batch of a recipe: its RecipeCost row when that is fresh, otherwise priced live
+# from its lines, sub-recipes included, with the rounding of managers.recipe_cost(). A sub-recipe
+# is priced per gram of its live batch weight, so a row that is dirty or not written yet is never
+# read. The depth limit only matters for a cycle written without validation.
+CREATE_RECIPE_BATCH_COST = """
+CREATE OR REPLACE FUNCTION recipe_batch_cost(recipe bigint, depth integer DEFAULT 0) RETURNS numeric AS $$
+DECLARE
+    cached numeric;
+BEGIN
+    SELECT cost INTO cached FROM management_recipecost WHERE recipe_id = recipe AND NOT is_dirty;
+    IF FOUND THEN
+        RETURN cached;
+    END IF;
+    IF depth > 100 THEN
+        RETURN NULL;
+    END IF;
+    RETURN (
+        SELECT round_half_even(
+            COALESCE(SUM(ri.quantity_in_grams * i.price_per_gram), 0)
+            + COALESCE(SUM(round_half_even(
+                ri.quantity_in_grams * recipe_batch_cost(ri.sub_recipe_id, depth + 1)
+                / NULLIF((SELECT SUM(w.quantity_in_grams) FROM management_recipeingredient w WHERE w.recipe_id = ri.sub_recipe_id), 0),
+                4
+            )), 0),
+            2
+        )
+        FROM management_recipeingredient ri
+        LEFT JOIN management_ingredient i ON i.id = ri.ingredient_id
+        WHERE ri.recipe_id = recipe
+    );
+END
+$$ LANGUAGE plpgsql STABLE STRICT;
+"""
+
+DROP_RECIPE_BATCH_COST = "DROP FUNCTION IF EXISTS recipe_batch_cost(bigint, integer);"
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("management", "0019_typeahead_indexes"),
+    ]
+
+    operations = [
+        migrations.RunSQL(CREATE_RECIPE_BATCH_COST, DROP_RECIPE_BATCH_COST),
+    ]
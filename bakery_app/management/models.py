@@ -1,14 +1,21 @@
 from django.db import models
 from django.conf import settings
+from django.contrib.postgres.indexes import GinIndex
 from django.core.validators import MinValueValidator, EmailValidator, RegexValidator
 from django.core.exceptions import ValidationError
 from django.contrib.auth.models import User
-from django.db.models import Sum, F, DecimalField
+from django.db.models import Sum, F, DecimalField, OuterRef
 from decimal import Decimal
 from django.utils.timezone import now
+from datetime import date
 from math import pi as math_pi
 import uuid
 
+from .managers import (
+    IngredientPriceManager, ProductionPlanLineManager, ProductManager, ProductVariationManager, RecipeBatchCost,
+    RecipeCostManager, RecipeIngredientManager, RecipeManager, recipe_weight,
+)
+
 
 pi = Decimal(math_pi)
 
@@ -41,17 +48,73 @@ class Supplier(AuditModel):
     address = models.TextField()
     id = models.CharField(max_length=100, default=uuid.uuid4, unique=True, primary_key=True, editable=False)
 
+    class Meta:
+        # Trigram indexes for management.search; created only where pg_trgm is available (migration 0018)
+        indexes = [
+            GinIndex(fields=['name'], name='supplier_name_trgm', opclasses=['gin_trgm_ops']),
+            GinIndex(fields=['ruc'], name='supplier_ruc_trgm', opclasses=['gin_trgm_ops']),
+        ]
+
     def __str__(self):
         return self.name
 
-class Ingredient(AuditModel):
+class LoadedValuesMixin:
+    """Remember the values an instance was loaded with, so signal handlers can tell what changed."""
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_values = dict(zip(field_names, values))
+        return instance
+
+    def loaded_value(self, attname):
+        return getattr(self, '_loaded_values', {}).get(attname)
+
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        # Later saves of the same instance compare against what was just written
+        self._loaded_values = {field.attname: getattr(self, field.attname) for field in self._meta.concrete_fields}
+
+
+class Ingredient(LoadedValuesMixin, AuditModel):
     name = models.CharField(max_length=255)
     supplier = models.ForeignKey(Supplier, on_delete=models.CASCADE, null=True)
     price_per_gram = models.DecimalField(max_digits=10, decimal_places=2, validators=[MinValueValidator(Decimal('0.01'))])
 
+    class Meta:
+        indexes = [
+            GinIndex(fields=['name'], name='ingredient_name_trgm', opclasses=['gin_trgm_ops']),
+            # Typeahead options are browsed in (name, pk) order
+            models.Index(fields=['name', 'id'], name='ingredient_name_idx'),
+        ]
+
     def __str__(self):
         return self.name[:50]
 
+class IngredientPrice(models.Model):
+    """
+    Append-only history of Ingredient.price_per_gram. A row is written by the signal handler in
+    management.signals whenever the price changes; bulk price writes must append rows themselves.
+    """
+    ingredient = models.ForeignKey(Ingredient, on_delete=models.CASCADE, related_name='price_history')
+    price_per_gram = models.DecimalField(max_digits=10, decimal_places=2)
+    effective_at = models.DateTimeField(default=now)
+
+    objects = IngredientPriceManager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['ingredient', 'effective_at'], name='ingredientprice_asof_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.ingredient_id}: {self.price_per_gram} from {self.effective_at:%Y-%m-%d %H:%M}"
+
+    def save(self, *args, **kwargs):
+        if not self._state.adding:
+            raise ValidationError("Price history is append-only.")
+        super().save(*args, **kwargs)
+
 class Recipe(models.Model):
     SHAPE_CHOICES = [
         ('C', 'Circular'),
@@ -63,7 +126,15 @@ class Recipe(models.Model):
     diameter = models.DecimalField(max_digits=5, decimal_places=2, blank=True, null=True)
     length = models.DecimalField(max_digits=5, decimal_places=2, blank=True, null=True)
     width = models.DecimalField(max_digits=5, decimal_places=2, blank=True, null=True)
-    ingredients = models.ManyToManyField('Ingredient', through='RecipeIngredient')
+    ingredients = models.ManyToManyField('Ingredient', through='RecipeIngredient', through_fields=('recipe', 'ingredient'))
+
+    objects = RecipeManager()
+
+    class Meta:
+        indexes = [
+            GinIndex(fields=['name'], name='recipe_name_trgm', opclasses=['gin_trgm_ops']),
+            models.Index(fields=['name', 'id'], name='recipe_name_idx'),
+        ]
 
     def __str__(self):
         return self.name
@@ -78,16 +149,33 @@ class Recipe(models.Model):
         )
 
 
-class RecipeIngredient(AuditModel):
+CYCLE_MESSAGE = "A recipe cannot contain itself, directly or through its sub-recipes."
+
+
+class RecipeIngredient(LoadedValuesMixin, AuditModel):
     recipe = models.ForeignKey(Recipe, on_delete=models.CASCADE)
-    ingredient = models.ForeignKey(Ingredient, on_delete=models.CASCADE, null=True)
+    ingredient = models.ForeignKey(Ingredient, on_delete=models.CASCADE, null=True, blank=True)
+    # A line uses either an ingredient or another recipe (dough, cream, glaze...) as its component
+    sub_recipe = models.ForeignKey(Recipe, on_delete=models.PROTECT, null=True, blank=True, related_name='used_in')
     quantity_in_grams = models.DecimalField(max_digits=10, decimal_places=2, validators=[MinValueValidator(Decimal('0.01'))])
 
+    objects = RecipeIngredientManager()
+
+    class Meta:
+        constraints = [
+            models.CheckConstraint(
+                check=models.Q(ingredient__isnull=True) | models.Q(sub_recipe__isnull=True),
+                name='recipeingredient_single_component',
+            ),
+        ]
 
     def __str__(self):
-        return f"{self.ingredient.name} in {self.quantity_in_grams:.2f}g for {self.recipe.name}"
+        component = self.sub_recipe if self.sub_recipe_id else self.ingredient
+        return f"{component.name} in {self.quantity_in_grams:.2f}g for {self.recipe.name}"
 
     def clean(self):
+        if bool(self.ingredient_id) == bool(self.sub_recipe_id):
+            raise ValidationError("A recipe line uses either an ingredient or a sub-recipe.")
 
         if self.quantity_in_grams < 0:
             raise ValidationError({'quantity_in_grams': ["Quantity in grams cannot be negative.",]})
@@ -95,16 +183,58 @@ class RecipeIngredient(AuditModel):
         if self.quantity_in_grams > 99999.99:
             raise ValidationError({'quantity_in_grams': ["Quantity in grams exceeds the maximum allowed value.",]})
 
+    def validate_constraints(self, exclude=None):
+        super().validate_constraints(exclude)
+        # Like the constraints on an excluded field, the cycle check is left to whoever excluded
+        # sub_recipe: BaseRecipeIngredientFormSet checks all the lines of a recipe in one query
+        if exclude and 'sub_recipe' in exclude:
+            return
+        if self.sub_recipe_id and self.recipe_id:
+            if self.recipe_id in Recipe.objects.descendant_ids([self.sub_recipe_id]):
+                raise ValidationError({'sub_recipe': [CYCLE_MESSAGE]})
+
     def save(self, *args, **kwargs):
         self.full_clean()
         super(RecipeIngredient, self).save(*args, **kwargs)
 
 
+class RecipeCost(models.Model):
+    """
+    Denormalized ingredient cost per recipe. Rows are flagged dirty by the signal handlers in
+    management.signals and recomputed in bulk on commit; bulk writes that skip signals must call
+    RecipeCost.objects.mark_dirty() themselves.
+    """
+    recipe = models.OneToOneField(Recipe, on_delete=models.CASCADE, primary_key=True, related_name='cost_cache')
+    cost = models.DecimalField(max_digits=12, decimal_places=2, default=Decimal('0.00'))
+    # Grams per batch, so the recipe can be priced per gram when used as a sub-recipe
+    weight = models.DecimalField(max_digits=14, decimal_places=2, default=Decimal('0.00'))
+    is_dirty = models.BooleanField(default=False)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    objects = RecipeCostManager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['recipe'], name='recipecost_dirty_idx', condition=models.Q(is_dirty=True)),
+        ]
+
+    def __str__(self):
+        return f"{self.recipe_id}: {self.cost}{' (dirty)' if self.is_dirty else ''}"
+
+
 class Product(models.Model):
     product_type = models.CharField(max_length=255)
     sale_price = models.DecimalField(max_digits=10, decimal_places=2)
     recipe = models.ForeignKey(Recipe, on_delete=models.CASCADE, related_name="products")
 
+    objects = ProductManager()
+
+    class Meta:
+        indexes = [
+            GinIndex(fields=['product_type'], name='product_type_trgm', opclasses=['gin_trgm_ops']),
+            models.Index(fields=['product_type', 'id'], name='product_type_idx'),
+        ]
+
     def save(self, *args, **kwargs):
         is_new = self._state.adding
         super().save(*args, **kwargs)
@@ -119,9 +249,19 @@ class Product(models.Model):
 
     @property
     def calculate_cost(self):
+        cached_cost = RecipeCost.objects.filter(recipe_id=self.recipe_id, is_dirty=False).values_list('cost', flat=True).first()
+        if cached_cost is not None:
+            return cached_cost
         total_cost = self.recipe.recipeingredient_set.aggregate(
             cost=Sum(F('quantity_in_grams') * F('ingredient__price_per_gram'), output_field=DecimalField())
         )['cost'] or Decimal('0.00')
+        # Sub-recipes are priced per gram from their batch cost, cached only while fresh, and live weight
+        sub_recipes = self.recipe.recipeingredient_set.filter(sub_recipe__isnull=False).annotate(
+            batch_cost=RecipeBatchCost('sub_recipe'), batch_weight=recipe_weight(OuterRef('sub_recipe')),
+        ).values_list('quantity_in_grams', 'batch_cost', 'batch_weight')
+        for quantity, cost, weight in sub_recipes:
+            if cost is not None and weight:
+                total_cost += (quantity * cost / weight).quantize(Decimal('.0001'))
         cost_rounded = round(total_cost, 2)
         return cost_rounded
 
@@ -145,11 +285,15 @@ class ProductVariation(models.Model):
     width = models.DecimalField(max_digits=5, decimal_places=2, blank=True, null=True)
     main_variation = models.BooleanField(default=False)
 
+    objects = ProductVariationManager()
+
     def calculate_surface_area(self):
-        if self.product.recipe.shape == 'Circular' and self.diameter:
+        # shape stores the choice key ('C'/'R'); compare on the display value
+        shape = self.product.recipe.get_shape_display()
+        if shape == 'Circular' and self.diameter:
             radius = self.diameter / Decimal('2.0')
             surface_area = pi * (radius ** 2)
-        elif self.product.recipe.shape == 'Rectangular' and self.length and self.width:
+        elif shape == 'Rectangular' and self.length and self.width:
             surface_area = self.length * self.width
         else:
             surface_area = Decimal('0.0')
@@ -183,3 +327,25 @@ class ProductVariation(models.Model):
 
     def __str__(self):
         return f"{self.product.product_type} Variation ({'main' if self.main_variation else 'secondary'})"
+
+
+class ProductionPlan(AuditModel):
+    name = models.CharField(max_length=255, blank=True)
+    bake_date = models.DateField(default=date.today)
+
+    def __str__(self):
+        return self.name or f"Production plan for {self.bake_date}"
+
+    def ingredient_demand(self):
+        return ProductionPlanLine.objects.filter(plan=self).ingredient_demand()
+
+
+class ProductionPlanLine(models.Model):
+    plan = models.ForeignKey(ProductionPlan, related_name='lines', on_delete=models.CASCADE)
+    variation = models.ForeignKey(ProductVariation, related_name='plan_lines', on_delete=models.CASCADE)
+    quantity = models.PositiveIntegerField(validators=[MinValueValidator(1)])
+
+    objects = ProductionPlanLineManager()
+
+    def __str__(self):
+        return f"{self.quantity} x {self.variation}"
@@ -0,0 +1,237 @@
+"""
+Keyset (cursor) pagination for django-tables2 tables.
+
+Pages are fetched with ``WHERE (sort keys) > (cursor)`` instead of OFFSET, so a deep page costs
+the same as the first one. The cursor holds the sort key values of the first or last row on
+the current page; ``pk`` is always appended to the sort keys so every row has a unique position.
+"""
+import base64
+import json
+import math
+import operator
+from functools import reduce
+
+from django.core.exceptions import FieldDoesNotExist
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connections
+from django.db.models import F, Q
+from django.db.models.expressions import OrderBy
+from django_tables2.rows import BoundRows
+
+CURSOR_FIELD = 'cursor'
+NEXT, PREVIOUS = 'n', 'p'
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(ordering, direction, values):
+    payload = json.dumps({'o': ordering, 'd': direction, 'v': values}, cls=DjangoJSONEncoder, separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor, ordering):
+    """Return (direction, values) for a cursor created for the same ``ordering``."""
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+        direction, values = payload['d'], payload['v']
+    except (ValueError, TypeError, KeyError):
+        raise InvalidCursor(cursor)
+    # A cursor taken under another sort order points nowhere in this one
+    if payload.get('o') != ordering or direction not in (NEXT, PREVIOUS) or len(values) != len(ordering):
+        raise InvalidCursor(cursor)
+    return direction, values
+
+
+def keyset_ordering(queryset):
+    """The queryset's ordering as (field, descending) pairs, ending with the primary key."""
+    ordering = []
+    for key in queryset.query.order_by or queryset.query.get_meta().ordering:
+        if isinstance(key, OrderBy) and isinstance(key.expression, F):
+            ordering.append((key.expression.name, key.descending))
+        elif isinstance(key, str) and key != '?':
+            ordering.append((key.lstrip('-'), key.startswith('-')))
+        else:
+            raise ValueError(f'Cannot paginate by cursor over {key!r}')
+    pk_name = queryset.model._meta.pk.name
+    if not ordering or ordering[-1][0] not in ('pk', pk_name):
+        ordering.append(('pk', False))
+    return ordering
+
+
+def nullable(model, name):
+    """Whether ordering key ``name`` can be NULL; annotations and unknown paths are assumed to be."""
+    if name == 'pk':
+        return False
+    for part in name.split('__'):
+        try:
+            field = model._meta.get_field(part)
+        except FieldDoesNotExist:
+            return True
+        if field.null or (field.is_relation and not field.many_to_one and not field.one_to_one):
+            return True
+        model = field.related_model
+    return False
+
+
+def estimated_count(queryset):
+    """The planner's row estimate for ``queryset``; an exact count where there is no planner to ask."""
+    connection = connections[queryset.db]
+    if connection.vendor != 'postgresql':
+        return queryset.count()
+    sql, params = queryset.order_by().values('pk').query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute(f'EXPLAIN (FORMAT JSON) {sql}', params)
+        plan = cursor.fetchone()[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return int(plan[0]['Plan']['Plan Rows'])
+
+
+class KeysetPage:
+    def __init__(self, records, object_list, paginator, has_previous, has_next):
+        self.records = records
+        self.object_list = object_list
+        self.paginator = paginator
+        self._has_previous = has_previous
+        self._has_next = has_next
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def has_previous(self):
+        return self._has_previous
+
+    def has_next(self):
+        return self._has_next
+
+    def has_other_pages(self):
+        return self._has_previous or self._has_next
+
+    @property
+    def previous_cursor(self):
+        return self.paginator.cursor_for(self.records[0], PREVIOUS) if self._has_previous and self.records else None
+
+    @property
+    def next_cursor(self):
+        return self.paginator.cursor_for(self.records[-1], NEXT) if self._has_next and self.records else None
+
+
+class KeysetPaginator:
+    """
+    Paginate a table's queryset by cursor, for ``Table.paginate(paginator_class=KeysetPaginator, cursor=...)``.
+
+    ``count`` is ``None`` to never count rows, ``'estimate'`` for the query planner's estimate or
+    ``'exact'`` for ``COUNT(*)``. An unknown or stale cursor serves the first page.
+    """
+
+    def __init__(self, object_list, per_page, cursor=None, count=None, **kwargs):
+        if isinstance(object_list, BoundRows):
+            self.table = object_list.table
+            queryset = object_list.data.data
+        else:
+            self.table, queryset = None, object_list
+        self.per_page = int(per_page)
+        self.count_mode = count
+        self.ordering = keyset_ordering(queryset)
+        self.aliases = [f'keyset_{position}' for position in range(len(self.ordering))]
+        self.nullable = [nullable(queryset.model, name) for name, _ in self.ordering]
+        self.queryset = queryset.annotate(
+            **{alias: F(name) for alias, (name, _) in zip(self.aliases, self.ordering)}
+        )
+        self.cursor = cursor
+        self._count = None
+
+    @property
+    def signature(self):
+        return [f"{'-' if descending else ''}{name}" for name, descending in self.ordering]
+
+    @property
+    def count(self):
+        if self.count_mode is None:
+            return None
+        if self._count is None:
+            self._count = estimated_count(self.queryset) if self.count_mode == 'estimate' else self.queryset.count()
+        return self._count
+
+    @property
+    def num_pages(self):
+        count = self.count
+        return None if count is None else max(1, math.ceil(count / self.per_page))
+
+    def cursor_for(self, record, direction):
+        return encode_cursor(self.signature, direction, [getattr(record, alias) for alias in self.aliases])
+
+    def _order_by(self, reverse):
+        # NULLs sort last going forwards, so the condition in _after() can place them. NOT NULL
+        # keys keep a plain ORDER BY (and WHERE), which an index on them can serve.
+        order_by = []
+        for alias, (_, descending), nullable in zip(self.aliases, self.ordering, self.nullable):
+            nulls = ({'nulls_first': True} if reverse else {'nulls_last': True}) if nullable else {}
+            order_by.append(F(alias).desc(**nulls) if descending != reverse else F(alias).asc(**nulls))
+        return order_by
+
+    def _after(self, values, reverse):
+        """Rows strictly after ``values`` in the (possibly reversed) page order."""
+        conditions = []
+        equal = Q()
+        for alias, (_, descending), nullable, value in zip(self.aliases, self.ordering, self.nullable, values):
+            if value is None:
+                beyond = Q(**{f'{alias}__isnull': False}) if reverse else None
+                same = Q(**{f'{alias}__isnull': True})
+            else:
+                lookup = 'lt' if descending != reverse else 'gt'
+                beyond = Q(**{f'{alias}__{lookup}': value})
+                if nullable and not reverse:
+                    beyond |= Q(**{f'{alias}__isnull': True})
+                same = Q(**{alias: value})
+            if beyond is not None:
+                conditions.append(equal & beyond)
+            equal &= same
+        return reduce(operator.or_, conditions)
+
+    def page(self, number=None):
+        direction, values = NEXT, None
+        if self.cursor:
+            try:
+                direction, values = decode_cursor(self.cursor, self.signature)
+            except InvalidCursor:
+                pass
+        reverse = direction == PREVIOUS
+        queryset = self.queryset.order_by(*self._order_by(reverse))
+        if values is not None:
+            queryset = queryset.filter(self._after(values, reverse))
+        records = list(queryset[:self.per_page + 1])
+        more = len(records) > self.per_page
+        records = records[:self.per_page]
+        if reverse:
+            records.reverse()
+            has_previous, has_next = more, True
+        else:
+            has_previous, has_next = values is not None, more
+        object_list = BoundRows(records, table=self.table) if self.table is not None else records
+        return KeysetPage(records, object_list, self, has_previous, has_next)
+
+
+class KeysetPaginationMixin:
+    """
+    For SingleTableMixin views: page the table with KeysetPaginator, reading the cursor from
+    the ``cursor`` query parameter. Set ``table_pagination = {'per_page': ...}`` rather than
+    ``paginate_by``, which would also OFFSET-paginate the view's object_list.
+    """
+
+    pagination_count = None
+
+    def get_table_pagination(self, table):
+        paginate = super().get_table_pagination(table)
+        if paginate is False:
+            return paginate
+        paginate = {} if paginate is True else paginate
+        paginate.update(
+            paginator_class=KeysetPaginator, cursor=self.request.GET.get(CURSOR_FIELD), count=self.pagination_count
+        )
+        return paginate
@@ -0,0 +1,255 @@
+"""
+Supplier price list imports.
+
+A price list is a CSV with an ingredient name and a price per gram on each row, and the
+supplier's RUC or name either in a column or given for the whole file. Rows are read one at a
+time and matched against an index of suppliers and ingredients loaded in two queries, so the
+file is never held in memory and matching costs no queries. Nothing is written unless every row
+is valid; then changed prices go out in one UPDATE and new ingredients with bulk_create(), in
+one transaction, with the price history, cost cache and fragment bookkeeping the Ingredient
+signal handlers would have done.
+"""
+import csv
+from decimal import Decimal, InvalidOperation
+
+from django.db import connection, transaction
+from django.utils import timezone
+
+from . import fragments
+from .models import Ingredient, IngredientPrice, RecipeCost, RecipeIngredient, Supplier
+
+BATCH_SIZE = 5000
+MAX_ERRORS = 100
+MIN_PRICE, MAX_PRICE = Decimal('0.01'), Decimal('99999999.99')
+CENT = Decimal('.01')
+
+# Accepted spellings of each column, after normalize()
+COLUMNS = {
+    'ruc': 'ruc',
+    'supplier': 'supplier',
+    'supplier name': 'supplier',
+    'ingredient': 'ingredient',
+    'name': 'ingredient',
+    'price': 'price',
+    'price per gram': 'price',
+    'price_per_gram': 'price',
+}
+
+# Index value for a key more than one record answers to
+AMBIGUOUS = object()
+
+
+def normalize(name):
+    return ' '.join(name.split()).casefold()
+
+
+class Index:
+    """Suppliers by RUC and by name, and ingredients by (supplier, name), with their current prices."""
+
+    def __init__(self, supplier_ids=None):
+        self.supplier_names = {}
+        self.by_ruc = {}
+        self.by_name = {}
+        for pk, ruc, name in Supplier.objects.values_list('pk', 'ruc', 'name'):
+            self.supplier_names[pk] = name
+            self._add(self.by_ruc, ruc.strip(), pk)
+            self._add(self.by_name, normalize(name), pk)
+        ingredients = Ingredient.objects.filter(supplier__isnull=False)
+        if supplier_ids is not None:
+            ingredients = ingredients.filter(supplier_id__in=supplier_ids)
+        self.ingredients = {}
+        for pk, supplier_id, name, price in ingredients.values_list('pk', 'supplier_id', 'name', 'price_per_gram'):
+            self._add(self.ingredients, (supplier_id, normalize(name)), (pk, price))
+
+    @staticmethod
+    def _add(index, key, value):
+        index[key] = AMBIGUOUS if key in index else value
+
+    def supplier(self, ruc, name):
+        """The pk of the supplier with this RUC, or else this name; raises ValueError if there is none or several."""
+        if ruc:
+            pk, label = self.by_ruc.get(ruc), f'RUC {ruc}'
+        else:
+            pk, label = self.by_name.get(normalize(name)), f'"{name}"'
+        if pk is None:
+            raise ValueError(f'Unknown supplier {label}.')
+        if pk is AMBIGUOUS:
+            raise ValueError(f'More than one supplier matches {label}.')
+        return pk
+
+
+class Report:
+    """What an import changed, or would change, and why it was refused if it was."""
+
+    def __init__(self):
+        self.rows = 0
+        self.unchanged = 0
+        self.changes = []
+        self.created = []
+        self.errors = []
+        self.error_count = 0
+        self.applied = False
+
+    def error(self, line, message):
+        self.error_count += 1
+        if len(self.errors) < MAX_ERRORS:
+            self.errors.append((line, message))
+
+    @property
+    def valid(self):
+        return not self.error_count
+
+
+def parse_price(value):
+    value = value.strip().lstrip('$').strip()
+    try:
+        price = Decimal(value)
+    except InvalidOperation:
+        raise ValueError(f'"{value}" is not a price.')
+    if not price.is_finite() or price != price.quantize(CENT):
+        raise ValueError(f'"{value}" is not a price with at most 2 decimal places.')
+    if not MIN_PRICE <= price <= MAX_PRICE:
+        raise ValueError(f'Price {value} is outside {MIN_PRICE} to {MAX_PRICE}.')
+    return price
+
+
+def import_price_list(lines, supplier=None, dry_run=False, batch_size=BATCH_SIZE):
+    """
+    Read a price list from ``lines`` (an iterable of CSV text lines, such as an open file) and
+    apply it unless ``dry_run``. ``supplier`` is the pk of the supplier rows without a supplier
+    column belong to. Returns a Report.
+    """
+    report = Report()
+    # Supplier keys are CharFields, loaded as str whatever a new instance's uuid4 default was
+    supplier = None if supplier is None else str(supplier)
+    reader = csv.reader(lines)
+    try:
+        header = next(reader, None)
+        if header is None:
+            report.error(1, 'The file is empty.')
+            return report
+        columns = {}
+        for position, title in enumerate(header):
+            column = COLUMNS.get(normalize(title))
+            if column:
+                columns.setdefault(column, position)
+        missing = [column for column in ('ingredient', 'price') if column not in columns]
+        if supplier is None and 'ruc' not in columns and 'supplier' not in columns:
+            missing.append('ruc or supplier')
+        if missing:
+            report.error(1, f'Missing column(s): {", ".join(missing)}.')
+            return report
+
+        # A file without supplier columns only touches one supplier's ingredients
+        per_row = 'ruc' in columns or 'supplier' in columns
+        index = Index(None if per_row else [supplier])
+
+        def cell(row, column):
+            position = columns.get(column)
+            return row[position].strip() if position is not None and position < len(row) else ''
+
+        seen = {}
+        for line, row in enumerate(reader, 2):
+            if not any(value.strip() for value in row):
+                continue
+            report.rows += 1
+            try:
+                ruc, supplier_name = cell(row, 'ruc'), cell(row, 'supplier')
+                supplier_id = index.supplier(ruc, supplier_name) if ruc or supplier_name else supplier
+                if supplier_id is None:
+                    raise ValueError('No supplier given.')
+                name = ' '.join(cell(row, 'ingredient').split())
+                if not name:
+                    raise ValueError('No ingredient name given.')
+                if len(name) > Ingredient._meta.get_field('name').max_length:
+                    raise ValueError(f'Ingredient name "{name[:50]}..." is too long.')
+                price = parse_price(cell(row, 'price'))
+                key = (supplier_id, normalize(name))
+                if key in seen:
+                    raise ValueError(f'"{name}" is already listed on line {seen[key]}.')
+                seen[key] = line
+                match = index.ingredients.get(key)
+                if match is AMBIGUOUS:
+                    raise ValueError(f'More than one ingredient of this supplier is called "{name}".')
+            except ValueError as error:
+                report.error(line, str(error))
+                continue
+            entry = {
+                'line': line,
+                'supplier_id': supplier_id,
+                'supplier': index.supplier_names.get(supplier_id, supplier_id),
+                'ingredient': name,
+                'new_price': price,
+            }
+            if match is None:
+                report.created.append(entry)
+            elif match[1] == price:
+                report.unchanged += 1
+            else:
+                entry.update(pk=match[0], old_price=match[1], delta=price - match[1])
+                report.changes.append(entry)
+    except (csv.Error, UnicodeDecodeError) as error:
+        report.error(reader.line_num + 1, f'The file could not be read: {error}')
+
+    if report.valid and not dry_run:
+        apply(report, batch_size)
+    return report
+
+
+def update_prices(prices, now):
+    """
+    Set the price of every (pk, price) in ``prices`` in one UPDATE joined to the new prices.
+    bulk_update() would send a CASE with a branch per row, which Django takes longer to build
+    than PostgreSQL takes to run.
+    """
+    table = connection.ops.quote_name(Ingredient._meta.db_table)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"""
+            UPDATE {table} AS ingredient SET price_per_gram = new.price, updated_at = %s
+            FROM unnest(%s::bigint[], %s::numeric[]) AS new (id, price)
+            WHERE ingredient.id = new.id
+            """,
+            [now, [pk for pk, _ in prices], [price for _, price in prices]],
+        )
+
+
+def append_history(prices, now):
+    """Append an IngredientPrice row for every (pk, price) in ``prices``, in one INSERT."""
+    table = connection.ops.quote_name(IngredientPrice._meta.db_table)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"""
+            INSERT INTO {table} (ingredient_id, price_per_gram, effective_at)
+            SELECT id, price, %s FROM unnest(%s::bigint[], %s::numeric[]) AS new (id, price)
+            """,
+            [now, [pk for pk, _ in prices], [price for _, price in prices]],
+        )
+
+
+@transaction.atomic
+def apply(report, batch_size=BATCH_SIZE):
+    now = timezone.now()
+    changed = [(entry['pk'], entry['new_price']) for entry in report.changes]
+    if changed:
+        update_prices(changed, now)
+    created = Ingredient.objects.bulk_create(
+        [
+            Ingredient(name=entry['ingredient'], supplier_id=entry['supplier_id'], price_per_gram=entry['new_price'])
+            for entry in report.created
+        ],
+        batch_size=batch_size,
+    )
+    for entry, ingredient in zip(report.created, created):
+        entry['pk'] = ingredient.pk
+    # Bulk writes send no signals, so the price history and the cost cache are kept here
+    history = changed + [(ingredient.pk, ingredient.price_per_gram) for ingredient in created]
+    if history:
+        append_history(history, now)
+    if changed:
+        RecipeCost.objects.mark_dirty(
+            RecipeIngredient.objects.filter(ingredient_id__in=[pk for pk, _ in changed]).values('recipe_id')
+        )
+    if changed or created:
+        fragments.bump(Ingredient)
+    report.applied = True
@@ -0,0 +1,393 @@
+"""
+Recipe import and export as JSON, for moving recipes between bakeries.
+
+A document lists suppliers, ingredients and recipes; each recipe carries its lines and its
+products with their variations. Lines point at ingredients and sub-recipes by their position in
+the document, suppliers are known by RUC and ingredients by supplier and name, so a document
+means the same thing in any database:
+
+    {
+      "version": 1,
+      "suppliers": [{"ruc": "1790012345001", "name": "La Molinera", "email": ..., "phone": ..., "address": ...}],
+      "ingredients": [{"name": "Flour", "supplier": "1790012345001", "price_per_gram": "0.10"}],
+      "recipes": [{
+        "name": "Bread", "description": "...", "shape": "C", "diameter": "20.00",
+        "lines": [{"ingredient": 0, "grams": "500.00"}, {"recipe": 3, "grams": "120.00"}],
+        "products": [{"product_type": "Bread", "sale_price": "30.00",
+                      "variations": [{"diameter": "20.00", "main": true}, {"diameter": "30.00"}]}]
+      }]
+    }
+
+Empty dimensions are left out. On import, suppliers and ingredients that already exist are
+reused as they are (prices included) and the rest are created; recipes are always new, so a
+recipe whose name is taken is an error. The whole document is checked with the models' field
+validation before anything is written, then every row is inserted in one transaction (recipes,
+lines, products and variations with COPY), with a constant number of lookups however many
+recipes there are.
+"""
+from django.core.exceptions import NON_FIELD_ERRORS, ValidationError
+from django.db import connection, transaction
+
+from . import fragments, seeding
+from .models import (
+    Ingredient,
+    IngredientPrice,
+    Product,
+    ProductVariation,
+    Recipe,
+    RecipeCost,
+    RecipeIngredient,
+    Supplier,
+)
+
+VERSION = 1
+BATCH_SIZE = 2000
+MAX_ERRORS = 100
+
+SUPPLIER_FIELDS = ('ruc', 'name', 'email', 'phone', 'address')
+RECIPE_FIELDS = ('name', 'description', 'shape', 'diameter', 'length', 'width')
+DIMENSIONS = ('diameter', 'length', 'width')
+
+
+def _text(value):
+    return None if value is None else str(value)
+
+
+def _compact(values):
+    return {key: _text(value) for key, value in values.items() if value is not None}
+
+
+def export_recipes(recipes):
+    """
+    The document for ``recipes`` (a Recipe queryset), including the sub-recipes they use and
+    every product made from them. Runs the same seven queries however many recipes there are.
+    """
+    recipe_ids = Recipe.objects.descendant_ids(recipes.values('pk'))
+    recipe_rows = list(Recipe.objects.filter(pk__in=recipe_ids).order_by('pk').values('pk', *RECIPE_FIELDS))
+    lines = list(
+        RecipeIngredient.objects.filter(recipe_id__in=recipe_ids)
+        .order_by('recipe_id', 'pk')
+        .values_list('recipe_id', 'ingredient_id', 'sub_recipe_id', 'quantity_in_grams')
+    )
+    ingredient_rows = list(
+        Ingredient.objects.filter(pk__in={ingredient_id for _, ingredient_id, _, _ in lines} - {None})
+        .order_by('pk')
+        .values_list('pk', 'name', 'supplier_id', 'supplier__ruc', 'price_per_gram')
+    )
+    supplier_rows = list(
+        Supplier.objects.filter(pk__in={row[2] for row in ingredient_rows} - {None})
+        .order_by('ruc', 'pk')
+        .values(*SUPPLIER_FIELDS)
+    )
+    products = list(
+        Product.objects.filter(recipe_id__in=recipe_ids)
+        .order_by('pk')
+        .values_list('pk', 'recipe_id', 'product_type', 'sale_price')
+    )
+    variations = list(
+        ProductVariation.objects.filter(product__recipe_id__in=recipe_ids)
+        .order_by('product_id', '-main_variation', 'pk')
+        .values_list('product_id', 'main_variation', *DIMENSIONS)
+    )
+
+    recipe_position = {row['pk']: position for position, row in enumerate(recipe_rows)}
+    ingredient_position = {row[0]: position for position, row in enumerate(ingredient_rows)}
+    documents = []
+    by_recipe = {}
+    for row in recipe_rows:
+        document = _compact({field: row[field] for field in RECIPE_FIELDS})
+        document.update(lines=[], products=[])
+        documents.append(document)
+        by_recipe[row['pk']] = document
+    for recipe_id, ingredient_id, sub_recipe_id, grams in lines:
+        if ingredient_id is not None:
+            line = {'ingredient': ingredient_position[ingredient_id]}
+        else:
+            line = {'recipe': recipe_position[sub_recipe_id]}
+        line['grams'] = _text(grams)
+        by_recipe[recipe_id]['lines'].append(line)
+    by_product = {}
+    for pk, recipe_id, product_type, sale_price in products:
+        product = {'product_type': product_type, 'sale_price': _text(sale_price), 'variations': []}
+        by_recipe[recipe_id]['products'].append(product)
+        by_product[pk] = product
+    for product_id, main, *dimensions in variations:
+        variation = _compact(dict(zip(DIMENSIONS, dimensions)))
+        if main:
+            variation['main'] = True
+        by_product[product_id]['variations'].append(variation)
+
+    return {
+        'version': VERSION,
+        'suppliers': [_compact(row) for row in supplier_rows],
+        'ingredients': [
+            {'name': name, 'supplier': ruc, 'price_per_gram': _text(price)}
+            for _, name, _, ruc, price in ingredient_rows
+        ],
+        'recipes': documents,
+    }
+
+
+class _Errors:
+    def __init__(self):
+        self.messages = []
+
+    def add(self, path, error):
+        if len(self.messages) >= MAX_ERRORS:
+            return
+        if isinstance(error, ValidationError):
+            fields = error.message_dict if hasattr(error, 'error_dict') else {NON_FIELD_ERRORS: error.messages}
+            for field, messages in fields.items():
+                for message in messages:
+                    self.add(path if field == NON_FIELD_ERRORS else f'{path}.{field}', message)
+            return
+        self.messages.append(f'{path}: {error}')
+
+    def check(self, path, instance, exclude=()):
+        """Field validation of ``instance`` without foreign keys, which are only resolved on insert."""
+        try:
+            instance.clean_fields(exclude=exclude)
+        except ValidationError as error:
+            self.add(path, error)
+            return False
+        return True
+
+
+def _list(document, key, errors, path='document'):
+    value = document.get(key, [])
+    if not isinstance(value, list):
+        errors.add(f'{path}.{key}', 'must be a list.')
+        return []
+    for position, item in enumerate(value):
+        if not isinstance(item, dict):
+            errors.add(f'{path}.{key}[{position}]', 'must be an object.')
+            return []
+    return value
+
+
+def _index(value, size):
+    return value if isinstance(value, int) and not isinstance(value, bool) and 0 <= value < size else None
+
+
+class Import:
+    """A validated document, ready to insert; ``errors`` lists what is wrong with it, by path."""
+
+    def __init__(self, document):
+        self.errors = _Errors()
+        self.suppliers = {}
+        self.new_suppliers = []
+        self.ingredients = []
+        self.new_ingredients = []
+        self.recipes = []
+        self.lines = []
+        self.products = []
+        self.variations = []
+        if not isinstance(document, dict):
+            self.errors.add('document', 'must be an object.')
+            return
+        if document.get('version') != VERSION:
+            self.errors.add('document.version', f'must be {VERSION}.')
+            return
+        self._suppliers(_list(document, 'suppliers', self.errors))
+        self._ingredients(_list(document, 'ingredients', self.errors))
+        self._recipes(_list(document, 'recipes', self.errors))
+
+    @property
+    def valid(self):
+        return not self.errors.messages
+
+    @property
+    def counts(self):
+        """The number of rows the import creates per model."""
+        return {
+            'suppliers': len(self.new_suppliers),
+            'ingredients': len(self.new_ingredients),
+            'recipes': len(self.recipes),
+            'recipe lines': len(self.lines),
+            'products': len(self.products),
+            'variations': len(self.variations),
+        }
+
+    def _suppliers(self, entries):
+        rucs = [_text(entry.get('ruc')) for entry in entries]
+        existing = {}
+        for pk, ruc in Supplier.objects.filter(ruc__in=set(rucs) - {None}).order_by('pk').values_list('pk', 'ruc'):
+            existing.setdefault(ruc, pk)
+        for position, (entry, ruc) in enumerate(zip(entries, rucs)):
+            path = f'suppliers[{position}]'
+            if ruc in self.suppliers:
+                self.errors.add(path, f'RUC {ruc} is listed twice.')
+            elif ruc in existing:
+                self.suppliers[ruc] = existing[ruc]
+            else:
+                supplier = Supplier(**{field: _text(entry.get(field)) or '' for field in SUPPLIER_FIELDS})
+                if self.errors.check(path, supplier, exclude=['id']):
+                    self.suppliers[ruc] = supplier.pk
+                    self.new_suppliers.append(supplier)
+
+    def _ingredients(self, entries):
+        keys = []
+        for position, entry in enumerate(entries):
+            ruc = _text(entry.get('supplier'))
+            if ruc is not None and ruc not in self.suppliers:
+                self.errors.add(f'ingredients[{position}].supplier', f'RUC {ruc} is not among the suppliers.')
+            keys.append((self.suppliers.get(ruc), _text(entry.get('name')) or ''))
+        existing = {}
+        found = Ingredient.objects.filter(name__in={name for _, name in keys}).order_by('pk')
+        for pk, supplier_id, name in found.values_list('pk', 'supplier_id', 'name'):
+            existing.setdefault((supplier_id, name), pk)
+        seen = set()
+        for position, (entry, key) in enumerate(zip(entries, keys)):
+            path = f'ingredients[{position}]'
+            if key in seen:
+                self.errors.add(path, f'"{key[1]}" is listed twice for the same supplier.')
+            seen.add(key)
+            if key in existing:
+                self.ingredients.append(existing[key])
+                continue
+            ingredient = Ingredient(name=key[1], supplier_id=key[0], price_per_gram=_text(entry.get('price_per_gram')))
+            self.errors.check(path, ingredient, exclude=['supplier'])
+            self.ingredients.append(ingredient)
+            self.new_ingredients.append(ingredient)
+
+    def _recipes(self, entries):
+        names = [_text(entry.get('name')) or '' for entry in entries]
+        taken = set(Recipe.objects.filter(name__in=set(names)).values_list('name', flat=True))
+        seen = set()
+        uses = []
+        for position, (entry, name) in enumerate(zip(entries, names)):
+            path = f'recipes[{position}]'
+            if name in taken:
+                self.errors.add(f'{path}.name', f'A recipe called "{name}" already exists.')
+            elif name in seen:
+                self.errors.add(f'{path}.name', f'"{name}" is listed twice.')
+            seen.add(name)
+            recipe = Recipe(**{field: _text(entry.get(field)) for field in RECIPE_FIELDS})
+            self.errors.check(path, recipe)
+            self.recipes.append(recipe)
+            uses.append(set())
+            for number, line in enumerate(_list(entry, 'lines', self.errors, path)):
+                uses[-1].update(self._line(f'{path}.lines[{number}]', recipe, line, len(entries)))
+            for number, product in enumerate(_list(entry, 'products', self.errors, path)):
+                self._product(f'{path}.products[{number}]', recipe, product)
+        self._check_cycles(uses)
+
+    def _line(self, path, recipe, entry, recipe_count):
+        """Add the line and return the position of the sub-recipe it uses, if any."""
+        ingredient = _index(entry.get('ingredient'), len(self.ingredients))
+        sub_recipe = _index(entry.get('recipe'), recipe_count)
+        if 'ingredient' in entry and ingredient is None:
+            self.errors.add(path, 'ingredient is not a position in the ingredients list.')
+        if 'recipe' in entry and sub_recipe is None:
+            self.errors.add(path, 'recipe is not a position in the recipes list.')
+        line = RecipeIngredient(quantity_in_grams=_text(entry.get('grams')))
+        if self.errors.check(path, line, exclude=['recipe', 'ingredient', 'sub_recipe']):
+            # Stand-in ids, so clean() sees which component the line uses; the real ones are set on insert
+            line.ingredient_id = None if ingredient is None else -1
+            line.sub_recipe_id = None if sub_recipe is None else -1
+            try:
+                line.clean()
+            except ValidationError as error:
+                self.errors.add(path, error)
+        self.lines.append((recipe, line, ingredient, sub_recipe))
+        return set() if sub_recipe is None else {sub_recipe}
+
+    def _product(self, path, recipe, entry):
+        product = Product(product_type=_text(entry.get('product_type')), sale_price=_text(entry.get('sale_price')))
+        self.errors.check(path, product, exclude=['recipe'])
+        self.products.append((recipe, product))
+        variations = _list(entry, 'variations', self.errors, path)
+        mains = sum(1 for variation in variations if variation.get('main'))
+        if mains > 1:
+            self.errors.add(f'{path}.variations', 'only one variation can be the main one.')
+        if not mains:
+            # Product.save() would have made one from the recipe
+            variations = [{'main': True, **{field: getattr(recipe, field) for field in DIMENSIONS}}, *variations]
+        for number, entry in enumerate(variations):
+            variation = ProductVariation(
+                main_variation=bool(entry.get('main')), **{field: _text(entry.get(field)) for field in DIMENSIONS}
+            )
+            self.errors.check(f'{path}.variations[{number}]', variation, exclude=['product'])
+            self.variations.append((product, variation))
+
+    def _check_cycles(self, uses):
+        # Kahn's algorithm over the document's sub-recipe graph; whatever is left is on a cycle
+        waiting = [len(used) for used in uses]
+        users = [[] for _ in uses]
+        for position, used in enumerate(uses):
+            for sub_recipe in used:
+                users[sub_recipe].append(position)
+        ready = [position for position, count in enumerate(waiting) if not count]
+        while ready:
+            for user in users[ready.pop()]:
+                waiting[user] -= 1
+                if not waiting[user]:
+                    ready.append(user)
+        for position, count in enumerate(waiting):
+            if count:
+                self.errors.add(f'recipes[{position}]', 'contains itself, directly or through its sub-recipes.')
+
+    @transaction.atomic
+    def save(self, batch_size=BATCH_SIZE):
+        """Insert everything and return the number of rows created per model."""
+        if not self.valid:
+            raise ValidationError(self.errors.messages)
+        Supplier.objects.bulk_create(self.new_suppliers, batch_size=batch_size)
+        Ingredient.objects.bulk_create(self.new_ingredients, batch_size=batch_size)
+        # bulk_create() sends no signals: new ingredients start their price history here
+        IngredientPrice.objects.bulk_create(
+            [
+                IngredientPrice(ingredient=ingredient, price_per_gram=ingredient.price_per_gram)
+                for ingredient in self.new_ingredients
+            ],
+            batch_size=batch_size,
+        )
+        ingredient_ids = [getattr(ingredient, 'pk', ingredient) for ingredient in self.ingredients]
+        with connection.cursor() as cursor:
+            # The bulk of the rows go out with COPY: bulk_create() spends longer building its
+            # INSERTs than PostgreSQL spends running them
+            writer = seeding.Writer(cursor, seeding.COPY, batch_size)
+            for recipe, pk in zip(self.recipes, seeding.reserve_ids(cursor, Recipe, len(self.recipes))):
+                recipe.pk = pk
+            _write(writer, Recipe, self.recipes)
+            for recipe, line, ingredient, sub_recipe in self.lines:
+                line.recipe = recipe
+                line.ingredient_id = None if ingredient is None else ingredient_ids[ingredient]
+                line.sub_recipe_id = None if sub_recipe is None else self.recipes[sub_recipe].pk
+            _write(writer, RecipeIngredient, [line for _, line, _, _ in self.lines])
+            for (recipe, product), pk in zip(self.products, seeding.reserve_ids(cursor, Product, len(self.products))):
+                product.pk = pk
+                product.recipe = recipe
+            _write(writer, Product, [product for _, product in self.products])
+            for product, variation in self.variations:
+                variation.product = product
+            _write(writer, ProductVariation, [variation for _, variation in self.variations])
+            recipe_ids = [recipe.pk for recipe in self.recipes]
+            _write(writer, RecipeCost, [RecipeCost(recipe_id=pk, is_dirty=True) for pk in recipe_ids])
+        RecipeCost.objects.mark_dirty(recipe_ids)
+        fragments.bump(Supplier, Ingredient, Recipe, RecipeIngredient, Product, ProductVariation)
+        return self.counts
+
+
+def _write(writer, model, instances):
+    """Write ``instances`` of ``model`` as they are, leaving the id to the sequence unless one is set."""
+    fields = [field for field in model._meta.concrete_fields if not field.primary_key]
+    if instances and instances[0].pk is not None:
+        fields.insert(0, model._meta.pk)
+    writer.write(
+        model, [field.attname for field in fields],
+        ([field.pre_save(instance, True) for field in fields] for instance in instances),
+    )
+
+
+def import_recipes(document, dry_run=False, batch_size=BATCH_SIZE):
+    """
+    Validate ``document`` (parsed JSON) and, unless ``dry_run``, insert it. Returns the Import;
+    raises ValidationError with every problem found, by path, if the document is invalid.
+    """
+    imported = Import(document)
+    if not imported.valid:
+        raise ValidationError(imported.errors.messages)
+    if not dry_run:
+        imported.save(batch_size)
+    return imported
@@ -0,0 +1,81 @@
+"""
+Trigram search over the catalogue: products, recipes, ingredients and suppliers.
+
+With pg_trgm installed, a term matches a field that is trigram-similar to it or contains it. Both
+of those are answered from the fields' gin_trgm_ops indexes, and results are ranked by their best
+similarity(). Without the extension (it is an optional contrib module), the same calls fall back
+to a ranked, unindexed icontains match, so the search still works, only slower.
+"""
+from functools import reduce
+from operator import or_
+
+from django.contrib.postgres.search import TrigramSimilarity
+from django.db import connections
+from django.db.models import Case, FloatField, Q, Value, When
+from django.db.models.functions import Greatest
+
+from .models import Ingredient, Product, Recipe, Supplier
+
+RANK = 'search_rank'
+MIN_LENGTH = 2
+LIVE_SEARCH_LIMIT = 5
+
+_installed = {}
+
+
+def trigram_available(using='default'):
+    """Whether pg_trgm is installed in the database, checked once per connection alias."""
+    if using not in _installed:
+        connection = connections[using]
+        if connection.vendor != 'postgresql':
+            _installed[using] = False
+        else:
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'")
+                _installed[using] = cursor.fetchone() is not None
+    return _installed[using]
+
+
+def _rank(fields, term):
+    if trigram_available():
+        similarities = [TrigramSimilarity(field, term) for field in fields]
+        return similarities[0] if len(similarities) == 1 else Greatest(*similarities)
+    # Exact matches first, then prefixes, then anything containing the term
+    return Case(
+        *[When(**{f'{field}__iexact': term}, then=Value(1.0)) for field in fields],
+        *[When(**{f'{field}__istartswith': term}, then=Value(0.75)) for field in fields],
+        default=Value(0.5),
+        output_field=FloatField(),
+    )
+
+
+def ranked(queryset, fields, term):
+    """``queryset`` narrowed to rows where any of ``fields`` matches ``term``, best match first."""
+    term = term.strip()
+    if not term:
+        return queryset
+    lookups = ['icontains', 'trigram_similar'] if trigram_available() else ['icontains']
+    matches = reduce(or_, (Q(**{f'{field}__{lookup}': term}) for field in fields for lookup in lookups))
+    return queryset.filter(matches).annotate(**{RANK: _rank(fields, term)}).order_by(f'-{RANK}', 'pk')
+
+
+# Fields searched per model, each backed by a gin_trgm_ops index (see the models' Meta.indexes)
+SEARCH_FIELDS = {
+    'products': ('product_type',),
+    'recipes': ('name',),
+    'ingredients': ('name',),
+    'suppliers': ('name', 'ruc'),
+}
+
+
+def catalogue(term, limit=LIVE_SEARCH_LIMIT):
+    """The best ``limit`` matches for ``term`` from each searchable model, for the live search box."""
+    querysets = {
+        'products': Product.objects.select_related('recipe'),
+        'recipes': Recipe.objects.all(),
+        'ingredients': Ingredient.objects.select_related('supplier'),
+        'suppliers': Supplier.objects.all(),
+    }
+    if len(term.strip()) < MIN_LENGTH:
+        return {name: [] for name in querysets}
+    return {name: list(ranked(queryset, SEARCH_FIELDS[name], term)[:limit]) for name, queryset in querysets.items()}
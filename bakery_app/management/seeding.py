@@ -0,0 +1,208 @@
+"""
+Synthetic catalogues for benchmarks and load tests, written straight to the tables: no save(),
+no full_clean() and no signals, so everything those would have done (main variations, price
+history, the RecipeCost cache, fragment generations) is written here in bulk instead.
+
+Primary keys are reserved from the table sequences up front, so rows can reference each other
+without reading anything back, and are then written with COPY or batched bulk_create(). The same
+seed always produces the same catalogue.
+"""
+import random
+import uuid
+from decimal import Decimal
+
+from django.db import connection
+from django.utils import timezone
+
+from . import fragments
+from .models import (
+    Ingredient,
+    IngredientPrice,
+    Product,
+    ProductVariation,
+    Recipe,
+    RecipeCost,
+    RecipeIngredient,
+    Supplier,
+)
+
+COPY, BULK = 'copy', 'bulk'
+
+INGREDIENT_NAMES = (
+    'Flour', 'Sugar', 'Butter', 'Eggs', 'Milk', 'Cream', 'Cocoa', 'Chocolate', 'Vanilla', 'Yeast',
+    'Salt', 'Almonds', 'Walnuts', 'Honey', 'Cinnamon', 'Lemon', 'Strawberries', 'Cheese', 'Oats', 'Raisins',
+)
+PRODUCT_NAMES = ('Cake', 'Tart', 'Pie', 'Loaf', 'Brownie', 'Cheesecake', 'Roll', 'Sheet cake', 'Torte', 'Muffin tray')
+# Extra variations are the recipe's dimensions scaled by one of these
+SCALES = (Decimal('0.5'), Decimal('0.75'), Decimal('1.25'), Decimal('1.5'), Decimal('2'))
+CENT = Decimal('.01')
+
+
+class Ratios:
+    """How many of each row to write per product, or per recipe for the recipe lines."""
+
+    def __init__(self, suppliers=0.05, ingredients=0.2, recipes=0.1, lines=8, variations=2):
+        self.suppliers = suppliers
+        self.ingredients = ingredients
+        self.recipes = recipes
+        self.lines = lines
+        self.variations = variations
+
+    def counts(self, products):
+        recipes = max(round(products * self.recipes), 1)
+        ingredients = max(round(products * self.ingredients), 1)
+        return {
+            'suppliers': max(round(products * self.suppliers), 1),
+            'ingredients': ingredients,
+            'recipes': recipes,
+            'lines': recipes * min(self.lines, ingredients),
+            'products': products,
+            'variations': products * max(self.variations, 1),
+        }
+
+
+def reserve_ids(cursor, model, count):
+    """Take ``count`` consecutive ids from the sequence of ``model``'s table, which stays locked against inserts."""
+    if not count:
+        return range(0)
+    table = model._meta.db_table
+    cursor.execute(f'LOCK TABLE {connection.ops.quote_name(table)} IN EXCLUSIVE MODE')
+    cursor.execute(
+        "SELECT setval(pg_get_serial_sequence(%s, 'id'), nextval(pg_get_serial_sequence(%s, 'id')) + %s - 1)",
+        [table, table, count],
+    )
+    last = cursor.fetchone()[0]
+    return range(last - count + 1, last + 1)
+
+
+def _money(rng, low, high):
+    return Decimal(rng.randint(low * 100, high * 100)).scaleb(-2)
+
+
+def _dimensions(rng):
+    if rng.random() < 0.5:
+        return 'C', Decimal(rng.randint(10, 40)), None, None
+    return 'R', None, Decimal(rng.randint(20, 60)), Decimal(rng.randint(15, 40))
+
+
+class Writer:
+    def __init__(self, cursor, method, batch_size):
+        self.cursor = cursor
+        self.method = method
+        self.batch_size = batch_size
+
+    def write(self, model, fields, rows):
+        """Write ``rows``, tuples of values for the model ``fields`` (attnames), and return how many there were."""
+        if self.method == COPY:
+            return self._copy(model, fields, rows)
+        return self._bulk_create(model, fields, rows)
+
+    def _copy(self, model, fields, rows):
+        quote = connection.ops.quote_name
+        columns = ', '.join(quote(model._meta.get_field(field).column) for field in fields)
+        written = 0
+        with self.cursor.copy(f'COPY {quote(model._meta.db_table)} ({columns}) FROM STDIN') as copy:
+            for row in rows:
+                copy.write_row(row)
+                written += 1
+        return written
+
+    def _bulk_create(self, model, fields, rows):
+        written = 0
+        batch = []
+        for row in rows:
+            batch.append(model(**dict(zip(fields, row))))
+            if len(batch) >= self.batch_size:
+                written += len(model.objects.bulk_create(batch))
+                batch = []
+        return written + len(model.objects.bulk_create(batch))
+
+
+def seed(products, ratios=None, seed=0, method=COPY, batch_size=5000):
+    """
+    Write a catalogue of ``products`` products and the suppliers, ingredients, recipes and
+    variations ``ratios`` ask for. Returns the number of rows written per table. Run it inside a
+    transaction: the sequences are locked until it ends.
+    """
+    ratios = ratios or Ratios()
+    counts = ratios.counts(products)
+    rng = random.Random(seed)
+    now = timezone.now()
+    written = {}
+
+    with connection.cursor() as cursor:
+        writer = Writer(cursor, method, batch_size)
+        ingredient_ids = reserve_ids(cursor, Ingredient, counts['ingredients'])
+        recipe_ids = reserve_ids(cursor, Recipe, counts['recipes'])
+        product_ids = reserve_ids(cursor, Product, counts['products'])
+
+        supplier_ids = [str(uuid.UUID(int=rng.getrandbits(128), version=4)) for _ in range(counts['suppliers'])]
+        written['suppliers'] = writer.write(
+            Supplier, ('id', 'name', 'ruc', 'email', 'phone', 'address', 'created_at', 'updated_at'),
+            (
+                (pk, f'Supplier {n}', f'{rng.randrange(10 ** 13):013}', f'supplier{n}@example.com',
+                 f'+5939{rng.randrange(10 ** 8):08}', f'Calle {n}, Quito', now, now)
+                for n, pk in enumerate(supplier_ids, 1)
+            ),
+        )
+
+        prices = [_money(rng, 0, 5) + CENT for _ in ingredient_ids]
+        written['ingredients'] = writer.write(
+            Ingredient, ('id', 'name', 'supplier_id', 'price_per_gram', 'created_at', 'updated_at'),
+            (
+                (pk, f'{rng.choice(INGREDIENT_NAMES)} {n}', rng.choice(supplier_ids), price, now, now)
+                for n, (pk, price) in enumerate(zip(ingredient_ids, prices), 1)
+            ),
+        )
+        # Bulk price writes append their own history rows (see IngredientPrice)
+        written['ingredient prices'] = writer.write(
+            IngredientPrice, ('ingredient_id', 'price_per_gram', 'effective_at'),
+            zip(ingredient_ids, prices, [now] * len(prices)),
+        )
+
+        shapes = [_dimensions(rng) for _ in recipe_ids]
+        written['recipes'] = writer.write(
+            Recipe, ('id', 'name', 'description', 'shape', 'diameter', 'length', 'width'),
+            (
+                (pk, f'Recipe {n}', f'Seeded recipe {n}', *shape)
+                for n, (pk, shape) in enumerate(zip(recipe_ids, shapes), 1)
+            ),
+        )
+        lines = min(ratios.lines, len(ingredient_ids))
+        written['recipe lines'] = writer.write(
+            RecipeIngredient, ('recipe_id', 'ingredient_id', 'quantity_in_grams', 'created_at', 'updated_at'),
+            (
+                (recipe_id, ingredient_id, _money(rng, 5, 500), now, now)
+                for recipe_id in recipe_ids
+                for ingredient_id in rng.sample(ingredient_ids, lines)
+            ),
+        )
+
+        product_recipes = [rng.randrange(len(recipe_ids)) for _ in product_ids]
+        written['products'] = writer.write(
+            Product, ('id', 'product_type', 'sale_price', 'recipe_id', 'created_at', 'updated_at'),
+            (
+                (pk, f'{rng.choice(PRODUCT_NAMES)} {n}', _money(rng, 5, 150), recipe_ids[recipe], now, now)
+                for n, (pk, recipe) in enumerate(zip(product_ids, product_recipes), 1)
+            ),
+        )
+
+        def variations():
+            for pk, recipe in zip(product_ids, product_recipes):
+                _, diameter, length, width = shapes[recipe]
+                # Product.save() would have created the main variation from the recipe
+                yield pk, diameter, length, width, True
+                for _ in range(ratios.variations - 1):
+                    scale = rng.choice(SCALES)
+                    scaled = ((value * scale).quantize(CENT) if value else None for value in (diameter, length, width))
+                    yield pk, *scaled, False
+
+        written['variations'] = writer.write(
+            ProductVariation, ('product_id', 'diameter', 'length', 'width', 'main_variation'), variations(),
+        )
+        models = (Supplier, Ingredient, IngredientPrice, Recipe, RecipeIngredient, Product, ProductVariation)
+        cursor.execute('ANALYZE ' + ', '.join(connection.ops.quote_name(model._meta.db_table) for model in models))
+
+    written['recipe costs'] = RecipeCost.objects.refresh_dirty()
+    fragments.bump(Supplier, Ingredient, Recipe, RecipeIngredient, Product, ProductVariation)
+    return written
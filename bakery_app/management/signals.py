@@ -0,0 +1,65 @@
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+
+from . import fragments
+from .models import (
+    Ingredient,
+    IngredientPrice,
+    Product,
+    ProductVariation,
+    Recipe,
+    RecipeCost,
+    RecipeIngredient,
+    Supplier,
+)
+
+
+@receiver(post_save, sender=Recipe)
+def create_recipe_cost(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        RecipeCost.objects.get_or_create(recipe=instance)
+
+
+@receiver(post_save, sender=Ingredient)
+def ingredient_price_changed(sender, instance, created, raw=False, **kwargs):
+    if raw or (not created and instance.price_per_gram == instance.loaded_value('price_per_gram')):
+        return
+    IngredientPrice.objects.create(
+        ingredient=instance, price_per_gram=instance.price_per_gram, effective_at=instance.updated_at
+    )
+    if created:
+        return
+    RecipeCost.objects.mark_dirty(RecipeIngredient.objects.filter(ingredient=instance).values('recipe_id'))
+
+
+@receiver(post_save, sender=RecipeIngredient)
+def recipe_ingredient_saved(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    recipe_ids = {instance.recipe_id, instance.loaded_value('recipe_id')} - {None}
+    RecipeCost.objects.mark_dirty(recipe_ids)
+
+
+@receiver(post_delete, sender=RecipeIngredient)
+def recipe_ingredient_deleted(sender, instance, **kwargs):
+    RecipeCost.objects.mark_dirty([instance.recipe_id])
+
+
+# Fragment cache generations for every model the table partials and search results are rendered from
+def bump_fragment_generation(sender, raw=False, **kwargs):
+    if not raw:
+        fragments.bump(sender)
+
+
+def recipe_ingredients_changed(sender, action, **kwargs):
+    # Recipe.ingredients.add()/remove()/clear() bypass RecipeIngredient's own signals
+    if action.startswith('post_'):
+        fragments.bump(RecipeIngredient)
+
+
+for model in (Product, Recipe, RecipeIngredient, Ingredient, ProductVariation, Supplier):
+    post_save.connect(bump_fragment_generation, sender=model, dispatch_uid=f'fragments-save-{model.__name__}')
+    post_delete.connect(bump_fragment_generation, sender=model, dispatch_uid=f'fragments-delete-{model.__name__}')
+m2m_changed.connect(
+    recipe_ingredients_changed, sender=Recipe.ingredients.through, dispatch_uid='fragments-recipe-ingredients'
+)
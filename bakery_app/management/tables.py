@@ -3,14 +3,16 @@ import django_tables2 as tables
 from .models import Product, ProductVariation, Ingredient
 
 class ProductTable(tables.Table):
-    total_cost = tables.Column(accessor='calculate_cost', verbose_name='Total Cost $USD')
-    profit = tables.Column(accessor='calculate_profit', verbose_name='Profit $USD')
-    margin_percentage = tables.Column(accessor='calculate_margin', verbose_name='Margin (%)')
+    # Backed by ProductQuerySet.with_costing() annotations
+    total_cost = tables.Column(verbose_name='Total Cost $USD')
+    profit = tables.Column(verbose_name='Profit $USD')
+    margin_percentage = tables.Column(verbose_name='Margin (%)')
 
     class Meta:
         model = Product
         fields = ['product_type', 'sale_price', 'total_cost', 'profit', 'margin_percentage']
-        template_name = 'django_tables2/bootstrap4.html'
+        # Paged by KeysetPaginator
+        template_name = 'management/suppliers/keyset_table.html'
 
 
 class IngredientTable(tables.Table):
@@ -20,16 +22,17 @@ class IngredientTable(tables.Table):
     class Meta:
         model = Ingredient
         fields = ('name', 'weight')
-        template_name = 'django_tables2/bootstrap4.html'
+        template_name = 'management/suppliers/keyset_table.html'
 
 
 class ProductVariationTable(tables.Table):
-    product_type = tables.Column(accessor='product.product_type')
-    shape = tables.Column(accessor='product.recipe.shape')
-    dimensions = tables.TemplateColumn(template_name='management/suppliers/variations_dimensions_column.html')
-    adjusted_cost = tables.Column(accessor='adjusted_cost', verbose_name='Adjusted Cost $USD')
-    adjusted_profit = tables.Column(accessor='adjusted_profit', verbose_name='Profit $USD')
-    adjusted_margin = tables.Column(accessor='adjusted_margin', verbose_name='Margin (%)')
+    product_type = tables.Column(accessor='product__product_type')
+    shape = tables.Column(accessor='product__recipe__shape')
+    dimensions = tables.TemplateColumn(template_name='management/suppliers/variations_dimensions_column.html', orderable=False)
+    # Backed by ProductVariationQuerySet.with_adjusted_costing() annotations
+    adjusted_cost = tables.Column(accessor='variation_cost', verbose_name='Adjusted Cost $USD')
+    adjusted_profit = tables.Column(accessor='variation_profit', verbose_name='Profit $USD')
+    adjusted_margin = tables.Column(accessor='variation_margin', verbose_name='Margin (%)')
 
     class Meta:
         model = ProductVariation
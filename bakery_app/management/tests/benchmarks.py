@@ -0,0 +1,254 @@
+"""
+Helpers for the end-to-end view benchmarks in test_views_benchmark.py and the model-layer
+micro-benchmarks in test_models_benchmark.py.
+
+Environment variables for the view benchmarks:
+
+- BENCHMARK_SIZES: comma-separated catalogue sizes (products) to run at, default ``1000``.
+- BENCHMARK_RUNS: timed requests per scenario, default ``20``.
+- BENCHMARK_JSON: write the results to this file, merged with what is already there per size.
+- BENCHMARK_BASELINE: compare with this earlier BENCHMARK_JSON and fail on regressions.
+- BENCHMARK_TOLERANCE: how much slower p95 may get than the baseline's, default ``0.25`` (25%).
+  Query counts may not grow at all.
+
+The micro-benchmarks compare with the baselines committed in baselines/, which hold their own
+thresholds. Timings are only checked with BENCHMARK_CHECK_TIME=1, on the machine the baseline
+was recorded on; BENCHMARK_UPDATE_BASELINE=1 records a new baseline instead of checking.
+"""
+import json
+import os
+import platform
+import statistics
+import time
+import tracemalloc
+from pathlib import Path
+
+import django
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from bakery_app.management.instrumentation import TRANSACTION_CONTROL
+from bakery_app.management.models import RecipeCost
+
+
+def sizes():
+    return [int(size) for size in os.environ.get('BENCHMARK_SIZES', '1000').split(',') if size]
+
+
+def runs():
+    return int(os.environ.get('BENCHMARK_RUNS', '20'))
+
+
+def seed(size):
+    """
+    A catalogue of ``size`` products written with INSERT ... SELECT: size/20 suppliers, size/5
+    ingredients, size/10 recipes of 8 lines each, and two variations per product.
+    """
+    suppliers, ingredients, recipes = max(size // 20, 1), max(size // 5, 8), max(size // 10, 1)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            """
+            INSERT INTO management_supplier (id, name, ruc, email, phone, address, created_at, updated_at)
+            SELECT 'bench-' || n, 'Supplier ' || n, lpad(n::text, 13, '0'), 'supplier' || n || '@example.com',
+                   '+593990000000', 'Quito', now(), now()
+            FROM generate_series(1, %s) AS n
+            """,
+            [suppliers],
+        )
+        cursor.execute(
+            """
+            INSERT INTO management_ingredient (name, supplier_id, price_per_gram, created_at, updated_at)
+            SELECT 'Ingredient ' || md5(n::text), 'bench-' || (1 + n %% %s), 0.01 * (1 + n %% 500), now(), now()
+            FROM generate_series(1, %s) AS n
+            """,
+            [suppliers, ingredients],
+        )
+        cursor.execute(
+            """
+            INSERT INTO management_recipe (name, description, shape, diameter, length, width)
+            SELECT 'Recipe ' || n, 'Benchmark recipe', CASE WHEN n %% 2 = 0 THEN 'C' ELSE 'R' END,
+                   CASE WHEN n %% 2 = 0 THEN 20 END, CASE WHEN n %% 2 = 1 THEN 30 END, CASE WHEN n %% 2 = 1 THEN 20 END
+            FROM generate_series(1, %s) AS n
+            """,
+            [recipes],
+        )
+        cursor.execute(
+            """
+            INSERT INTO management_recipeingredient (recipe_id, ingredient_id, quantity_in_grams, created_at, updated_at)
+            SELECT r.id, i.id, 10 + line * 5, now(), now()
+            FROM (SELECT id, row_number() OVER (ORDER BY id) AS position FROM management_recipe) AS r
+            CROSS JOIN generate_series(0, 7) AS line
+            JOIN (SELECT id, row_number() OVER (ORDER BY id) - 1 AS position FROM management_ingredient) AS i
+              ON i.position = (r.position * 8 + line) %% %s
+            """,
+            [ingredients],
+        )
+        cursor.execute(
+            """
+            INSERT INTO management_product (product_type, sale_price, recipe_id, created_at, updated_at)
+            SELECT 'Product ' || n, 5 + n %% 60, r.id, now(), now()
+            FROM generate_series(1, %s) AS n
+            JOIN (SELECT id, row_number() OVER (ORDER BY id) AS position FROM management_recipe) AS r
+              ON r.position = 1 + n %% %s
+            """,
+            [size, recipes],
+        )
+        cursor.execute(
+            """
+            INSERT INTO management_productvariation (product_id, diameter, length, width, main_variation)
+            SELECT p.id, r.diameter * scale, r.length * scale, r.width * scale, scale = 1
+            FROM management_product p JOIN management_recipe r ON r.id = p.recipe_id
+            CROSS JOIN (VALUES (1), (1.5)) AS scales (scale)
+            """
+        )
+        cursor.execute('ANALYZE')
+    RecipeCost.objects.refresh_dirty()
+
+
+def _percentile(timings, percent):
+    ordered = sorted(timings)
+    return ordered[min(len(ordered) - 1, round(percent / 100 * (len(ordered) - 1)))]
+
+
+def measure(request, repeat=None, before=None):
+    """
+    Time ``request()`` ``repeat`` times, calling ``before()`` ahead of each run (outside the
+    timing), then count the queries and trace the peak memory of one more run.
+    """
+    timings = []
+    for _ in range(repeat or runs()):
+        if before:
+            before()
+        started = time.perf_counter()
+        request()
+        timings.append((time.perf_counter() - started) * 1000)
+    if before:
+        before()
+    with CaptureQueriesContext(connection) as queries:
+        tracemalloc.start()
+        try:
+            request()
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+    return {
+        'runs': len(timings),
+        'mean_ms': round(statistics.fmean(timings), 2),
+        'p50_ms': round(_percentile(timings, 50), 2),
+        'p95_ms': round(_percentile(timings, 95), 2),
+        'p99_ms': round(_percentile(timings, 99), 2),
+        'queries': len([query for query in queries if not query['sql'].startswith(TRANSACTION_CONTROL)]),
+        'peak_kib': round(peak / 1024, 1),
+    }
+
+
+def write(size, results):
+    path = os.environ.get('BENCHMARK_JSON')
+    if not path:
+        return
+    path = Path(path)
+    document = json.loads(path.read_text()) if path.exists() else {'sizes': {}}
+    document['meta'] = {
+        'python': platform.python_version(),
+        'django': django.get_version(),
+        'database': connection.vendor,
+        'runs': runs(),
+        'written_at': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+    }
+    document['sizes'][str(size)] = results
+    path.write_text(json.dumps(document, indent=2, sort_keys=True))
+
+
+def regressions(size, results):
+    """How ``results`` are worse than BENCHMARK_BASELINE's at the same size, as readable lines."""
+    path = os.environ.get('BENCHMARK_BASELINE')
+    if not path:
+        return []
+    tolerance = float(os.environ.get('BENCHMARK_TOLERANCE', '0.25'))
+    baseline = json.loads(Path(path).read_text())['sizes'].get(str(size), {})
+    found = []
+    for name, result in results.items():
+        before = baseline.get(name)
+        if before is None:
+            continue
+        if result['p95_ms'] > before['p95_ms'] * (1 + tolerance):
+            found.append(f"{name}: p95 {result['p95_ms']} ms, baseline {before['p95_ms']} ms")
+        if result['queries'] > before['queries']:
+            found.append(f"{name}: {result['queries']} queries, baseline {before['queries']}")
+    return found
+
+
+def report(size, results):
+    lines = [f'{name:<40} p50 {r["p50_ms"]:>8.2f} ms  p95 {r["p95_ms"]:>8.2f} ms  {r["queries"]:>3} queries  '
+             f'{r["peak_kib"]:>9.1f} KiB' for name, r in sorted(results.items())]
+    print(f'\nviews at {size} products\n' + '\n'.join(lines))
+
+
+def micro(fn, repeat=5, budget=0.05):
+    """
+    Per-call cost of ``fn()``: the median time over ``repeat`` timed loops of as many calls as fill
+    ``budget`` seconds, and the queries and peak traced memory of a single call.
+    """
+    fn()
+    number = 1
+    while True:
+        started = time.perf_counter()
+        for _ in range(number):
+            fn()
+        if time.perf_counter() - started >= budget or number >= 2 ** 16:
+            break
+        number *= 2
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        for _ in range(number):
+            fn()
+        timings.append((time.perf_counter() - started) / number)
+    with CaptureQueriesContext(connection) as queries:
+        tracemalloc.start()
+        try:
+            before = tracemalloc.get_traced_memory()[0]
+            fn()
+            peak = tracemalloc.get_traced_memory()[1] - before
+        finally:
+            tracemalloc.stop()
+    return {
+        'us_per_call': round(statistics.median(timings) * 1e6, 2),
+        'calls': number * repeat,
+        'queries': len([query for query in queries if not query['sql'].startswith(TRANSACTION_CONTROL)]),
+        'alloc_kib': round(peak / 1024, 2),
+    }
+
+
+BASELINES = Path(__file__).parent / 'baselines'
+
+
+def check_baseline(name, results):
+    """
+    Compare ``results`` with baselines/<name>.json and return the regressions as readable lines,
+    or record them as the new baseline with BENCHMARK_UPDATE_BASELINE=1.
+    """
+    path = BASELINES / f'{name}.json'
+    if os.environ.get('BENCHMARK_UPDATE_BASELINE'):
+        document = json.loads(path.read_text()) if path.exists() else {
+            'thresholds': {'time': 0.5, 'alloc': 0.25, 'alloc_slack_kib': 4}, 'results': {},
+        }
+        document['results'].update(results)
+        path.write_text(json.dumps(document, indent=2, sort_keys=True) + '\n')
+        return []
+    document = json.loads(path.read_text())
+    thresholds, baseline = document['thresholds'], document['results']
+    check_time = bool(os.environ.get('BENCHMARK_CHECK_TIME'))
+    found = []
+    for key, result in results.items():
+        before = baseline.get(key)
+        if before is None:
+            continue
+        if result['queries'] > before['queries']:
+            found.append(f"{key}: {result['queries']} queries, baseline {before['queries']}")
+        allowed = before['alloc_kib'] * (1 + thresholds['alloc']) + thresholds['alloc_slack_kib']
+        if result['alloc_kib'] > allowed:
+            found.append(f"{key}: {result['alloc_kib']} KiB allocated, baseline {before['alloc_kib']} KiB")
+        if check_time and result['us_per_call'] > before['us_per_call'] * (1 + thresholds['time']):
+            found.append(f"{key}: {result['us_per_call']} us per call, baseline {before['us_per_call']} us")
+    return found
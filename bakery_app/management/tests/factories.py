@@ -0,0 +1,68 @@
+import random
+
+import factory
+from factory import Faker, LazyFunction, Sequence, SubFactory
+
+from bakery_app.management.models import Ingredient, Product, ProductVariation, Recipe, RecipeIngredient, Supplier
+
+# this definition was found in https://github.com/joke2k/faker/issues/966 as char length with Faker was throwing errors that passed char limits
+
+def factory_lazy_function(value, max_length=None):
+    if max_length is None:
+        max_length = len(value)
+
+    return factory.LazyFunction(lambda: value[:max_length])
+
+fake = factory.faker.faker.Faker()
+
+class SupplierFactory(factory.django.DjangoModelFactory):
+    class Meta:
+        model = Supplier
+
+    name = factory_lazy_function(value=fake.company(), max_length=20)
+    ruc = factory_lazy_function(value=fake.isbn13(separator=""), max_length=13)
+    email = factory_lazy_function(value=fake.email(), max_length=20)
+    phone = factory_lazy_function(value=fake.phone_number(), max_length=20)
+    address = factory_lazy_function(value=fake.address(), max_length=20)
+
+class IngredientFactory(factory.django.DjangoModelFactory):
+    class Meta:
+        model = Ingredient
+
+    name = factory_lazy_function(value=fake.word(), max_length=20)
+    supplier = SubFactory(SupplierFactory)
+    price_per_gram = LazyFunction(lambda: round(random.uniform(0.01, 100.00), 2))
+
+
+class RecipeFactory(factory.django.DjangoModelFactory):
+    class Meta:
+        model = Recipe
+
+    name = Sequence(lambda n: f'Test Recipe {n}')
+    description = Faker('sentence')
+    shape = 'C'
+    diameter = Faker('pydecimal', left_digits=2, right_digits=2, positive=True)
+
+class RecipeIngredientFactory(factory.django.DjangoModelFactory):
+    class Meta:
+        model = RecipeIngredient
+
+    recipe = SubFactory(RecipeFactory)
+    ingredient = SubFactory(IngredientFactory)
+    quantity_in_grams = Faker('pydecimal', left_digits=5, right_digits=2, positive=True)
+
+class ProductFactory(factory.django.DjangoModelFactory):
+    class Meta:
+        model = Product
+
+    product_type = Sequence(lambda n: f'Test Product {n}')
+    sale_price = Faker('pydecimal', left_digits=3, right_digits=2, positive=True)
+    recipe = SubFactory(RecipeFactory)
+
+
+class ProductVariationFactory(factory.django.DjangoModelFactory):
+    class Meta:
+        model = ProductVariation
+
+    product = SubFactory(ProductFactory)
+    diameter = Faker('pydecimal', left_digits=2, right_digits=2, positive=True)
@@ -0,0 +1,276 @@
+import json
+import time
+from datetime import timedelta
+from decimal import Decimal
+from http import HTTPStatus
+from io import StringIO
+
+import numpy as np
+import pytest
+from django.core.exceptions import ValidationError
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.test import TestCase
+from django.urls import reverse
+from django.utils import timezone
+
+from bakery_app.management import costing, seeding
+from bakery_app.management.models import Ingredient, IngredientPrice, Product, ProductVariation, Supplier
+from bakery_app.management.tests.factories import (
+    IngredientFactory,
+    ProductFactory,
+    ProductVariationFactory,
+    RecipeFactory,
+    RecipeIngredientFactory,
+)
+
+
+@pytest.mark.django_db
+class TestCostingParity(TestCase):
+    def setUp(self):
+        ingredients = [IngredientFactory(price_per_gram=Decimal(price)) for price in ('0.01', '0.35', '2.45', '17.80')]
+        circular = RecipeFactory(shape='C', diameter=Decimal('22.00'))
+        rectangular = RecipeFactory(shape='R', diameter=None, length=Decimal('32.50'), width=Decimal('21.25'))
+        empty = RecipeFactory(shape='C', diameter=Decimal('10.00'))
+        for recipe in (circular, rectangular):
+            for ingredient, quantity in zip(ingredients, ('2.50', '333.33', '47.15', '1.05')):
+                RecipeIngredientFactory(recipe=recipe, ingredient=ingredient, quantity_in_grams=Decimal(quantity))
+        for recipe, sale_price in ((circular, '45.00'), (circular, '12.99'), (rectangular, '80.50'), (empty, '5.00')):
+            product = ProductFactory(recipe=recipe, sale_price=Decimal(sale_price))
+            for size in ('7.50', '15.25', '31.00'):
+                ProductVariationFactory(
+                    product=product, diameter=Decimal(size), length=Decimal(size), width=Decimal('9.99'), main_variation=False
+                )
+
+    def test_products_match_properties(self):
+        result = costing.catalog_costing()
+        for row in result.products():
+            product = Product.objects.get(pk=row['id'])
+            self.assertEqual(row['total_cost'], product.calculate_cost)
+            self.assertEqual(row['profit'], product.calculate_profit)
+            self.assertEqual(row['margin_percentage'], product.calculate_margin)
+
+    def test_variations_match_properties(self):
+        result = costing.catalog_costing()
+        rows = list(result.variations())
+        self.assertEqual(len(rows), ProductVariation.objects.count())
+        for row in rows:
+            variation = ProductVariation.objects.get(pk=row['id'])
+            self.assertEqual(row['surface_area'], variation.calculate_surface_area())
+            self.assertEqual(row['area_factor'], variation.adjustment_factor())
+            self.assertEqual(row['variation_cost'], variation.adjusted_cost)
+            self.assertEqual(row['variation_profit'], variation.adjusted_profit)
+            self.assertEqual(row['variation_margin'], variation.adjusted_margin)
+
+    def test_load_catalog_query_count(self):
+        with self.assertNumQueries(5):
+            costing.load_catalog()
+
+
+def test_divide_half_even_matches_decimal_rounding():
+    numerators = np.arange(-1000, 1000, dtype=np.int64)
+    rounded = costing.divide_half_even(numerators, 100)
+    for numerator, value in zip(numerators, rounded):
+        assert Decimal(int(numerator)).scaleb(-2).quantize(Decimal('1')) == int(value)
+
+
+def synthetic_catalog(variations, products=10_000, recipes=2_000, ingredients=500, per_recipe=12, seed=7):
+    rng = np.random.default_rng(seed)
+    ri_recipe = np.repeat(np.arange(recipes), per_recipe)
+    product_recipe = rng.integers(0, recipes, products)
+    variation_product = np.sort(rng.integers(0, products, variations))
+    main = np.zeros(variations, dtype=bool)
+    main[np.unique(variation_product, return_index=True)[1]] = True
+    return costing.Catalog(
+        ingredient_ids=np.arange(1, ingredients + 1),
+        ingredient_prices=rng.integers(1, 5_000, ingredients),
+        ingredient_suppliers=np.array([f'supplier-{n % 50}' for n in range(ingredients)], dtype=object),
+        recipe_ids=np.arange(1, recipes + 1),
+        recipe_shapes=rng.integers(costing.CIRCULAR, costing.RECTANGULAR + 1, recipes),
+        ri_recipe=ri_recipe,
+        ri_ingredient=rng.integers(0, ingredients, len(ri_recipe)),
+        ri_quantity=rng.integers(1, 100_000, len(ri_recipe)),
+        product_ids=np.arange(1, products + 1),
+        product_recipe=product_recipe,
+        product_sale_price=rng.integers(100, 50_000, products),
+        variation_ids=np.arange(1, variations + 1),
+        variation_product=variation_product,
+        variation_main=main,
+        variation_diameter=rng.integers(500, 6_000, variations),
+        variation_length=rng.integers(500, 6_000, variations),
+        variation_width=rng.integers(500, 6_000, variations),
+    )
+
+
+@pytest.mark.benchmark
+def test_compute_benchmark_100k_variations():
+    catalog = synthetic_catalog(variations=100_000)
+    started = time.perf_counter()
+    result = costing.compute(catalog)
+    elapsed = time.perf_counter() - started
+    print(f"costing.compute: 100k variations in {elapsed * 1000:.1f} ms")
+    assert len(result.variation_cost) == 100_000
+    assert elapsed < 5
+
+
+@pytest.mark.django_db
+class TestPriceSimulation(TestCase):
+    def setUp(self):
+        self.flour = IngredientFactory(price_per_gram=Decimal('0.10'))
+        self.butter = IngredientFactory(price_per_gram=Decimal('0.40'))
+        bread = RecipeFactory()
+        pastry = RecipeFactory()
+        RecipeIngredientFactory(recipe=bread, ingredient=self.flour, quantity_in_grams=Decimal('100.00'))
+        RecipeIngredientFactory(recipe=pastry, ingredient=self.butter, quantity_in_grams=Decimal('50.00'))
+        self.bread = ProductFactory(recipe=bread, sale_price=Decimal('20.00'))
+        self.pastry = ProductFactory(recipe=pastry, sale_price=Decimal('40.00'))
+
+    def test_supplier_percentage_ranks_affected_products_first(self):
+        simulation = costing.simulate(supplier_percentages={self.butter.supplier_id: Decimal('50')})
+        rows = list(simulation.products())
+        self.assertEqual(rows[0]['id'], self.pastry.pk)
+        self.assertEqual(rows[0]['new_total_cost'], Decimal('30.00'))
+        self.assertEqual(rows[0]['margin_delta'], Decimal('-25.00'))
+        self.assertEqual(rows[1]['margin_delta'], Decimal('0.00'))
+
+    def test_ingredient_price_overrides_supplier_change_and_target_filters(self):
+        simulation = costing.simulate(
+            ingredient_prices={self.flour.pk: Decimal('0.15')},
+            supplier_percentages={self.flour.supplier_id: Decimal('900')},
+        )
+        rows = list(simulation.products(target_margin=Decimal('50')))
+        self.assertEqual([row['id'] for row in rows], [self.bread.pk])
+        self.assertEqual(rows[0]['new_margin_percentage'], Decimal('25.00'))
+
+    def test_cached_catalog_is_reloaded_after_a_committed_write(self):
+        catalog = costing.cached_catalog()
+        self.assertIs(costing.cached_catalog(), catalog)
+        self.assertIs(catalog.costing, catalog.costing)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.flour.price_per_gram = Decimal('0.20')
+            self.flour.save()
+        reloaded = costing.cached_catalog()
+        self.assertIsNot(reloaded, catalog)
+        simulation = costing.simulate(catalog=reloaded)
+        self.assertEqual(next(simulation.products())['total_cost'], Decimal('20.00'))
+
+    def test_simulation_does_not_write(self):
+        costing.simulate(ingredient_prices={self.flour.pk: Decimal('9.99')})
+        self.flour.refresh_from_db()
+        self.assertEqual(self.flour.price_per_gram, Decimal('0.10'))
+
+
+@pytest.mark.benchmark
+def test_simulation_benchmark_50k_products():
+    catalog = synthetic_catalog(variations=100_000, products=50_000, recipes=10_000)
+    started = time.perf_counter()
+    prices = costing.simulated_prices(catalog, supplier_percentages={'supplier-3': Decimal('7.5')})
+    simulation = costing.PriceSimulation(costing.compute(catalog), costing.compute(catalog, prices))
+    rows = list(simulation.products(limit=100))
+    elapsed = time.perf_counter() - started
+    print(f"price simulation: 50k products in {elapsed * 1000:.1f} ms")
+    assert len(rows) == 100
+    assert elapsed < 1
+
+
+@pytest.mark.benchmark
+@pytest.mark.django_db(transaction=True)
+def test_simulation_api_benchmark_50k_products(client, user):
+    with transaction.atomic():
+        seeding.seed(50_000, seed=1)
+    supplier = Supplier.objects.order_by('pk').first()
+    client.force_login(user)
+    url = reverse('management:price-simulation-api')
+    payload = json.dumps({'suppliers': {str(supplier.pk): '7.5'}, 'limit': 100})
+    timings = []
+    for _ in range(3):
+        started = time.perf_counter()
+        response = client.post(url, payload, content_type='application/json')
+        timings.append(time.perf_counter() - started)
+        assert response.status_code == HTTPStatus.OK
+    print(
+        f"\nprice simulation API: 50k products, first request {timings[0] * 1000:.1f} ms, "
+        f"then {min(timings[1:]) * 1000:.1f} ms on the cached catalog"
+    )
+    assert len(response.json()['products']) == 100
+    assert max(timings[1:]) < 1
+
+
+@pytest.mark.django_db
+class TestPointInTimeCosting(TestCase):
+    def setUp(self):
+        self.flour = IngredientFactory(price_per_gram=Decimal('0.10'))
+        self.butter = IngredientFactory(price_per_gram=Decimal('0.40'))
+        recipe = RecipeFactory()
+        RecipeIngredientFactory(recipe=recipe, ingredient=self.flour, quantity_in_grams=Decimal('100.00'))
+        RecipeIngredientFactory(recipe=recipe, ingredient=self.butter, quantity_in_grams=Decimal('50.00'))
+        self.product = ProductFactory(recipe=recipe, sale_price=Decimal('50.00'))
+        self.recipe = recipe
+
+    def test_price_changes_are_recorded(self):
+        self.flour.price_per_gram = Decimal('0.25')
+        self.flour.save()
+        history = list(self.flour.price_history.order_by('effective_at').values_list('price_per_gram', flat=True))
+        self.assertEqual(history, [Decimal('0.10'), Decimal('0.25')])
+        self.flour.name = 'Rye flour'
+        self.flour.save()
+        self.assertEqual(self.flour.price_history.count(), 2)
+
+    def test_history_is_append_only(self):
+        entry = self.flour.price_history.get()
+        entry.price_per_gram = Decimal('9.99')
+        with self.assertRaises(ValidationError):
+            entry.save()
+
+    def test_as_of_uses_price_in_effect(self):
+        last_month = timezone.now() - timedelta(days=30)
+        IngredientPrice.objects.all().update(effective_at=last_month - timedelta(days=1))
+        IngredientPrice.objects.create(ingredient=self.flour, price_per_gram=Decimal('0.20'), effective_at=last_month + timedelta(days=1))
+        self.flour.price_per_gram = Decimal('0.30')
+        self.flour.save()
+
+        self.assertEqual(IngredientPrice.objects.as_of(last_month).count(), 2)
+        past = costing.as_of(last_month)
+        self.assertEqual(list(past.recipes()), [{'id': self.recipe.pk, 'cost': Decimal('30.00')}])
+        self.assertEqual(next(past.products())['total_cost'], Decimal('30.00'))
+        self.assertEqual(next(costing.as_of(last_month + timedelta(days=2)).products())['total_cost'], Decimal('40.00'))
+        self.assertEqual(next(costing.catalog_costing().products())['total_cost'], Decimal('50.00'))
+
+    def test_as_of_before_history_keeps_current_price(self):
+        long_ago = timezone.now() - timedelta(days=365)
+        self.assertEqual(next(costing.as_of(long_ago).products())['total_cost'], Decimal('30.00'))
+
+    def test_backfill_records_ingredients_without_history(self):
+        IngredientPrice.objects.filter(ingredient=self.butter).delete()
+        call_command('backfill_price_history', '--batch-size', '1', stdout=StringIO())
+        entry = self.butter.price_history.get()
+        self.assertEqual(entry.price_per_gram, Decimal('0.40'))
+        self.assertEqual(entry.effective_at, self.butter.created_at)
+        self.assertEqual(IngredientPrice.objects.count(), 2)
+
+
+@pytest.mark.benchmark
+@pytest.mark.django_db
+def test_as_of_benchmark_2m_history_rows():
+    ingredients = Ingredient.objects.bulk_create(
+        Ingredient(name=f'Ingredient {i}', price_per_gram=Decimal('1.00')) for i in range(2000)
+    )
+    with connection.cursor() as cursor:
+        # 1000 price changes per ingredient, one per day
+        cursor.execute(
+            """
+            INSERT INTO management_ingredientprice (ingredient_id, price_per_gram, effective_at)
+            SELECT i.id, 1 + (day %% 97) / 100.0, now() - make_interval(days => day)
+            FROM management_ingredient i CROSS JOIN generate_series(1, 1000) AS day
+            WHERE i.id >= %s
+            """,
+            [ingredients[0].pk],
+        )
+        cursor.execute('ANALYZE management_ingredientprice')
+    catalog = costing.load_catalog()
+    started = time.perf_counter()
+    prices = costing.historical_prices(catalog, timezone.now() - timedelta(days=500))
+    elapsed = time.perf_counter() - started
+    print(f"costing.historical_prices: 2M history rows in {elapsed * 1000:.1f} ms")
+    assert len(prices) == 2000
+    assert elapsed < 10
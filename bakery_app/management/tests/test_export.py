@@ -0,0 +1,122 @@
+import csv
+import io
+import time
+import tracemalloc
+import zipfile
+from decimal import Decimal
+from xml.etree import ElementTree
+
+import pytest
+from django.db import connection
+from django.urls import reverse
+
+from bakery_app.management import export
+from bakery_app.management.models import Ingredient, Product, Recipe, RecipeCost, RecipeIngredient
+from bakery_app.management.tables import ProductTable
+
+SHEET_NS = {'s': 'http://schemas.openxmlformats.org/spreadsheetml/2006/main'}
+
+
+@pytest.fixture
+def cakes(db):
+    flour = Ingredient.objects.create(name='Flour & "Co"', price_per_gram='2.50')
+    recipe = Recipe.objects.create(name='Cake', description='Sponge', shape='C', diameter='20.00')
+    RecipeIngredient.objects.create(recipe=recipe, ingredient=flour, quantity_in_grams='4.00')
+    for product_type, sale_price in (('Sponge', '30.00'), ('Lemon', '12.00'), ('Free sample', '0.00')):
+        Product.objects.create(product_type=product_type, sale_price=sale_price, recipe=recipe)
+    RecipeCost.objects.refresh_dirty()
+
+
+def read_xlsx(content):
+    archive = zipfile.ZipFile(io.BytesIO(content))
+    assert 'xl/workbook.xml' in archive.namelist()
+    sheet = ElementTree.fromstring(archive.read('xl/worksheets/sheet1.xml'))
+    rows = []
+    for row in sheet.iterfind('.//s:row', SHEET_NS):
+        cells = []
+        for cell in row.iterfind('s:c', SHEET_NS):
+            text = cell.find('.//s:t', SHEET_NS)
+            cells.append(text.text if text is not None else Decimal(cell.find('s:v', SHEET_NS).text))
+        rows.append(cells)
+    return rows
+
+
+def test_product_csv_export_is_filtered_and_sorted(client, cakes):
+    response = client.get(reverse('management:table-export', args=['products', 'csv']), {'sort': '-profit', 'profit_min': '0'})
+    assert response.streaming
+    assert response['Content-Disposition'].startswith('attachment; filename="products-')
+    rows = list(csv.reader(io.StringIO(b''.join(response.streaming_content).decode())))
+    assert rows == [
+        ['Product type', 'Sale price', 'Total Cost $USD', 'Profit $USD', 'Margin (%)'],
+        ['Sponge', '30.00', '10.00', '20.00', '66.67'],
+        ['Lemon', '12.00', '10.00', '2.00', '16.67'],
+    ]
+
+
+def test_xlsx_export_is_a_readable_workbook(client, cakes):
+    response = client.get(reverse('management:table-export', args=['products', 'xlsx']), {'sort': 'sale_price'})
+    assert response['Content-Type'] == export.CONTENT_TYPES['xlsx']
+    rows = read_xlsx(b''.join(response.streaming_content))
+    assert rows[0] == ['Product type', 'Sale price', 'Total Cost $USD', 'Profit $USD', 'Margin (%)']
+    # NULL margin is an empty cell; numbers are numeric cells
+    assert rows[1] == ['Free sample', Decimal('0.00'), Decimal('10.00'), Decimal('-10.00')]
+    assert rows[3] == ['Sponge', Decimal('30.00'), Decimal('10.00'), Decimal('20.00'), Decimal('66.67')]
+
+    rows = read_xlsx(b''.join(client.get(reverse('management:table-export', args=['ingredients', 'xlsx'])).streaming_content))
+    assert rows == [['Ingredient Name', 'Weight (grams)'], ['Flour & "Co"', Decimal('2.50')]]
+
+
+def test_variation_export_renders_template_columns(client, cakes):
+    Product.objects.get(product_type='Sponge').variations.create(diameter='10.00')
+    response = client.get(reverse('management:table-export', args=['variations', 'csv']), {'sort': '-adjusted_cost'})
+    header, *rows = csv.reader(io.StringIO(b''.join(response.streaming_content).decode()))
+    assert header[:3] == ['Product type', 'Shape', 'Dimensions']
+    assert sorted(row[0] for row in rows[:3]) == ['Free sample', 'Lemon', 'Sponge']
+    assert rows[-1][0] == 'Sponge'
+    assert rows[-1][3] == '2.50'
+
+
+def test_unknown_exports_are_not_found(client, db):
+    assert client.get(reverse('management:table-export', args=['suppliers', 'csv'])).status_code == 404
+    assert client.get(reverse('management:table-export', args=['products', 'pdf'])).status_code == 404
+
+
+@pytest.mark.benchmark
+def test_export_benchmark_memory_stays_flat(cakes):
+    recipe = Recipe.objects.get()
+    with connection.cursor() as cursor:
+        cursor.execute(
+            """
+            INSERT INTO management_product (product_type, sale_price, recipe_id, created_at, updated_at)
+            SELECT 'Cake ' || n, 10 + n %% 40, %s, now(), now() FROM generate_series(1, 50000) AS n
+            """,
+            [recipe.pk],
+        )
+
+    def products(limit):
+        return ProductTable(Product.objects.with_costing().filter(pk__in=Product.objects.order_by('pk').values('pk')[:limit]))
+
+    def peak_memory(limit, stream):
+        # tracemalloc slows every allocation down, so memory is traced over fewer rows and smaller chunks
+        tracemalloc.start()
+        for _ in stream(export.table_rows(products(limit), chunk_size=500)):
+            pass
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        return peak
+
+    for name, stream in (('csv', export.csv_stream), ('xlsx', export.xlsx_stream)):
+        started = time.perf_counter()
+        chunks = stream(export.table_rows(products(50_000)))
+        first = next(chunks)
+        first_byte = time.perf_counter() - started
+        size = len(first) + sum(len(chunk) for chunk in chunks)
+        elapsed = time.perf_counter() - started
+        small_peak, peak = peak_memory(1_000, stream), peak_memory(4_000, stream)
+        print(
+            f"{name} export, 50k products: {elapsed:.1f} s, first bytes after {first_byte * 1000:.1f} ms, "
+            f"{size / 2**20:.1f} MiB out; peak Python memory {small_peak / 2**20:.2f} MiB at 1k rows, "
+            f"{peak / 2**20:.2f} MiB at 4k rows"
+        )
+        assert first_byte < 0.05
+        assert peak < small_peak * 1.5
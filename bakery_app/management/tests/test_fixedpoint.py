@@ -0,0 +1,107 @@
+import random
+import time
+from decimal import Decimal
+
+import pytest
+
+from bakery_app.management import fixedpoint
+from bakery_app.management.fixedpoint import to_decimal, to_micro
+from bakery_app.management.models import pi
+
+
+def cents(rng, high):
+    return Decimal(rng.randint(0, high)).scaleb(-2)
+
+
+# The Decimal formulas used by the model properties
+def decimal_circle_area(diameter):
+    return Decimal(pi * ((diameter / Decimal('2.0')) ** 2)).quantize(Decimal('.01'))
+
+
+def decimal_factor(area, main_area):
+    return (area / main_area).quantize(Decimal('.01'))
+
+
+def decimal_margin(profit, sale_price):
+    return round((profit / sale_price) * 100, 2)
+
+
+def test_circle_area_matches_decimal_for_every_diameter():
+    # Every value a DecimalField(max_digits=5, decimal_places=2) can hold
+    for hundredths in range(100_000):
+        diameter = Decimal(hundredths).scaleb(-2)
+        assert to_decimal(fixedpoint.circle_area(to_micro(diameter))) == decimal_circle_area(diameter), diameter
+
+
+def test_rectangle_area_and_factor_match_decimal():
+    rng = random.Random(3)
+    for _ in range(20_000):
+        length, width, main_length = cents(rng, 99_999), cents(rng, 99_999), cents(rng, 99_999) + Decimal('0.01')
+        area = (length * width).quantize(Decimal('.01'))
+        main_area = (main_length * width).quantize(Decimal('.01'))
+        assert to_decimal(fixedpoint.rectangle_area(to_micro(length), to_micro(width))) == area
+        if main_area > 0:
+            assert to_decimal(fixedpoint.adjustment_factor(to_micro(area), to_micro(main_area))) == decimal_factor(area, main_area)
+
+
+def test_cost_and_margin_match_decimal():
+    rng = random.Random(5)
+    for _ in range(20_000):
+        cost, factor = cents(rng, 10_000_000), cents(rng, 1_000)
+        sale_price = cents(rng, 100_000) + Decimal('0.01')
+        adjusted_cost = round(cost * factor, 2)
+        assert to_decimal(fixedpoint.adjusted_cost(to_micro(cost), to_micro(factor))) == adjusted_cost
+        profit = sale_price - adjusted_cost
+        assert to_decimal(fixedpoint.margin(to_micro(profit), to_micro(sale_price))) == decimal_margin(profit, sale_price)
+
+
+def test_sub_recipe_line_cost_matches_decimal():
+    rng = random.Random(9)
+    for _ in range(20_000):
+        quantity, cost, weight = cents(rng, 9_999_999), cents(rng, 10_000_000), cents(rng, 9_999_999) + Decimal('0.01')
+        expected = (quantity * cost / weight).quantize(Decimal('.0001'))
+        assert to_decimal(fixedpoint.sub_recipe_line_cost(to_micro(quantity), to_micro(cost), to_micro(weight)), 4) == expected
+
+
+def test_half_even_ties():
+    assert fixedpoint.round_to(5, 1000) == 0
+    assert fixedpoint.round_to(15, 1000) == 20_000
+    assert fixedpoint.round_to(-15, 1000) == -20_000
+    assert fixedpoint.margin(to_micro('-1.00'), to_micro('-8.00')) == to_micro('12.50')
+
+
+@pytest.mark.benchmark
+def test_fixed_point_benchmark_100k_variations():
+    rng = random.Random(1)
+    rows = [(cents(rng, 9_999), cents(rng, 9_999), cents(rng, 100_000), cents(rng, 50_000) + 1) for _ in range(100_000)]
+
+    started = time.perf_counter()
+    for diameter, main_diameter, cost, sale_price in rows:
+        factor = decimal_factor(decimal_circle_area(diameter), decimal_circle_area(main_diameter) or Decimal('1'))
+        decimal_margin(sale_price - round(cost * factor, 2), sale_price)
+    decimal_elapsed = time.perf_counter() - started
+
+    started = time.perf_counter()
+    for diameter, main_diameter, cost, sale_price in rows:
+        sale_price = to_micro(sale_price)
+        factor = fixedpoint.adjustment_factor(
+            fixedpoint.circle_area(to_micro(diameter)), fixedpoint.circle_area(to_micro(main_diameter)) or fixedpoint.MICRO
+        )
+        fixedpoint.margin(sale_price - fixedpoint.adjusted_cost(to_micro(cost), factor), sale_price)
+    converting_elapsed = time.perf_counter() - started
+
+    # Values that stay in micro-units between steps, as when they are loaded as integers
+    micro_rows = [tuple(to_micro(value) for value in row) for row in rows]
+    started = time.perf_counter()
+    for diameter, main_diameter, cost, sale_price in micro_rows:
+        factor = fixedpoint.adjustment_factor(
+            fixedpoint.circle_area(diameter), fixedpoint.circle_area(main_diameter) or fixedpoint.MICRO
+        )
+        fixedpoint.margin(sale_price - fixedpoint.adjusted_cost(cost, factor), sale_price)
+    fixed_elapsed = time.perf_counter() - started
+
+    print(
+        f"variation costing, 100k rows: Decimal {decimal_elapsed * 1000:.1f} ms, "
+        f"fixed point from Decimal {converting_elapsed * 1000:.1f} ms, fixed point {fixed_elapsed * 1000:.1f} ms"
+    )
+    assert fixed_elapsed < decimal_elapsed
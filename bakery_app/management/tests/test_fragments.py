@@ -0,0 +1,200 @@
+import json
+import time
+
+import pytest
+from django.core.cache import cache
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from bakery_app.management import fragments
+from bakery_app.management.forms import ProductVariationForm
+from bakery_app.management.models import Ingredient, Product, Recipe, RecipeCost, RecipeIngredient
+from bakery_app.management.views import product_list_view
+
+
+@pytest.fixture
+def cake(db):
+    flour = Ingredient.objects.create(name='Flour', price_per_gram='2.50')
+    recipe = Recipe.objects.create(name='Cake', description='Sponge', shape='C', diameter='20.00')
+    RecipeIngredient.objects.create(recipe=recipe, ingredient=flour, quantity_in_grams='4.00')
+    product = Product.objects.create(product_type='Sponge cake', sale_price='30.00', recipe=recipe)
+    RecipeCost.objects.refresh_dirty()
+    return product
+
+
+def htmx_get(rf, **params):
+    request = rf.get('/', params, HTTP_HX_REQUEST='true')
+    request.htmx = True
+    return product_list_view(request).content.decode()
+
+
+def test_repeated_partial_is_served_from_cache(rf, cake, django_assert_num_queries):
+    first = htmx_get(rf, sort='-profit')
+    with django_assert_num_queries(0):
+        assert htmx_get(rf, sort='-profit') == first
+    assert fragments.stats() == {'hits': 1, 'misses': 1, 'hit_rate': 0.5}
+
+    # Another sort, filter or cursor is another fragment
+    htmx_get(rf, sort='profit')
+    htmx_get(rf, sort='-profit', total_cost_max='5')
+    assert fragments.stats()['misses'] == 3
+
+
+def test_writes_bump_generations(rf, cake, django_capture_on_commit_callbacks):
+    assert '10.00' in htmx_get(rf)
+
+    flour = Ingredient.objects.get(name='Flour')
+    flour.price_per_gram = '3.00'
+    with django_capture_on_commit_callbacks(execute=True):
+        flour.save()
+    assert '12.00' in htmx_get(rf)
+
+    with django_capture_on_commit_callbacks(execute=True):
+        Product.objects.create(product_type='Lemon cake', sale_price='18.00', recipe=cake.recipe)
+    assert 'Lemon cake' in htmx_get(rf)
+
+    with django_capture_on_commit_callbacks(execute=True):
+        cake.delete()
+    assert 'Sponge cake' not in htmx_get(rf)
+    assert fragments.stats() == {'hits': 0, 'misses': 4, 'hit_rate': 0.0}
+
+
+def test_generation_is_only_bumped_on_commit(rf, cake, django_capture_on_commit_callbacks):
+    before = fragments.generations([Product])
+    with django_capture_on_commit_callbacks(execute=False) as callbacks:
+        Product.objects.create(product_type='Lemon cake', sale_price='18.00', recipe=cake.recipe)
+    assert fragments.generations([Product]) == before
+    for callback in callbacks:
+        callback()
+    assert fragments.generations([Product]) == [before[0] + 1]
+
+
+def test_table_view_htmx_requests_use_cache_and_stats_endpoint(client, django_user_model, cake):
+    user = django_user_model.objects.create_user(email='cache@example.com', password='12345')
+    client.force_login(user)
+    url = reverse('management:variations-table')
+    for _ in range(3):
+        response = client.get(url, {'sort': 'adjusted_cost'}, HTTP_HX_REQUEST='true')
+        assert response.status_code == 200
+    client.get(url)  # full page loads are not cached
+
+    # Cache internals are for staff only
+    stats_url = reverse('management:fragment-cache-stats')
+    assert client.get(stats_url).status_code == 302
+    user.is_staff = True
+    user.save()
+    stats = client.get(stats_url).json()
+    assert stats == {'hits': 2, 'misses': 1, 'hit_rate': 0.6667}
+
+
+def test_unchanged_partial_is_not_modified(client, django_user_model, cake, django_capture_on_commit_callbacks, django_assert_num_queries):
+    client.force_login(django_user_model.objects.create_user(email='etag@example.com', password='12345'))
+    url = reverse('management:product-table')
+    response = client.get(url, HTTP_HX_REQUEST='true')
+    etag = response.headers['ETag']
+    assert 'HX-Request' in response.headers['Vary']
+    # Full pages render the session's layout and CSRF token, so they are never a 304
+    page = client.get(url, HTTP_IF_NONE_MATCH=etag)
+    assert page.status_code == 200
+    assert 'ETag' not in page.headers and 'Last-Modified' not in page.headers
+    assert 'HX-Request' in page.headers['Vary']
+
+    # Only the session and user lookups run
+    with django_assert_num_queries(2):
+        response = client.get(url, HTTP_HX_REQUEST='true', HTTP_IF_NONE_MATCH=etag)
+    assert response.status_code == 304
+    assert response.content == b''
+
+    with django_capture_on_commit_callbacks(execute=True):
+        Product.objects.create(product_type='Lemon cake', sale_price='18.00', recipe=cake.recipe)
+    response = client.get(url, HTTP_HX_REQUEST='true', HTTP_IF_NONE_MATCH=etag)
+    assert response.status_code == 200
+    assert response.headers['ETag'] != etag
+    assert 'Last-Modified' in response.headers
+    assert client.get(url, HTTP_HX_REQUEST='true', HTTP_IF_MODIFIED_SINCE=response.headers['Last-Modified']).status_code == 304
+
+
+def test_product_shape_endpoints_are_conditional(client, cake, django_capture_on_commit_callbacks):
+    for name in ('get_product_shape', 'update_variation_form'):
+        url = reverse(f'management:{name}', args=[cake.pk])
+        response = client.get(url)
+        assert response.json() == {'shape': 'C'}
+        with CaptureQueriesContext(connection) as queries:
+            assert client.get(url, HTTP_IF_NONE_MATCH=response.headers['ETag']).status_code == 304
+        # ATOMIC_REQUESTS savepoints only
+        assert not [query for query in queries if 'SELECT' in query['sql']]
+
+    url = reverse('management:get_product_shape', args=[cake.pk])
+    etag = client.get(url).headers['ETag']
+    recipe = cake.recipe
+    recipe.shape = 'R'
+    with django_capture_on_commit_callbacks(execute=True):
+        recipe.save()
+    response = client.get(url, HTTP_IF_NONE_MATCH=etag)
+    assert response.status_code == 200
+    assert response.json() == {'shape': 'R'}
+
+
+def test_product_shapes_are_batched(client, cake):
+    tray = Recipe.objects.create(name='Tray bake', description='Flat', shape='R', length='30.00', width='20.00')
+    slab = Product.objects.create(product_type='Brownie slab', sale_price='25.00', recipe=tray)
+    url = reverse('management:product-shapes')
+
+    # One query for every product, however many are asked for
+    ids = {'ids': f'{cake.pk},{slab.pk},999999'}
+    with CaptureQueriesContext(connection) as queries:
+        response = client.get(url, ids)
+    assert len([query for query in queries if 'SELECT' in query['sql']]) == 1
+    assert response.json() == {'shapes': {
+        str(cake.pk): {'shape': 'C', 'diameter': '20.00', 'length': None, 'width': None},
+        str(slab.pk): {'shape': 'R', 'diameter': None, 'length': '30.00', 'width': '20.00'},
+    }}
+    assert client.get(url, ids, HTTP_IF_NONE_MATCH=response.headers['ETag']).status_code == 304
+
+    assert client.get(url, {'ids': 'cake'}).status_code == 400
+    assert client.get(url, {'ids': ','.join(map(str, range(1, 600)))}).status_code == 400
+    assert client.get(reverse('management:get_product_shape', args=[999999])).status_code == 404
+
+
+def test_variation_form_embeds_the_shape_map(cake):
+    html = str(ProductVariationForm(initial={'product': cake.pk})['product'])
+    assert 'data-shapes-url="/management/api/product-shapes/"' in html
+    shapes = json.loads(html.split('data-shapes="')[1].split('"')[0].replace('&quot;', '"'))
+    assert shapes == {str(cake.pk): {'shape': 'C', 'diameter': '20.00', 'length': None, 'width': None}}
+    assert 'data-shapes="{}"' in str(ProductVariationForm()['product'])
+
+
+@pytest.mark.benchmark
+def test_conditional_polling_benchmark(client, django_user_model, django_assert_num_queries):
+    recipe = Recipe.objects.create(name='Cake', description='Sponge', shape='C', diameter='20.00')
+    flour = Ingredient.objects.create(name='Flour', price_per_gram='2.50')
+    RecipeIngredient.objects.create(recipe=recipe, ingredient=flour, quantity_in_grams='4.00')
+    Product.objects.bulk_create(
+        Product(product_type=f'Cake {n}', sale_price=f'{10 + n % 40}.00', recipe=recipe) for n in range(5000)
+    )
+    RecipeCost.objects.refresh_dirty()
+    client.force_login(django_user_model.objects.create_user(email='poll@example.com', password='12345'))
+    url = reverse('management:product-table')
+    params = {'sort': '-margin_percentage', 'margin_percentage_max': '60'}
+
+    def poll(times, **headers):
+        started = time.perf_counter()
+        for _ in range(times):
+            response = client.get(url, params, HTTP_HX_REQUEST='true', **headers)
+        return (time.perf_counter() - started) / times * 1000, response
+
+    rendered = []
+    for _ in range(20):
+        cache.clear()
+        rendered.append(poll(1)[0])
+    render_ms = sum(rendered) / len(rendered)
+    cached_ms, response = poll(100)
+    not_modified_ms, not_modified = poll(100, HTTP_IF_NONE_MATCH=response.headers['ETag'])
+
+    print(
+        f"product table poll, 5000 products: render {render_ms:.2f} ms, fragment cache hit {cached_ms:.2f} ms, "
+        f"304 {not_modified_ms:.2f} ms"
+    )
+    assert not_modified.status_code == 304
+    assert not_modified_ms < cached_ms < render_ms
@@ -0,0 +1,69 @@
+import json
+import logging
+
+import pytest
+from django.http import HttpResponse
+from django.template.loader import render_to_string
+from django.test import override_settings
+from django.urls import reverse
+
+from bakery_app.management.instrumentation import QueryBudgetMiddleware
+from bakery_app.management.models import Ingredient, Product, Recipe, RecipeCost, RecipeIngredient
+
+LOGGER = 'bakery_app.management.instrumentation'
+
+
+@pytest.fixture
+def cake(db):
+    flour = Ingredient.objects.create(name='Flour', price_per_gram='2.50')
+    recipe = Recipe.objects.create(name='Cake', description='Sponge', shape='C', diameter='20.00')
+    RecipeIngredient.objects.create(recipe=recipe, ingredient=flour, quantity_in_grams='4.00')
+    product = Product.objects.create(product_type='Sponge cake', sale_price='30.00', recipe=recipe)
+    RecipeCost.objects.refresh_dirty()
+    return product
+
+
+def request_records(caplog):
+    return [record.request_stats for record in caplog.records if record.levelno == logging.INFO]
+
+
+def test_requests_are_logged_with_their_queries_cache_and_templates(client, django_user_model, cake, caplog):
+    client.force_login(django_user_model.objects.create_user(email='timing@example.com', password='12345'))
+    caplog.set_level(logging.INFO, logger=LOGGER)
+    url = reverse('management:product-table')
+    response = client.get(url, HTTP_HX_REQUEST='true')
+    assert 'Server-Timing' not in response.headers
+    client.get(url, HTTP_HX_REQUEST='true')
+
+    miss, hit = request_records(caplog)
+    assert miss['view'] == hit['view'] == 'management:product-table'
+    assert (miss['cache_hits'], miss['cache_misses'], hit['cache_hits'], hit['cache_misses']) == (0, 1, 1, 0)
+    assert miss['queries'] > hit['queries'] > 0
+    assert miss['template_ms'] > 0 and hit['template_ms'] == 0
+    assert miss['queries'] <= miss['budget']
+    assert json.loads(caplog.records[0].getMessage().removeprefix('request ')) == miss
+
+
+@override_settings(SERVER_TIMING_HEADER=True)
+def test_server_timing_header(client, cake):
+    timing = client.get(reverse('management:get_product_shape', args=[cake.pk])).headers['Server-Timing']
+    db, cache, template, total = timing.split(', ')
+    assert db.startswith('db;desc="1 queries";dur=')
+    assert cache == 'cache;desc="0 hits 0 misses"'
+    assert template.startswith('template;dur=') and total.startswith('total;dur=')
+
+
+@override_settings(QUERY_BUDGET_DEFAULT=3)
+def test_over_budget_requests_name_their_repeated_statements(rf, cake, caplog):
+    def n_plus_one(request):
+        names = [product.recipe.name for product in Product.objects.all()]
+        names += [Recipe.objects.get(pk=cake.recipe_id).name for _ in range(4)]
+        return HttpResponse(render_to_string('management/suppliers/search_results.html', {'term': ''}) + ','.join(names))
+
+    caplog.set_level(logging.INFO, logger=LOGGER)
+    QueryBudgetMiddleware(n_plus_one)(rf.get('/catalogue/'))
+    warning, = [record for record in caplog.records if record.levelno == logging.WARNING]
+    assert warning.getMessage().startswith('query budget exceeded: /catalogue/ ran 6 queries (budget 3)')
+    assert warning.request_stats['template_ms'] > 0
+    (statement, count), = json.loads(warning.getMessage().split('most repeated: ')[1])
+    assert count == 5 and statement.startswith('SELECT') and 'management_recipe' in statement
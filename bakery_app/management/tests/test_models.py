@@ -1,75 +1,26 @@
 import pytest
 from django.test import TestCase
 import factory
-from bakery_app.management.models import Supplier, Ingredient, Recipe, RecipeIngredient, Product, ProductVariation
+from bakery_app.management.models import Supplier, Ingredient, Recipe, RecipeIngredient, Product, ProductVariation, RecipeCost, ProductionPlan, ProductionPlanLine
 from factory import Faker, SubFactory, Sequence, post_generation, django, LazyFunction
 from django.core.exceptions import ValidationError
-from django.db import IntegrityError
+from django.core.management import call_command, CommandError
+from django.db import IntegrityError, connection
 from decimal import Decimal
+from bakery_app.management.managers import refresh_recipe_costs
 import random
+import time
+from io import StringIO
 import factory
 
-# this definition was found in https://github.com/joke2k/faker/issues/966 as char length with Faker was throwing errors that passed char limits
-
-def factory_lazy_function(value, max_length=None):
-    if max_length is None:
-        max_length = len(value)
-
-    return factory.LazyFunction(lambda: value[:max_length])
-
-fake = factory.faker.faker.Faker()
-
-class SupplierFactory(factory.django.DjangoModelFactory):
-    class Meta:
-        model = Supplier
-
-    name = factory_lazy_function(value=fake.company(), max_length=20)
-    ruc = factory_lazy_function(value=fake.isbn13(separator=""), max_length=13)
-    email = factory_lazy_function(value=fake.email(), max_length=20)
-    phone = factory_lazy_function(value=fake.phone_number(), max_length=20)
-    address = factory_lazy_function(value=fake.address(), max_length=20)
-
-class IngredientFactory(factory.django.DjangoModelFactory):
-    class Meta:
-        model = Ingredient
-
-    name = factory_lazy_function(value=fake.word(), max_length=20)
-    supplier = SubFactory(SupplierFactory)
-    price_per_gram = LazyFunction(lambda: round(random.uniform(0.01, 100.00), 2))
-
-
-class RecipeFactory(factory.django.DjangoModelFactory):
-    class Meta:
-        model = Recipe
-
-    name = Sequence(lambda n: f'Test Recipe {n}')
-    description = Faker('sentence')
-    shape = 'C'
-    diameter = Faker('pydecimal', left_digits=2, right_digits=2, positive=True)
-
-class RecipeIngredientFactory(factory.django.DjangoModelFactory):
-    class Meta:
-        model = RecipeIngredient
-
-    recipe = SubFactory(RecipeFactory)
-    ingredient = SubFactory(IngredientFactory)
-    quantity_in_grams = Faker('pydecimal', left_digits=5, right_digits=2, positive=True)
-
-class ProductFactory(factory.django.DjangoModelFactory):
-    class Meta:
-        model = Product
-
-    product_type = Sequence(lambda n: f'Test Product {n}')
-    sale_price = Faker('pydecimal', left_digits=3, right_digits=2, positive=True)
-    recipe = SubFactory(RecipeFactory)
-
-
-class ProductVariationFactory(factory.django.DjangoModelFactory):
-    class Meta:
-        model = ProductVariation
-
-    product = SubFactory(ProductFactory)
-    diameter = Faker('pydecimal', left_digits=2, right_digits=2, positive=True)
+from bakery_app.management.tests.factories import (
+    IngredientFactory,
+    ProductFactory,
+    ProductVariationFactory,
+    RecipeFactory,
+    RecipeIngredientFactory,
+    SupplierFactory,
+)
 
 
 class TestModels(TestCase):
@@ -246,7 +197,10 @@ class TestProductVariationModels(TestCase):
         self.ingredient = IngredientFactory(supplier=self.supplier)
         self.recipe = RecipeFactory()
         self.product = ProductFactory(recipe=self.recipe)
-        self.product_variation = ProductVariationFactory(product=self.product, diameter=Decimal('10.0'), main_variation=True)
+        # Product.save() already created the main variation from the recipe dimensions
+        self.product_variation = self.product.variations.get(main_variation=True)
+        self.product_variation.diameter = Decimal('10.0')
+        self.product_variation.save()
 
     def test_product_variation_creation(self):
         """Test the basic creation of a ProductVariation instance."""
@@ -301,3 +255,402 @@ class TestProductVariationModels(TestCase):
         expected_margin = (expected_profit / self.product.sale_price) * 100
         self.assertEqual(self.product_variation.adjusted_profit, expected_profit)
         self.assertAlmostEqual(self.product_variation.adjusted_margin, expected_margin, places=2)
+
+
+@pytest.mark.django_db
+class TestProductCostingQuerySet(TestCase):
+    def setUp(self):
+        self.recipe = RecipeFactory()
+        RecipeIngredientFactory(recipe=self.recipe, quantity_in_grams=Decimal('150.00'))
+        RecipeIngredientFactory(recipe=self.recipe, quantity_in_grams=Decimal('2.50'))
+        self.products = ProductFactory.create_batch(3, recipe=self.recipe)
+        self.empty_product = ProductFactory(sale_price=Decimal('0.00'))
+
+    def test_with_costing_matches_properties(self):
+        for product in Product.objects.with_costing().exclude(pk=self.empty_product.pk):
+            self.assertEqual(product.total_cost, product.calculate_cost)
+            self.assertEqual(product.profit, product.calculate_profit)
+            self.assertEqual(product.margin_percentage, product.calculate_margin)
+
+    def test_with_costing_rounds_half_even(self):
+        ingredient = IngredientFactory(price_per_gram=Decimal('0.01'))
+        recipe = RecipeFactory()
+        RecipeIngredientFactory(recipe=recipe, ingredient=ingredient, quantity_in_grams=Decimal('2.50'))
+        product = ProductFactory(recipe=recipe, sale_price=Decimal('10.00'))
+        annotated = Product.objects.with_costing().get(pk=product.pk)
+        self.assertEqual(annotated.total_cost, Decimal('0.02'))
+        self.assertEqual(annotated.total_cost, product.calculate_cost)
+
+    def test_with_costing_handles_empty_recipe_and_zero_price(self):
+        product = Product.objects.with_costing().get(pk=self.empty_product.pk)
+        self.assertEqual(product.total_cost, Decimal('0.00'))
+        self.assertIsNone(product.margin_percentage)
+
+    def test_with_costing_single_query(self):
+        with self.assertNumQueries(1):
+            products = list(Product.objects.with_costing())
+            self.assertEqual(len(products), 4)
+
+
+@pytest.mark.django_db
+class TestRecipeCostCache(TestCase):
+    def setUp(self):
+        self.ingredient = IngredientFactory(price_per_gram=Decimal('0.50'))
+        self.recipe = RecipeFactory()
+        self.other_recipe = RecipeFactory()
+        RecipeIngredientFactory(recipe=self.recipe, ingredient=self.ingredient, quantity_in_grams=Decimal('100.00'))
+        RecipeIngredientFactory(recipe=self.other_recipe, quantity_in_grams=Decimal('10.00'))
+        # on_commit callbacks never run inside TestCase, so refresh explicitly
+        RecipeCost.objects.refresh_dirty()
+
+    def test_cache_is_refreshed(self):
+        cache = RecipeCost.objects.get(recipe=self.recipe)
+        self.assertFalse(cache.is_dirty)
+        self.assertEqual(cache.cost, Decimal('50.00'))
+
+    def test_price_change_marks_only_affected_recipes_dirty(self):
+        ingredient = Ingredient.objects.get(pk=self.ingredient.pk)
+        ingredient.price_per_gram = Decimal('1.00')
+        ingredient.save()
+        self.assertTrue(RecipeCost.objects.get(recipe=self.recipe).is_dirty)
+        self.assertFalse(RecipeCost.objects.get(recipe=self.other_recipe).is_dirty)
+
+        self.assertEqual(RecipeCost.objects.refresh_dirty(), 1)
+        self.assertEqual(RecipeCost.objects.get(recipe=self.recipe).cost, Decimal('100.00'))
+
+    def test_one_refresh_is_scheduled_per_transaction(self):
+        RecipeIngredientFactory.create_batch(3, recipe=self.recipe)
+        scheduled = [entry for entry in connection.run_on_commit if entry[1] is refresh_recipe_costs]
+        self.assertEqual(len(scheduled), 1)
+
+    def test_unchanged_price_does_not_invalidate(self):
+        ingredient = Ingredient.objects.get(pk=self.ingredient.pk)
+        ingredient.name = 'Renamed'
+        ingredient.save()
+        self.assertFalse(RecipeCost.objects.get(recipe=self.recipe).is_dirty)
+
+    def test_recipe_ingredient_delete_invalidates(self):
+        self.recipe.recipeingredient_set.all().delete()
+        RecipeCost.objects.refresh_dirty()
+        self.assertEqual(RecipeCost.objects.get(recipe=self.recipe).cost, Decimal('0.00'))
+
+    def test_calculate_cost_reads_cache_in_one_query(self):
+        product = ProductFactory(recipe=self.recipe)
+        with self.assertNumQueries(1):
+            self.assertEqual(product.calculate_cost, Decimal('50.00'))
+
+    def test_rebuild_command_verifies_cache(self):
+        RecipeCost.objects.filter(recipe=self.recipe).update(cost=Decimal('1.00'))
+        with self.assertRaises(CommandError):
+            call_command('rebuild_recipe_costs', '--check', stdout=StringIO(), stderr=StringIO())
+        call_command('rebuild_recipe_costs', stdout=StringIO())
+        self.assertEqual(RecipeCost.objects.get(recipe=self.recipe).cost, Decimal('50.00'))
+
+
+@pytest.mark.django_db
+class TestProductVariationAdjustedCosting(TestCase):
+    def setUp(self):
+        ingredient = IngredientFactory(price_per_gram=Decimal('0.35'))
+        circular = RecipeFactory(shape='C', diameter=Decimal('20.00'))
+        rectangular = RecipeFactory(shape='R', diameter=None, length=Decimal('30.00'), width=Decimal('20.00'))
+        for recipe in (circular, rectangular):
+            RecipeIngredientFactory(recipe=recipe, ingredient=ingredient, quantity_in_grams=Decimal('333.33'))
+        self.cake = ProductFactory(recipe=circular, sale_price=Decimal('45.00'))
+        self.tray = ProductFactory(recipe=rectangular, sale_price=Decimal('80.00'))
+        ProductVariationFactory(product=self.cake, diameter=Decimal('15.00'), main_variation=False)
+        ProductVariationFactory(product=self.cake, diameter=Decimal('26.50'), main_variation=False)
+        ProductVariationFactory(product=self.tray, diameter=None, length=Decimal('15.00'), width=Decimal('10.00'), main_variation=False)
+
+    def test_with_adjusted_costing_matches_properties(self):
+        variations = ProductVariation.objects.with_adjusted_costing()
+        self.assertEqual(len(variations), 5)
+        for variation in variations:
+            self.assertEqual(variation.surface_area, variation.calculate_surface_area())
+            self.assertEqual(variation.area_factor, variation.adjustment_factor())
+            self.assertEqual(variation.variation_cost, variation.adjusted_cost)
+            self.assertEqual(variation.variation_profit, variation.adjusted_profit)
+            self.assertEqual(variation.variation_margin, variation.adjusted_margin)
+
+    def test_secondary_variation_is_scaled_by_area(self):
+        variation = ProductVariation.objects.with_adjusted_costing().get(product=self.tray, main_variation=False)
+        self.assertEqual(variation.area_factor, Decimal('0.25'))
+
+    def test_with_adjusted_costing_single_query(self):
+        with self.assertNumQueries(1):
+            variations = list(ProductVariation.objects.select_related('product__recipe').with_adjusted_costing())
+            for variation in variations:
+                variation.product.recipe.shape
+
+
+@pytest.mark.django_db
+class TestIngredientUsage(TestCase):
+    def setUp(self):
+        self.flour = IngredientFactory(price_per_gram=Decimal('0.10'))
+        sugar = IngredientFactory(price_per_gram=Decimal('0.30'))
+        self.recipe = RecipeFactory()
+        self.unrelated = RecipeFactory()
+        RecipeIngredientFactory(recipe=self.recipe, ingredient=self.flour, quantity_in_grams=Decimal('300.00'))
+        RecipeIngredientFactory(recipe=self.recipe, ingredient=sugar, quantity_in_grams=Decimal('100.00'))
+        RecipeIngredientFactory(recipe=self.unrelated, ingredient=sugar, quantity_in_grams=Decimal('10.00'))
+        self.product = ProductFactory(recipe=self.recipe)
+        ProductFactory(recipe=self.unrelated)
+        RecipeCost.objects.refresh_dirty()
+
+    def test_lines_using_ingredient(self):
+        line = RecipeIngredient.objects.for_ingredient(self.flour).get()
+        self.assertEqual(line.ingredient_cost, Decimal('30.0000'))
+        self.assertEqual(line.ingredient_share, Decimal('0.500000'))
+
+    def test_price_change_refreshes_shares(self):
+        self.flour.price_per_gram = Decimal('0.30')
+        self.flour.save()
+        RecipeCost.objects.refresh_dirty()
+        line = RecipeIngredient.objects.for_ingredient(self.flour).get()
+        self.assertEqual(line.ingredient_share, Decimal('0.750000'))
+
+    def test_products_using_ingredient(self):
+        products = list(Product.objects.using_ingredient(self.flour))
+        self.assertEqual(products, [self.product])
+        self.assertEqual(products[0].ingredient_cost, Decimal('30.0000'))
+        self.assertEqual(products[0].cost_change_per_percent, Decimal('0.3'))
+        self.assertEqual(ProductVariation.objects.using_ingredient(self.flour).count(), self.product.variations.count())
+
+    def test_products_using_ingredient_through_sub_recipes(self):
+        # 200 grams of cream, half of them flour, and a tart using 50 of them
+        cream = RecipeFactory()
+        RecipeIngredientFactory(recipe=cream, ingredient=self.flour, quantity_in_grams=Decimal('100.00'))
+        RecipeIngredientFactory(recipe=cream, ingredient=IngredientFactory(price_per_gram=Decimal('0.30')), quantity_in_grams=Decimal('100.00'))
+        tart = RecipeFactory()
+        line = RecipeIngredientFactory(recipe=tart, ingredient=None, sub_recipe=cream, quantity_in_grams=Decimal('50.00'))
+        product = ProductFactory(recipe=tart)
+        RecipeCost.objects.refresh_dirty()
+
+        usage = Product.objects.using_ingredient(self.flour).get(pk=product.pk)
+        self.assertEqual(usage.ingredient_cost, Decimal('2.5000'))
+        self.assertEqual(usage.cost_change_per_percent, Decimal('0.025'))
+        # The tart costs 50 / 200 x (10.00 + 30.00)
+        self.assertEqual(usage.ingredient_share, Decimal('0.250000'))
+        self.assertEqual(ProductVariation.objects.using_ingredient(self.flour).filter(product=product).count(), 1)
+
+        lines = {line.pk: line for line in RecipeIngredient.objects.for_ingredient(self.flour)}
+        self.assertEqual(lines[line.pk].ingredient_cost, Decimal('2.5000'))
+        self.assertEqual(len(lines), 3)
+
+
+@pytest.mark.django_db
+class TestProductionPlanDemand(TestCase):
+    def setUp(self):
+        self.flour = IngredientFactory(price_per_gram=Decimal('0.10'))
+        self.butter = IngredientFactory(price_per_gram=Decimal('0.40'))
+        recipe = RecipeFactory(shape='C', diameter=Decimal('20.00'))
+        RecipeIngredientFactory(recipe=recipe, ingredient=self.flour, quantity_in_grams=Decimal('100.00'))
+        RecipeIngredientFactory(recipe=recipe, ingredient=self.butter, quantity_in_grams=Decimal('50.00'))
+        product = ProductFactory(recipe=recipe)
+        self.large = product.variations.get(main_variation=True)
+        self.small = ProductVariationFactory(product=product, diameter=Decimal('10.00'), main_variation=False)
+        self.plan = ProductionPlan.objects.create(name='Monday')
+        ProductionPlanLine.objects.create(plan=self.plan, variation=self.large, quantity=40)
+        ProductionPlanLine.objects.create(plan=self.plan, variation=self.small, quantity=120)
+
+    def test_area_factor_matches_adjustment_factor(self):
+        factors = dict(ProductVariation.objects.with_area_factor().values_list('pk', 'area_factor'))
+        self.assertEqual(factors[self.small.pk], self.small.adjustment_factor())
+        self.assertEqual(factors[self.large.pk], Decimal('1.00'))
+
+    def test_demand_is_scaled_and_grouped_by_supplier(self):
+        demand = {row['ingredient_id']: row for row in self.plan.ingredient_demand()}
+        # 40 x 1.00 + 120 x 0.25 = 70 batches of the recipe
+        self.assertEqual(demand[self.flour.pk]['grams'], Decimal('7000.00'))
+        self.assertEqual(demand[self.flour.pk]['cost'], Decimal('700.00'))
+        self.assertEqual(demand[self.butter.pk]['grams'], Decimal('3500.00'))
+        self.assertEqual(demand[self.butter.pk]['supplier_id'], str(self.butter.supplier_id))
+
+    def test_demand_runs_in_one_query(self):
+        with self.assertNumQueries(1):
+            list(self.plan.ingredient_demand())
+
+
+@pytest.mark.benchmark
+@pytest.mark.django_db
+def test_production_plan_benchmark_2000_lines():
+    ingredients = [IngredientFactory() for _ in range(40)]
+    recipes = Recipe.objects.bulk_create(
+        Recipe(name=f'Recipe {i}', description='', shape='CR'[i % 2], diameter=Decimal('20.00'), length=Decimal('30.00'), width=Decimal('20.00'))
+        for i in range(50)
+    )
+    RecipeIngredient.objects.bulk_create(
+        RecipeIngredient(recipe=recipe, ingredient=ingredients[(i + j) % 40], quantity_in_grams=Decimal('25.50'))
+        for i, recipe in enumerate(recipes) for j in range(12)
+    )
+    products = Product.objects.bulk_create(
+        Product(product_type=f'Product {i}', sale_price=Decimal('30.00'), recipe=recipes[i % 50]) for i in range(200)
+    )
+    variations = ProductVariation.objects.bulk_create(
+        ProductVariation(
+            product=product, main_variation=j == 0, diameter=Decimal(10 + j), length=Decimal(10 + j), width=Decimal('15.00')
+        )
+        for product in products for j in range(10)
+    )
+    plan = ProductionPlan.objects.create(name='Benchmark')
+    ProductionPlanLine.objects.bulk_create(
+        ProductionPlanLine(plan=plan, variation=variation, quantity=1 + i % 50) for i, variation in enumerate(variations)
+    )
+    with connection.cursor() as cursor:
+        cursor.execute('ANALYZE')
+    started = time.perf_counter()
+    demand = list(plan.ingredient_demand())
+    elapsed = time.perf_counter() - started
+    print(f"production plan demand: 2000 lines in {elapsed * 1000:.1f} ms")
+    assert len(demand) == 40
+    assert elapsed < 1
+
+
+@pytest.mark.django_db
+class TestSubRecipes(TestCase):
+    def setUp(self):
+        self.flour = IngredientFactory(price_per_gram=Decimal('0.10'))
+        self.butter = IngredientFactory(price_per_gram=Decimal('0.40'))
+        self.dough = RecipeFactory(name='Dough')
+        RecipeIngredientFactory(recipe=self.dough, ingredient=self.flour, quantity_in_grams=Decimal('300.00'))
+        RecipeIngredientFactory(recipe=self.dough, ingredient=self.butter, quantity_in_grams=Decimal('100.00'))
+        self.cake = RecipeFactory(name='Cake')
+        RecipeIngredientFactory(recipe=self.cake, ingredient=None, sub_recipe=self.dough, quantity_in_grams=Decimal('200.00'))
+        RecipeIngredientFactory(recipe=self.cake, ingredient=self.butter, quantity_in_grams=Decimal('50.00'))
+        self.tart = RecipeFactory(name='Tart')
+        RecipeIngredientFactory(recipe=self.tart, ingredient=None, sub_recipe=self.dough, quantity_in_grams=Decimal('100.00'))
+        RecipeIngredientFactory(recipe=self.tart, ingredient=None, sub_recipe=self.cake, quantity_in_grams=Decimal('50.00'))
+        RecipeCost.objects.refresh_dirty()
+
+    def cached_costs(self):
+        return dict(RecipeCost.objects.values_list('recipe_id', 'cost'))
+
+    def test_cost_rolls_up_per_gram(self):
+        costs = self.cached_costs()
+        self.assertEqual(costs[self.dough.pk], Decimal('70.00'))
+        # 200g of a 400g dough batch plus 50g of butter
+        self.assertEqual(costs[self.cake.pk], Decimal('55.00'))
+        # 100g of dough plus 50g of a 250g cake batch
+        self.assertEqual(costs[self.tart.pk], Decimal('28.50'))
+        product = ProductFactory(recipe=self.tart)
+        self.assertEqual(Product.objects.with_costing().get(pk=product.pk).total_cost, Decimal('28.50'))
+
+    def test_price_change_propagates_to_parents(self):
+        self.flour.price_per_gram = Decimal('0.20')
+        self.flour.save()
+        self.assertFalse(RecipeCost.objects.filter(is_dirty=False).exists())
+        RecipeCost.objects.refresh_dirty()
+        costs = self.cached_costs()
+        self.assertEqual(costs[self.cake.pk], Decimal('70.00'))
+        self.assertEqual(costs[self.tart.pk], Decimal('39.00'))
+
+    def test_property_fallback_matches_cache(self):
+        product = ProductFactory(recipe=self.tart)
+        RecipeCost.objects.filter(recipe=self.tart).update(is_dirty=True)
+        self.assertEqual(product.calculate_cost, Decimal('28.50'))
+
+    def test_stale_sub_recipe_costs_are_priced_live(self):
+        product = ProductFactory(recipe=self.tart)
+        # Marked dirty, and the refresh that would follow the commit never runs inside the test
+        self.flour.price_per_gram = Decimal('0.20')
+        self.flour.save()
+        self.assertEqual(product.calculate_cost, Decimal('39.00'))
+        self.assertEqual(Product.objects.with_costing().get(pk=product.pk).total_cost, Decimal('39.00'))
+
+        # A sub-recipe without a RecipeCost row at all, as after a bulk insert
+        RecipeCost.objects.filter(recipe=self.dough).delete()
+        self.assertEqual(product.calculate_cost, Decimal('39.00'))
+        RecipeCost.objects.refresh_dirty()
+        self.assertEqual(self.cached_costs()[self.tart.pk], Decimal('39.00'))
+
+    def test_production_plan_ignores_stale_sub_recipe_weights(self):
+        RecipeCost.objects.filter(recipe=self.dough).delete()
+        RecipeIngredientFactory(recipe=self.dough, ingredient=self.butter, quantity_in_grams=Decimal('400.00'))
+        product = ProductFactory(recipe=self.cake)
+        plan = ProductionPlan.objects.create()
+        ProductionPlanLine.objects.create(plan=plan, variation=product.variations.get(), quantity=2)
+        demand = {row['ingredient_id']: row['grams'] for row in plan.ingredient_demand()}
+        # 400g of what is now an 800g dough batch
+        self.assertEqual(demand, {self.flour.pk: Decimal('150.00'), self.butter.pk: Decimal('350.00')})
+
+    def test_cycles_are_rejected(self):
+        with self.assertRaises(ValidationError):
+            RecipeIngredientFactory(recipe=self.dough, ingredient=None, sub_recipe=self.tart, quantity_in_grams=Decimal('1.00'))
+        with self.assertRaises(ValidationError):
+            RecipeIngredientFactory(recipe=self.cake, ingredient=None, sub_recipe=self.cake, quantity_in_grams=Decimal('1.00'))
+
+    def test_closures(self):
+        self.assertEqual(Recipe.objects.ancestor_ids([self.dough.pk]), {self.dough.pk, self.cake.pk, self.tart.pk})
+        self.assertEqual(Recipe.objects.descendant_ids([self.cake.pk]), {self.cake.pk, self.dough.pk})
+
+    def test_dependency_levels(self):
+        levels = RecipeCost.objects.all()._dependency_levels([self.tart.pk, self.cake.pk, self.dough.pk])
+        self.assertEqual(levels, [[self.dough.pk], [self.cake.pk], [self.tart.pk]])
+
+    def test_production_plan_explodes_sub_recipes(self):
+        product = ProductFactory(recipe=self.cake)
+        plan = ProductionPlan.objects.create()
+        ProductionPlanLine.objects.create(plan=plan, variation=product.variations.get(), quantity=2)
+        demand = {row['ingredient_id']: row['grams'] for row in plan.ingredient_demand()}
+        # Two cakes need one 400g dough batch
+        self.assertEqual(demand, {self.flour.pk: Decimal('300.00'), self.butter.pk: Decimal('200.00')})
+
+
+@pytest.mark.benchmark
+@pytest.mark.django_db
+def test_sub_recipe_rollup_benchmark_10k_node_dag():
+    from bakery_app.management import costing
+
+    rng = random.Random(11)
+    ingredients = [IngredientFactory(price_per_gram=Decimal(f'0.{n + 10}')) for n in range(20)]
+    levels, width = 100, 100
+    recipes = Recipe.objects.bulk_create(
+        Recipe(name=f'Node {n}', description='', shape='C', diameter=Decimal('20.00')) for n in range(levels * width)
+    )
+    lines = []
+    for n, recipe in enumerate(recipes):
+        level = n // width
+        for ingredient in rng.sample(ingredients, 2):
+            lines.append(RecipeIngredient(recipe=recipe, ingredient=ingredient, quantity_in_grams=Decimal(rng.randint(100, 50000)) / 100))
+        if level:
+            # Hundreds of parents share each sub-recipe of the level below
+            for sub_recipe in rng.sample(recipes[(level - 1) * width:level * width], 3):
+                lines.append(RecipeIngredient(recipe=recipe, sub_recipe=sub_recipe, quantity_in_grams=Decimal(rng.randint(100, 50000)) / 100))
+    RecipeIngredient.objects.bulk_create(lines)
+    with connection.cursor() as cursor:
+        cursor.execute('ANALYZE')
+
+    started = time.perf_counter()
+    RecipeCost.objects.rebuild()
+    elapsed = time.perf_counter() - started
+    print(f"sub-recipe rollup: {len(recipes)} recipes, {len(lines)} lines, depth {levels} in {elapsed * 1000:.1f} ms")
+
+    started = time.perf_counter()
+    result = costing.compute(costing.load_catalog())
+    print(f"costing.compute with sub-recipes: {(time.perf_counter() - started) * 1000:.1f} ms")
+    cached = dict(RecipeCost.objects.values_list('recipe_id', 'cost'))
+    assert {row['id']: row['cost'] for row in result.recipes()} == cached
+    assert elapsed < 30
+
+
+@pytest.mark.django_db(transaction=True)
+@pytest.mark.parametrize('method', ['copy', 'bulk'])
+def test_seed_catalog_writes_a_consistent_deterministic_catalog(method):
+    def seed():
+        call_command('seed_catalog', '--products', '40', '--seed', '7', '--method', method, '--batch-size', '16', stdout=StringIO())
+        return (
+            list(Product.objects.order_by('pk').values_list('product_type', 'sale_price', 'recipe__name')),
+            list(RecipeIngredient.objects.order_by('pk').values_list('recipe__name', 'ingredient__name', 'quantity_in_grams')),
+        )
+
+    first = seed()
+    assert Supplier.objects.count() == 2 and Ingredient.objects.count() == 8 and Recipe.objects.count() == 4
+    assert RecipeIngredient.objects.count() == 32 and ProductVariation.objects.count() == 80
+    assert ProductVariation.objects.filter(main_variation=True).count() == 40
+    assert Ingredient.objects.filter(price_history__isnull=True).count() == 0
+    # The cost cache is filled as if every row had gone through save()
+    call_command('rebuild_recipe_costs', '--check', stdout=StringIO())
+    assert not RecipeCost.objects.filter(is_dirty=True).exists()
+
+    for model in (Product, Recipe, Ingredient, Supplier):
+        model.objects.all().delete()
+    assert seed() == first
@@ -0,0 +1,107 @@
+"""
+Micro-benchmarks of the costing and geometry methods and of their annotated replacements,
+checked against baselines/models.json (see benchmarks.py):
+
+    pytest -m benchmark -k models_benchmark -s
+    BENCHMARK_UPDATE_BASELINE=1 pytest -m benchmark -k models_benchmark
+"""
+import pytest
+
+from bakery_app.management.models import Ingredient, Product, ProductVariation, Recipe, RecipeCost, RecipeIngredient
+from bakery_app.management.tests import benchmarks
+
+pytestmark = pytest.mark.benchmark
+
+LINES = 50
+VARIATIONS = 50
+
+
+@pytest.fixture
+def catalogue(db):
+    ingredients = Ingredient.objects.bulk_create(
+        Ingredient(name=f'Ingredient {n}', price_per_gram=f'{1 + n % 9}.{n % 100:02}') for n in range(LINES)
+    )
+    round_recipe = Recipe.objects.create(name='Round', description='Circular', shape='C', diameter='20.00')
+    tray_recipe = Recipe.objects.create(name='Tray', description='Rectangular', shape='R', length='30.00', width='20.00')
+    for recipe in (round_recipe, tray_recipe):
+        RecipeIngredient.objects.bulk_create(
+            RecipeIngredient(recipe=recipe, ingredient=ingredient, quantity_in_grams=f'{10 + n}.50')
+            for n, ingredient in enumerate(ingredients)
+        )
+    RecipeCost.objects.rebuild()
+    round_cake = Product.objects.create(product_type='Round cake', sale_price='90.00', recipe=round_recipe)
+    tray_bake = Product.objects.create(product_type='Tray bake', sale_price='120.00', recipe=tray_recipe)
+    ProductVariation.objects.bulk_create(
+        ProductVariation(product=round_cake, diameter=f'{10 + n}.00') for n in range(VARIATIONS)
+    )
+    ProductVariation.objects.create(product=tray_bake, length='15.00', width='10.00')
+    products = Product.objects.select_related('recipe').in_bulk([round_cake.pk, tray_bake.pk])
+    return products[round_cake.pk], products[tray_bake.pk]
+
+
+def variation(product, main):
+    return ProductVariation.objects.select_related('product__recipe').filter(product=product, main_variation=main).first()
+
+
+def test_models_benchmark(catalogue):
+    round_cake, tray_bake = catalogue
+    circular, rectangular = variation(round_cake, main=False), variation(tray_bake, main=False)
+    results = {}
+
+    def bench(name, fn):
+        results[name] = benchmarks.micro(fn)
+
+    # Per-instance methods, on instances whose product and recipe are already loaded
+    bench('Product.calculate_cost', lambda: round_cake.calculate_cost)
+    bench('Product.calculate_profit', lambda: round_cake.calculate_profit)
+    bench('Product.calculate_margin', lambda: round_cake.calculate_margin)
+    bench('ProductVariation.calculate_surface_area circular', circular.calculate_surface_area)
+    bench('ProductVariation.calculate_surface_area rectangular', rectangular.calculate_surface_area)
+    bench('ProductVariation.adjustment_factor', circular.adjustment_factor)
+    bench('ProductVariation.adjusted_cost', lambda: circular.adjusted_cost)
+    bench('ProductVariation.adjusted_profit', lambda: circular.adjusted_profit)
+    bench('ProductVariation.adjusted_margin', lambda: circular.adjusted_margin)
+
+    # A stale cost cache sends calculate_cost to the recipe lines
+    RecipeCost.objects.filter(recipe=round_cake.recipe).update(is_dirty=True)
+    bench('Product.calculate_cost uncached', lambda: round_cake.calculate_cost)
+    RecipeCost.objects.refresh_dirty()
+
+    # Every variation of a product through the properties, and through the annotations
+    def adjusted_properties():
+        return [
+            (item.adjusted_cost, item.adjusted_profit, item.adjusted_margin)
+            for item in ProductVariation.objects.select_related('product__recipe').filter(product=round_cake)
+        ]
+
+    def adjusted_annotations():
+        return list(
+            ProductVariation.objects.filter(product=round_cake).with_adjusted_costing()
+            .values_list('variation_cost', 'variation_profit', 'variation_margin')
+        )
+
+    assert sorted(adjusted_properties()) == sorted(adjusted_annotations())
+    bench(f'{VARIATIONS} variations adjusted_* properties', adjusted_properties)
+    bench(f'{VARIATIONS} variations with_adjusted_costing()', adjusted_annotations)
+    bench(f'{VARIATIONS} variations with_area_factor()', lambda: list(
+        ProductVariation.objects.filter(product=round_cake).with_area_factor().values_list('area_factor', flat=True)
+    ))
+
+    def costing_properties():
+        return [(item.calculate_cost, item.calculate_profit) for item in Product.objects.select_related('recipe')]
+
+    def costing_annotations():
+        return list(Product.objects.with_costing().values_list('total_cost', 'profit'))
+
+    assert sorted(costing_properties()) == sorted(costing_annotations())
+    bench('products calculate_* properties', costing_properties)
+    bench('products with_costing()', costing_annotations)
+
+    print('\ncosting')
+    for name, result in results.items():
+        print(
+            f"{name:<75} {result['us_per_call']:>10.1f} us {result['queries']:>3} queries "
+            f"{result['alloc_kib']:>8.1f} KiB"
+        )
+    regressions = benchmarks.check_baseline('models', results)
+    assert not regressions, 'Worse than baselines/models.json:\n' + '\n'.join(regressions)
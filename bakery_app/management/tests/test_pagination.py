@@ -0,0 +1,156 @@
+import time
+
+import pytest
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from bakery_app.management.models import Ingredient, Product, Recipe, RecipeCost
+from bakery_app.management.pagination import KeysetPaginator, encode_cursor
+from bakery_app.management.tables import IngredientTable, ProductTable
+
+
+@pytest.fixture
+def products(db):
+    recipe = Recipe.objects.create(name='Cake', description='Sponge', shape='C', diameter='20.00')
+    # Repeated sale prices and a zero price (NULL margin) make ties and NULLs in every sort key
+    prices = ['0.00', '10.00', '10.00', '12.50', '0.00', '30.00', '12.50', '10.00', '45.00', '0.00', '7.25']
+    created = [Product.objects.create(product_type=f'Cake {n % 4}', sale_price=price, recipe=recipe) for n, price in enumerate(prices)]
+    RecipeCost.objects.refresh_dirty()
+    return created
+
+
+def paginate(order_by, cursor=None, per_page=3, count=None):
+    table = ProductTable(Product.objects.with_costing(), order_by=order_by)
+    table.paginate(paginator_class=KeysetPaginator, per_page=per_page, cursor=cursor, count=count)
+    return table
+
+
+def expected_order(order_by):
+    name, descending = (order_by or 'pk').lstrip('-'), (order_by or '').startswith('-')
+    products = sorted(Product.objects.with_costing(), key=lambda product: product.pk)
+    present = sorted((p for p in products if getattr(p, name) is not None), key=lambda p: getattr(p, name), reverse=descending)
+    # NULLs last in either direction, ties broken by pk
+    return [p.pk for p in present] + [p.pk for p in products if getattr(p, name) is None]
+
+
+def page_pks(table):
+    return [row.record.pk for row in table.paginated_rows]
+
+
+@pytest.mark.parametrize('order_by', [None, 'sale_price', '-sale_price', '-margin_percentage', 'margin_percentage', 'product_type'])
+def test_cursor_walk_matches_offset_order(products, order_by):
+    expected = expected_order(order_by)
+    assert sorted(expected) == sorted(product.pk for product in products)
+
+    forward, cursor, pages = [], None, []
+    while True:
+        table = paginate(order_by, cursor)
+        pages.append(page_pks(table))
+        forward += pages[-1]
+        if not table.page.has_next():
+            break
+        cursor = table.page.next_cursor
+    assert forward == expected
+    assert [len(page) for page in pages] == [3, 3, 3, 2]
+
+    # And back again from the last page
+    backward = []
+    while table.page.has_previous():
+        table = paginate(order_by, table.page.previous_cursor)
+        backward.insert(0, page_pks(table))
+    assert backward == pages[:-1]
+
+
+def test_cursor_from_another_sort_order_serves_first_page(products):
+    cursor = paginate('sale_price').page.next_cursor
+    table = paginate('-sale_price', cursor)
+    assert page_pks(table) == page_pks(paginate('-sale_price'))
+    assert not table.page.has_previous()
+    assert page_pks(paginate('sale_price', 'not a cursor')) == page_pks(paginate('sale_price'))
+    assert page_pks(paginate('sale_price', encode_cursor(['sale_price', 'pk'], 'n', [None]))) == page_pks(paginate('sale_price'))
+
+
+def test_counts(products):
+    assert paginate('sale_price').paginator.count is None
+    assert paginate('sale_price', count='exact').paginator.count == len(products)
+    assert paginate('sale_price', count='exact').paginator.num_pages == 4
+    assert paginate('sale_price', count='estimate').paginator.count >= 1
+
+
+def test_deep_page_runs_a_single_query_without_count(products):
+    cursor = paginate('sale_price').page.next_cursor
+    with CaptureQueriesContext(connection) as queries:
+        table = paginate('sale_price', cursor)
+        page_pks(table)
+        table.page.next_cursor
+    assert len(queries) == 1
+    assert 'COUNT(' not in queries[0]['sql'].upper()
+    assert 'OFFSET' not in queries[0]['sql'].upper()
+
+
+@pytest.mark.django_db
+def test_product_table_view_follows_cursor_links(client, django_user_model, products):
+    client.force_login(django_user_model.objects.create_user(email='pager@example.com', password='12345'))
+    url = reverse('management:product-table')
+    response = client.get(url, {'sort': 'sale_price'})
+    table = response.context['table']
+    assert [row.record.pk for row in table.paginated_rows] == page_pks(paginate('sale_price', per_page=10))
+    next_cursor = table.page.next_cursor
+    assert f'cursor={next_cursor}' in response.content.decode()
+
+    response = client.get(url, {'sort': 'sale_price', 'cursor': next_cursor}, HTTP_HX_REQUEST='true')
+    assert [row.record.pk for row in response.context['table'].paginated_rows] == page_pks(
+        paginate('sale_price', next_cursor, per_page=10)
+    )
+    assert 'hx-select="div.table-container"' in response.content.decode()
+
+
+@pytest.mark.django_db
+def test_product_list_view_partial_uses_cursor_links(rf, products):
+    from bakery_app.management.views import product_list_view
+
+    request = rf.get('/', {'sort': '-sale_price'}, HTTP_HX_REQUEST='true')
+    request.htmx = True
+    content = product_list_view(request).content.decode()
+    assert 'cursor=' in content
+    assert 'page=' not in content
+
+
+@pytest.mark.benchmark
+@pytest.mark.django_db
+def test_keyset_pagination_benchmark_deep_pages():
+    with connection.cursor() as cursor:
+        cursor.execute(
+            """
+            INSERT INTO management_ingredient (name, price_per_gram, created_at, updated_at)
+            SELECT 'Ingredient ' || n, 0.01 + (n % 997) / 100.0, now(), now() FROM generate_series(1, 100000) AS n
+            """
+        )
+        cursor.execute('ANALYZE management_ingredient')
+    queryset = Ingredient.objects.order_by('pk')
+
+    def keyset_page(cursor):
+        table = IngredientTable(queryset)
+        table.paginate(paginator_class=KeysetPaginator, per_page=10, cursor=cursor)
+        list(table.paginated_rows)
+        return table
+
+    def timed(fetch):
+        started = time.perf_counter()
+        for _ in range(20):
+            fetch()
+        return (time.perf_counter() - started) / 20
+
+    first_page = timed(lambda: keyset_page(None))
+    last = Ingredient.objects.order_by('-pk').values_list('pk', flat=True)[20]
+    deep_cursor = encode_cursor(['pk'], 'n', [last])
+    deep_page = timed(lambda: keyset_page(deep_cursor))
+    offset_page = timed(lambda: list(queryset[99_980:99_990]))
+
+    print(
+        f"100k ingredients, 10 per page: keyset page 1 {first_page * 1000:.2f} ms, "
+        f"keyset page 9999 {deep_page * 1000:.2f} ms, OFFSET page 9999 {offset_page * 1000:.2f} ms"
+    )
+    assert deep_page < offset_page
+    assert deep_page < first_page * 3
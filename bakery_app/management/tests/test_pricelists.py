@@ -0,0 +1,137 @@
+import io
+import time
+from decimal import Decimal
+
+import pytest
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command, CommandError
+from django.urls import reverse
+
+from bakery_app.management import pricelists
+from bakery_app.management.models import Ingredient, IngredientPrice, Product, Recipe, RecipeCost, Supplier
+
+
+@pytest.fixture
+def pantry(db):
+    mill = Supplier.objects.create(name='La Molinera', ruc='1790012345001', email='mill@example.com', phone='+593991234567', address='Quito')
+    dairy = Supplier.objects.create(name='Lácteos Andinos', ruc='1790054321001', email='dairy@example.com', phone='+593997654321', address='Cuenca')
+    flour = Ingredient.objects.create(name='Flour', supplier=mill, price_per_gram='0.10')
+    sugar = Ingredient.objects.create(name='Sugar', supplier=mill, price_per_gram='0.20')
+    butter = Ingredient.objects.create(name='Butter', supplier=dairy, price_per_gram='0.40')
+    recipe = Recipe.objects.create(name='Bread', description='Basic', shape='C', diameter='20.00')
+    recipe.recipeingredient_set.create(ingredient=flour, quantity_in_grams='100.00')
+    product = Product.objects.create(product_type='Bread', sale_price='30.00', recipe=recipe)
+    return mill, dairy, flour, sugar, butter, product
+
+
+def lines(text):
+    return io.StringIO(text.lstrip(), newline='')
+
+
+def test_import_updates_changed_prices_only(pantry):
+    mill, dairy, flour, sugar, butter, product = pantry
+    report = pricelists.import_price_list(lines("""
+RUC,Ingredient,Price per gram
+1790012345001,  flour ,0.15
+1790012345001,Sugar,0.20
+1790012345001,Yeast,1.25
+1790054321001,BUTTER,$0.45
+"""))
+    assert report.applied and report.rows == 4 and report.unchanged == 1
+    assert [(entry['ingredient'], entry['old_price'], entry['new_price']) for entry in report.changes] == [
+        ('flour', Decimal('0.10'), Decimal('0.15')),
+        ('BUTTER', Decimal('0.40'), Decimal('0.45')),
+    ]
+    assert [(entry['supplier'], entry['ingredient']) for entry in report.created] == [('La Molinera', 'Yeast')]
+
+    flour.refresh_from_db()
+    assert flour.price_per_gram == Decimal('0.15') and flour.name == 'Flour'
+    assert Ingredient.objects.get(name='Yeast').supplier_id == str(mill.pk)
+    # One history row per changed or new price, on top of the ones written when the fixture was created
+    assert IngredientPrice.objects.count() == 3 + 3
+    assert not sugar.price_history.exclude(price_per_gram=Decimal('0.20')).exists()
+    assert RecipeCost.objects.get(recipe=product.recipe).is_dirty
+    RecipeCost.objects.refresh_dirty()
+    assert RecipeCost.objects.get(recipe=product.recipe).cost == Decimal('15.00')
+
+
+def test_import_refuses_a_list_with_errors(pantry):
+    report = pricelists.import_price_list(lines("""
+supplier,ingredient,price
+La Molinera,Flour,0.15
+Nobody,Flour,0.15
+La Molinera,,0.15
+La Molinera,Sugar,cheap
+La Molinera,Sugar,0.001
+La Molinera,FLOUR,0.16
+"""))
+    assert not report.valid and not report.applied
+    assert [line for line, _ in report.errors] == [3, 4, 5, 6, 7]
+    assert 'already listed on line 2' in report.errors[-1][1]
+    assert Ingredient.objects.get(name='Flour').price_per_gram == Decimal('0.10')
+
+    report = pricelists.import_price_list(lines('name,price\nFlour,0.15\n'))
+    assert report.errors == [(1, 'Missing column(s): ruc or supplier.')]
+
+
+def test_dry_run_writes_nothing(pantry):
+    mill = pantry[0]
+    report = pricelists.import_price_list(lines('ingredient,price\nFlour,0.15\nRye,0.30\n'), supplier=mill.pk, dry_run=True)
+    assert report.valid and not report.applied
+    assert len(report.changes) == 1 and len(report.created) == 1
+    assert Ingredient.objects.get(name='Flour').price_per_gram == Decimal('0.10')
+    assert not Ingredient.objects.filter(name='Rye').exists()
+
+
+def test_import_price_list_command(pantry, tmp_path):
+    path = tmp_path / 'molinera.csv'
+    path.write_text('﻿ingredient,price_per_gram\nFlour,0.12\nSugar,0.20\n', encoding='utf-8')
+    out = io.StringIO()
+    call_command('import_price_list', str(path), '--supplier', '1790012345001', '-v', '2', stdout=out)
+    assert 'La Molinera / Flour: 0.10 -> 0.12' in out.getvalue()
+    assert '2 row(s): 1 price(s) changed, 1 unchanged, 0 new ingredient(s)' in out.getvalue()
+    assert Ingredient.objects.get(name='Flour').price_per_gram == Decimal('0.12')
+
+    path.write_text('ingredient,price_per_gram\nFlour,free\n')
+    with pytest.raises(CommandError):
+        call_command('import_price_list', str(path), '--supplier', 'la molinera', stdout=io.StringIO(), stderr=io.StringIO())
+    with pytest.raises(CommandError):
+        call_command('import_price_list', str(path), '--supplier', 'Nobody', stdout=io.StringIO())
+
+
+def test_price_list_import_page(client, django_user_model, pantry):
+    mill = pantry[0]
+    client.force_login(django_user_model.objects.create_user(email='buyer@example.com', password='12345'))
+    url = reverse('management:price-list-import')
+    assert client.get(url).status_code == 200
+
+    upload = SimpleUploadedFile('list.csv', b'ingredient,price\nFlour,0.11\n', content_type='text/csv')
+    response = client.post(url, {'file': upload, 'supplier': mill.pk, 'dry_run': 'on'}, HTTP_HX_REQUEST='true')
+    assert b'Preview' in response.content and b'0.11' in response.content
+    assert Ingredient.objects.get(name='Flour').price_per_gram == Decimal('0.10')
+
+    upload = SimpleUploadedFile('list.csv', b'ingredient,price\nFlour,0.11\n', content_type='text/csv')
+    response = client.post(url, {'file': upload, 'supplier': mill.pk}, HTTP_HX_REQUEST='true')
+    assert b'Imported' in response.content
+    assert Ingredient.objects.get(name='Flour').price_per_gram == Decimal('0.11')
+
+    response = client.post(url, {'supplier': mill.pk}, HTTP_HX_REQUEST='true')
+    assert response['HX-Retarget'] == '#price-list-import-form'
+
+
+@pytest.mark.benchmark
+@pytest.mark.django_db
+def test_import_benchmark_50k_rows():
+    supplier = Supplier.objects.create(name='Bulk', ruc='1790000000001', email='bulk@example.com', phone='+593990000000', address='Quito')
+    Ingredient.objects.bulk_create(
+        Ingredient(name=f'Ingredient {n}', supplier=supplier, price_per_gram='1.00') for n in range(40000)
+    )
+    # A quarter of the known prices change, and 10000 rows are new ingredients
+    text = 'ingredient,price\n' + ''.join(
+        f'Ingredient {n},{"1.50" if n % 4 == 0 else "1.00"}\n' for n in range(50000)
+    )
+    started = time.perf_counter()
+    report = pricelists.import_price_list(lines(text), supplier=supplier.pk)
+    elapsed = time.perf_counter() - started
+    print(f'\nprice list import: {report.rows} rows in {elapsed:.2f}s, {report.rows / elapsed:.0f} rows/s')
+    assert report.applied and len(report.changes) == 10000 and len(report.created) == 10000
@@ -0,0 +1,153 @@
+import io
+import json
+import time
+
+import pytest
+from django.core.exceptions import ValidationError
+from django.core.management import call_command, CommandError
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from bakery_app.management import recipebook, seeding
+from bakery_app.management.models import (
+    Ingredient, Product, ProductVariation, Recipe, RecipeCost, RecipeIngredient, Supplier,
+)
+
+
+@pytest.fixture
+def bakery(db):
+    mill = Supplier.objects.create(name='La Molinera', ruc='1790012345001', email='mill@example.com', phone='+593991234567', address='Quito')
+    flour = Ingredient.objects.create(name='Flour', supplier=mill, price_per_gram='0.10')
+    butter = Ingredient.objects.create(name='Butter', price_per_gram='0.40')
+    dough = Recipe.objects.create(name='Dough', description='Base', shape='C', diameter='20.00')
+    dough.recipeingredient_set.create(ingredient=flour, quantity_in_grams='500.00')
+    dough.recipeingredient_set.create(ingredient=butter, quantity_in_grams='100.00')
+    tart = Recipe.objects.create(name='Tart', description='Filled', shape='R', length='30.00', width='20.00')
+    tart.recipeingredient_set.create(sub_recipe=dough, quantity_in_grams='300.00')
+    product = Product.objects.create(product_type='Apple tart', sale_price='45.00', recipe=tart)
+    product.variations.create(length='15.00', width='10.00')
+    return tart
+
+
+def remove_recipes():
+    Product.objects.all().delete()
+    RecipeIngredient.objects.filter(sub_recipe__isnull=False).delete()
+    Recipe.objects.all().delete()
+
+
+def test_export_includes_sub_recipes_and_products(bakery):
+    with CaptureQueriesContext(connection) as queries:
+        document = recipebook.export_recipes(Recipe.objects.filter(pk=bakery.pk))
+    assert len(queries) == 7
+    assert [recipe['name'] for recipe in document['recipes']] == ['Dough', 'Tart']
+    assert document['suppliers'] == [
+        {'ruc': '1790012345001', 'name': 'La Molinera', 'email': 'mill@example.com', 'phone': '+593991234567', 'address': 'Quito'}
+    ]
+    assert document['ingredients'][1] == {'name': 'Butter', 'supplier': None, 'price_per_gram': '0.40'}
+    tart = document['recipes'][1]
+    assert tart['lines'] == [{'recipe': 0, 'grams': '300.00'}]
+    assert 'diameter' not in tart
+    assert tart['products'][0]['variations'] == [
+        {'length': '30.00', 'width': '20.00', 'main': True},
+        {'length': '15.00', 'width': '10.00'},
+    ]
+
+
+def test_import_recreates_an_export(bakery):
+    document = json.loads(json.dumps(recipebook.export_recipes(Recipe.objects.all())))
+    remove_recipes()
+
+    imported = recipebook.import_recipes(document)
+    # Supplier and ingredients were still there, so they are reused
+    assert imported.counts == {
+        'suppliers': 0, 'ingredients': 0, 'recipes': 2, 'recipe lines': 3, 'products': 1, 'variations': 2,
+    }
+    assert recipebook.export_recipes(Recipe.objects.all()) == document
+    tart = Recipe.objects.get(name='Tart')
+    assert RecipeCost.objects.get(recipe=tart).is_dirty
+    RecipeCost.objects.refresh_dirty()
+    # 500 x 0.10 + 100 x 0.40 for the dough, 300 of its 600 grams in the tart
+    assert RecipeCost.objects.get(recipe=tart).cost == 45
+    assert not RecipeCost.objects.filter(is_dirty=True).exists()
+
+
+def test_import_creates_missing_suppliers_and_ingredients(bakery):
+    document = recipebook.export_recipes(Recipe.objects.all())
+    remove_recipes()
+    Supplier.objects.all().delete()
+    Ingredient.objects.all().delete()
+
+    imported = recipebook.import_recipes(document)
+    assert imported.counts['suppliers'] == 1 and imported.counts['ingredients'] == 2
+    flour = Ingredient.objects.get(name='Flour')
+    assert flour.supplier.ruc == '1790012345001'
+    assert list(flour.price_history.values_list('price_per_gram', flat=True)) == [flour.price_per_gram]
+
+
+def test_import_reports_every_problem_and_writes_nothing(bakery):
+    document = recipebook.export_recipes(Recipe.objects.all())
+    document['recipes'][1]['name'] = 'Dough'
+    document['recipes'][0]['lines'].append({'recipe': 1, 'grams': '10.00'})
+    document['recipes'][0]['lines'].append({'ingredient': 7, 'grams': '-1'})
+    document['recipes'][1]['products'][0]['variations'][1]['main'] = True
+    document['ingredients'][0]['supplier'] = '0000000000000'
+
+    with pytest.raises(ValidationError) as error:
+        recipebook.import_recipes(document, dry_run=True)
+    messages = error.value.messages
+    assert 'ingredients[0].supplier: RUC 0000000000000 is not among the suppliers.' in messages
+    assert 'recipes[0].name: A recipe called "Dough" already exists.' in messages
+    assert 'recipes[1].name: A recipe called "Dough" already exists.' in messages
+    assert 'recipes[0].lines[3]: ingredient is not a position in the ingredients list.' in messages
+    assert any(message.startswith('recipes[0].lines[3].quantity_in_grams:') for message in messages)
+    assert 'recipes[1].products[0].variations: only one variation can be the main one.' in messages
+    assert 'recipes[0]: contains itself, directly or through its sub-recipes.' in messages
+    assert Recipe.objects.count() == 2
+
+    with pytest.raises(ValidationError):
+        recipebook.import_recipes({'version': 2})
+
+
+def test_recipe_commands_round_trip(bakery, tmp_path):
+    path = tmp_path / 'recipes.json'
+    call_command('export_recipes', str(bakery.pk), '--output', str(path), stderr=io.StringIO())
+    remove_recipes()
+
+    out = io.StringIO()
+    call_command('import_recipes', str(path), '--dry-run', stdout=out)
+    assert 'Would create 0 suppliers, 0 ingredients, 2 recipes' in out.getvalue()
+    assert not Recipe.objects.exists()
+    call_command('import_recipes', str(path), stdout=io.StringIO())
+    assert Recipe.objects.count() == 2
+    with pytest.raises(CommandError):
+        call_command('import_recipes', str(path), stdout=io.StringIO(), stderr=io.StringIO())
+
+
+def test_recipe_export_view(client, bakery):
+    response = client.get(reverse('management:recipe-export'), {'ids': str(bakery.pk)})
+    assert response['Content-Disposition'].startswith('attachment; filename="recipes-')
+    assert [recipe['name'] for recipe in response.json()['recipes']] == ['Dough', 'Tart']
+    assert client.get(reverse('management:recipe-export'), {'ids': 'tart'}).status_code == 400
+
+
+@pytest.mark.benchmark
+@pytest.mark.django_db(transaction=True)
+def test_import_benchmark_10k_recipes():
+    with transaction.atomic():
+        seeding.seed(10000, seeding.Ratios(recipes=1), seed=1)
+    document = recipebook.export_recipes(Recipe.objects.all())
+    # Imported as copies next to the originals, reusing their suppliers and ingredients
+    for recipe in document['recipes']:
+        recipe['name'] += ' (imported)'
+
+    started = time.perf_counter()
+    with CaptureQueriesContext(connection) as queries:
+        imported = recipebook.import_recipes(document)
+    elapsed = time.perf_counter() - started
+    print(
+        f'\nrecipe import: {len(document["recipes"])} recipes, {imported.counts["recipe lines"]} lines, '
+        f'{imported.counts["variations"]} variations in {elapsed:.2f}s, {len(queries)} queries'
+    )
+    assert imported.counts['ingredients'] == 0
+    assert Recipe.objects.count() == 20000 and ProductVariation.objects.count() == 40000
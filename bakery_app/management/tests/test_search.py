@@ -0,0 +1,106 @@
+import time
+
+import pytest
+from django.db import connection
+from django.urls import reverse
+
+from bakery_app.management import search
+from bakery_app.management.models import Ingredient, Product, Recipe, Supplier
+
+
+@pytest.fixture
+def trigram(db):
+    # Checked inside the test: a skipif condition runs before the test may touch the database
+    if not search.trigram_available():
+        pytest.skip('pg_trgm is not installed')
+
+
+needs_trigram = pytest.mark.usefixtures('trigram')
+
+
+@pytest.fixture
+def catalogue(db):
+    supplier = Supplier.objects.create(
+        name='Molinos del Sur', ruc='1790012345001', email='ventas@molinos.example', phone='+593991234567',
+        address='Quito',
+    )
+    for name in ('Rye flour', 'Flour', 'Flour blend', 'Sugar'):
+        Ingredient.objects.create(name=name, price_per_gram='1.00', supplier=supplier)
+    chocolate = Recipe.objects.create(name='Chocolate sponge', description='Dark', shape='C', diameter='20.00')
+    Recipe.objects.create(name='Lemon drizzle', description='Citrus', shape='R', length='20.00', width='10.00')
+    Product.objects.create(product_type='Chocolate cake', sale_price='30.00', recipe=chocolate)
+    Product.objects.create(product_type='Chocolate cupcakes', sale_price='12.00', recipe=chocolate)
+    return supplier
+
+
+def test_ranked_puts_the_best_match_first(catalogue):
+    flours = list(search.ranked(Ingredient.objects.all(), ['name'], ' flour ').values_list('name', flat=True))
+    assert flours[0] == 'Flour'
+    assert sorted(flours) == ['Flour', 'Flour blend', 'Rye flour']
+    assert search.ranked(Ingredient.objects.all(), ['name'], '').count() == 4
+
+    # Either of several fields can match
+    assert list(search.ranked(Supplier.objects.all(), ['name', 'ruc'], '179001').values_list('name', flat=True)) == [
+        'Molinos del Sur'
+    ]
+
+
+@needs_trigram
+def test_trigram_search_forgives_typos(catalogue):
+    assert list(search.ranked(Recipe.objects.all(), ['name'], 'choclate spnge').values_list('name', flat=True)) == [
+        'Chocolate sponge'
+    ]
+
+
+def test_product_filter_search(client, django_user_model, catalogue):
+    client.force_login(django_user_model.objects.create_user(email='search@example.com', password='12345'))
+    response = client.get(reverse('management:product-table'), {'search': 'cupcake'}, HTTP_HX_REQUEST='true')
+    content = response.content.decode()
+    assert 'Chocolate cupcakes' in content
+    assert 'Chocolate cake<' not in content
+
+
+def test_live_search_groups_results(client, catalogue):
+    url = reverse('management:live-search')
+    response = client.get(url, {'q': 'choc'}, HTTP_HX_REQUEST='true')
+    content = response.content.decode()
+    assert 'Chocolate cake' in content and 'Chocolate cupcakes' in content and 'Chocolate sponge' in content
+    assert 'Ingredients' not in content
+
+    assert 'Molinos del Sur' in client.get(url, {'q': 'molinos'}).content.decode()
+    assert 'No matches' in client.get(url, {'q': 'brioche'}).content.decode()
+    assert 'hoverlist' not in client.get(url, {'q': 'c'}).content.decode()
+
+    # Unchanged results are a 304 until a searched model is written
+    etag = response.headers['ETag']
+    assert client.get(url, {'q': 'choc'}, HTTP_HX_REQUEST='true', HTTP_IF_NONE_MATCH=etag).status_code == 304
+
+
+def test_admin_search_is_ranked(admin_client, catalogue):
+    response = admin_client.get(reverse('admin:management_ingredient_changelist'), {'q': 'flour'})
+    assert [ingredient.name for ingredient in response.context['cl'].result_list][0] == 'Flour'
+    assert response.context['cl'].result_count == 3
+
+
+@pytest.mark.benchmark
+@needs_trigram
+def test_search_benchmark_stays_in_milliseconds(db):
+    with connection.cursor() as cursor:
+        cursor.execute(
+            """
+            INSERT INTO management_ingredient (name, price_per_gram, created_at, updated_at)
+            SELECT 'Ingredient ' || md5(n::text), 1, now(), now() FROM generate_series(1, 200000) AS n
+            """
+        )
+        cursor.execute('ANALYZE management_ingredient')
+    Ingredient.objects.create(name='Valrhona dark chocolate 70%', price_per_gram='4.00')
+
+    timings = []
+    for _ in range(20):
+        started = time.perf_counter()
+        found = list(search.ranked(Ingredient.objects.all(), ['name'], 'valrhona choc')[:5])
+        timings.append(time.perf_counter() - started)
+    median_ms = sorted(timings)[len(timings) // 2] * 1000
+    print(f"trigram search, 200k ingredients: median {median_ms:.2f} ms")
+    assert found[0].name == 'Valrhona dark chocolate 70%'
+    assert median_ms < 20
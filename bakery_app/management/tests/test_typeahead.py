@@ -0,0 +1,83 @@
+import pytest
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from bakery_app.management import typeahead
+from bakery_app.management.forms import ProductForm, RecipeIngredientFormSet
+from bakery_app.management.models import Ingredient, Recipe, RecipeIngredient
+
+
+@pytest.fixture
+def pantry(db):
+    Ingredient.objects.bulk_create(Ingredient(name=f'Ingredient {n:03}', price_per_gram='1.00') for n in range(45))
+    return Recipe.objects.create(name='Bread', description='Basic', shape='C', diameter='20.00')
+
+
+def formset_data(ingredients, prefix='recipeingredient_set'):
+    data = {f'{prefix}-TOTAL_FORMS': str(len(ingredients)), f'{prefix}-INITIAL_FORMS': '0'}
+    for index, ingredient in enumerate(ingredients):
+        data[f'{prefix}-{index}-ingredient'] = str(ingredient)
+        data[f'{prefix}-{index}-quantity_in_grams'] = '10.00'
+    return data
+
+
+def test_typeahead_pages_through_options(client, pantry):
+    url = reverse('management:typeahead', args=['ingredients'])
+    first = client.get(url).json()
+    assert [option['text'] for option in first['results']] == [f'Ingredient {n:03}' for n in range(20)]
+
+    second = client.get(url, {'cursor': first['next']}).json()
+    third = client.get(url, {'cursor': second['next']}).json()
+    assert second['results'][0]['text'] == 'Ingredient 020'
+    assert len(third['results']) == 5 and third['next'] is None
+
+    found = client.get(url, {'q': 'ingredient 042'}).json()['results']
+    assert found[0]['text'] == 'Ingredient 042'
+    assert client.get(reverse('management:typeahead', args=['suppliers'])).status_code == 404
+
+
+def test_lazy_select_renders_only_the_selected_option(pantry):
+    html = str(ProductForm()['recipe'])
+    assert 'data-typeahead="/management/typeahead/recipes/"' in html
+    assert html.count('<option') == 1
+
+    html = str(ProductForm(initial={'recipe': pantry.pk})['recipe'])
+    assert html.count('<option') == 2
+    assert f'<option value="{pantry.pk}" selected>Bread</option>' in html
+
+
+def test_formset_costs_a_constant_number_of_queries(pantry):
+    ingredients = list(Ingredient.objects.values_list('pk', flat=True))
+
+    def validate(count):
+        formset = RecipeIngredientFormSet(formset_data(ingredients[:count]), instance=pantry)
+        with CaptureQueriesContext(connection) as queries:
+            assert formset.is_valid(), formset.errors
+            formset.as_table()
+        return len(queries)
+
+    assert validate(2) == validate(40)
+
+    for index, pk in enumerate(ingredients[:30]):
+        RecipeIngredient.objects.create(recipe=pantry, ingredient_id=pk, quantity_in_grams=index + 1)
+    with CaptureQueriesContext(connection) as queries:
+        html = RecipeIngredientFormSet(instance=pantry).as_table()
+    # The lines, then one lookup for all their ingredients (no line has a sub-recipe to look up)
+    assert len(queries) == 2
+    assert html.count('selected>Ingredient') == 30
+
+
+def test_formset_rejects_unknown_choices(pantry):
+    data = formset_data([Ingredient.objects.first().pk, 999999, 'flour'])
+    formset = RecipeIngredientFormSet(data, instance=pantry)
+    assert not formset.is_valid()
+    assert formset.errors[0] == {}
+    assert 'ingredient' in formset.errors[1] and 'ingredient' in formset.errors[2]
+
+
+def test_options_default_to_name_order(pantry):
+    Ingredient.objects.create(name='Aaa butter', price_per_gram='1.00')
+    page = typeahead.options('ingredients', 'a', per_page=2)
+    assert [option['text'] for option in page['results']] == ['Aaa butter', 'Ingredient 000']
+    assert page['next']
@@ -1,9 +1,13 @@
 import pytest
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 from http import HTTPStatus
-from bakery_app.management.models import Supplier, Ingredient, Recipe, Product
+from bakery_app.management import costing
+from bakery_app.management.models import Supplier, Ingredient, Recipe, RecipeCost, RecipeIngredient, Product
 from django.contrib.auth import get_user_model
 import json
+from decimal import Decimal
 
 User = get_user_model()
 
@@ -203,3 +207,250 @@ def test_add_supplier(client, user):
 #     assert response.status_code ==  200
 #     assert Ingredient.objects.filter(name='Test Ingredient').exists()
 #     assert 'HX-Trigger' in response.headers
+
+
+@pytest.mark.django_db
+def test_product_table_view_query_count_is_constant(client, user, django_assert_max_num_queries):
+    recipe = Recipe.objects.create(name='Cake', description='Sponge', shape='C', diameter='20.00')
+    for n in range(25):
+        Product.objects.create(product_type=f'Cake {n}', sale_price='30.00', recipe=recipe)
+    client.force_login(user)
+    with django_assert_max_num_queries(8):
+        response = client.get(reverse('management:product-table'))
+    assert response.status_code == HTTPStatus.OK
+
+
+@pytest.mark.django_db
+def test_variations_table_view_query_count_is_constant(client, user, django_assert_max_num_queries):
+    recipe = Recipe.objects.create(name='Tray', description='Brownies', shape='R', length='30.00', width='20.00')
+    product = Product.objects.create(product_type='Brownies', sale_price='25.00', recipe=recipe)
+    for n in range(1, 40):
+        product.variations.create(length=n, width=10)
+    client.force_login(user)
+    with django_assert_max_num_queries(6):
+        response = client.get(reverse('management:variations-table'))
+    assert response.status_code == HTTPStatus.OK
+
+
+@pytest.mark.django_db
+def test_price_simulation_api(client, user, supplier):
+    butter = Ingredient.objects.create(name='Butter', price_per_gram='0.40', supplier=supplier)
+    recipe = Recipe.objects.create(name='Croissant', description='Laminated dough', shape='C', diameter='10.00')
+    recipe.recipeingredient_set.create(ingredient=butter, quantity_in_grams='50.00')
+    product = Product.objects.create(product_type='Croissant', sale_price='40.00', recipe=recipe)
+    client.force_login(user)
+    url = reverse('management:price-simulation-api')
+    payload = {'suppliers': {str(supplier.pk): '50'}, 'target_margin': '30'}
+    response = client.post(url, json.dumps(payload), content_type='application/json')
+    assert response.status_code == HTTPStatus.OK
+    products = response.json()['products']
+    assert products[0]['id'] == product.pk
+    assert products[0]['new_total_cost'] == '30.00'
+    butter.refresh_from_db()
+    assert str(butter.price_per_gram) == '0.40'
+
+
+@pytest.mark.django_db
+def test_price_simulation_api_skips_products_deleted_since_the_catalog_loaded(client, user, ingredient):
+    recipe = Recipe.objects.create(name='Tart', description='Shortcrust', shape='C', diameter='20.00')
+    recipe.recipeingredient_set.create(ingredient=ingredient, quantity_in_grams='4.00')
+    kept = Product.objects.create(product_type='Tart', sale_price='30.00', recipe=recipe)
+    deleted = Product.objects.create(product_type='Mini tart', sale_price='12.00', recipe=recipe)
+    costing.cached_catalog()
+    # Not committed yet, so the cached catalog still has it
+    deleted.delete()
+    client.force_login(user)
+    url = reverse('management:price-simulation-api')
+    response = client.post(url, json.dumps({'ingredients': {str(ingredient.pk): '3.00'}}), content_type='application/json')
+    assert response.status_code == HTTPStatus.OK
+    assert [row['id'] for row in response.json()['products']] == [kept.pk]
+
+
+@pytest.mark.django_db
+def test_price_simulation_api_rejects_bad_input(client, user):
+    client.force_login(user)
+    url = reverse('management:price-simulation-api')
+    response = client.post(url, json.dumps({'ingredients': {'1': 'cheap'}}), content_type='application/json')
+    assert response.status_code == HTTPStatus.BAD_REQUEST
+    for limit in (0, -5, 1001, 10**9):
+        response = client.post(url, json.dumps({'limit': limit}), content_type='application/json')
+        assert response.status_code == HTTPStatus.BAD_REQUEST
+        assert 'limit' in response.json()['error']
+
+
+@pytest.mark.django_db
+def test_price_simulation_page(client, user):
+    client.force_login(user)
+    response = client.get(reverse('management:price-simulation'))
+    assert response.status_code == HTTPStatus.OK
+    data = {
+        'ingredients-TOTAL_FORMS': '0', 'ingredients-INITIAL_FORMS': '0',
+        'suppliers-TOTAL_FORMS': '0', 'suppliers-INITIAL_FORMS': '0',
+        'target_margin': '',
+    }
+    response = client.post(reverse('management:price-simulation'), data, HTTP_HX_REQUEST='true')
+    assert response.status_code == HTTPStatus.OK
+    assert b'No products affected.' in response.content
+
+
+@pytest.mark.django_db
+def test_ingredient_detail_view(client, user, ingredient):
+    recipe = Recipe.objects.create(name='Bread', description='Basic bread recipe.')
+    RecipeIngredient.objects.create(recipe=recipe, ingredient=ingredient, quantity_in_grams='100')
+    client.force_login(user)
+    response = client.get(reverse('management:ingredient-detail', args=[ingredient.pk]))
+    assert response.status_code == HTTPStatus.OK
+    assert recipe.name in response.content.decode()
+
+
+@pytest.mark.django_db
+def test_production_plan_api(client, user, ingredient):
+    recipe = Recipe.objects.create(name='Bread', description='Basic bread recipe.', shape='R', length='30', width='20')
+    RecipeIngredient.objects.create(recipe=recipe, ingredient=ingredient, quantity_in_grams='100')
+    product = Product.objects.create(product_type='Loaf', sale_price='10.00', recipe=recipe)
+    variation = product.variations.get()
+    client.force_login(user)
+    response = client.post(
+        reverse('management:production-plan-api'),
+        json.dumps({'name': 'Monday', 'bake_date': '2026-10-19', 'lines': [{'variation': variation.pk, 'quantity': 3}]}),
+        content_type='application/json',
+    )
+    assert response.status_code == HTTPStatus.CREATED
+    data = response.json()
+    assert data['bake_date'] == '2026-10-19'
+    assert data['suppliers'][0]['ingredients'] == [{'id': ingredient.pk, 'name': 'Flour', 'grams': '300.00', 'cost': '750.00'}]
+
+    response = client.get(reverse('management:production-plan-demand-api', args=[data['id']]))
+    assert response.json() == data
+
+
+@pytest.mark.django_db
+def test_production_plan_api_rejects_unknown_variations(client, user):
+    client.force_login(user)
+    response = client.post(
+        reverse('management:production-plan-api'),
+        json.dumps({'lines': [{'variation': 999999, 'quantity': 1}]}),
+        content_type='application/json',
+    )
+    assert response.status_code == HTTPStatus.BAD_REQUEST
+
+
+@pytest.mark.django_db
+def test_product_table_filters_and_sorts_on_costing_columns(client, user, ingredient):
+    recipe = Recipe.objects.create(name='Cake', description='Sponge', shape='C', diameter='20.00')
+    recipe.recipeingredient_set.create(ingredient=ingredient, quantity_in_grams='4.00')  # costs 10.00
+    for sale_price in ('11.00', '12.00', '12.40', '20.00', '50.00'):
+        Product.objects.create(product_type=f'Cake {sale_price}', sale_price=sale_price, recipe=recipe)
+    client.force_login(user)
+    # Under 20% margin, sorted by profit, highest first
+    response = client.get(reverse('management:product-table'), {'margin_percentage_max': '20', 'sort': '-profit'})
+    rows = [(row.record.sale_price, row.record.profit) for row in response.context['table'].paginated_rows]
+    assert rows == [(Decimal('12.40'), Decimal('2.40')), (Decimal('12.00'), Decimal('2.00')), (Decimal('11.00'), Decimal('1.00'))]
+
+    response = client.get(reverse('management:product-table'), {'total_cost_min': '10', 'profit_min': '10', 'sort': 'margin_percentage'})
+    assert [row.record.margin_percentage for row in response.context['table'].paginated_rows] == [Decimal('50.00'), Decimal('80.00')]
+
+
+@pytest.mark.django_db
+def test_variations_table_filters_and_sorts_on_adjusted_costing(client, user, ingredient):
+    recipe = Recipe.objects.create(name='Tray', description='Brownies', shape='R', length='10.00', width='10.00')
+    recipe.recipeingredient_set.create(ingredient=ingredient, quantity_in_grams='4.00')
+    product = Product.objects.create(product_type='Brownies', sale_price='30.00', recipe=recipe)
+    for length in (5, 30, 20):
+        product.variations.create(length=length, width=10)
+    client.force_login(user)
+    response = client.get(reverse('management:variations-table'), {'adjusted_cost_max': '25', 'sort': '-adjusted_cost'})
+    costs = [row.record.variation_cost for row in response.context['table'].paginated_rows]
+    assert costs == sorted(costs, reverse=True)
+    assert costs and all(cost <= 25 for cost in costs)
+    assert Decimal('30.00') not in costs
+
+
+@pytest.mark.django_db
+def test_ingredient_table_filters_on_ingredient_fields(client, user, ingredient):
+    Ingredient.objects.create(name='Butter', price_per_gram='0.40')
+    Ingredient.objects.create(name='Sugar', price_per_gram='1.00')
+    client.force_login(user)
+    url = reverse('management:ingredient-table')
+    # Product filter parameters mean nothing here and are ignored
+    response = client.get(url, {'search': 'flour', 'total_cost_min': '10', 'margin_percentage_max': '5'})
+    assert response.status_code == HTTPStatus.OK
+    assert [row.record.name for row in response.context['table'].paginated_rows] == ['Flour']
+
+    response = client.get(url, {'price_per_gram_max': '1.00', 'sort': 'name'}, HTTP_HX_REQUEST='true')
+    assert response.status_code == HTTPStatus.OK
+    content = response.content.decode()
+    assert 'Butter' in content and 'Sugar' in content and 'Flour' not in content
+
+
+def recipe_data(recipe, lines, initial=0):
+    data = {
+        'name': recipe.name, 'description': recipe.description, 'shape': 'C', 'diameter': '20.00',
+        'recipeingredient_set-TOTAL_FORMS': str(len(lines)), 'recipeingredient_set-INITIAL_FORMS': str(initial),
+    }
+    for index, line in enumerate(lines):
+        data.update({f'recipeingredient_set-{index}-{name}': value for name, value in line.items()})
+    return data
+
+
+@pytest.mark.django_db
+def test_recipe_update_saves_lines_in_a_constant_number_of_queries(client, user):
+    flours = Ingredient.objects.bulk_create(Ingredient(name=f'Flour {n}', price_per_gram='1.00') for n in range(40))
+    client.force_login(user)
+
+    def save(count):
+        recipe = Recipe.objects.create(name=f'Bread {count}', description='Basic', shape='C', diameter='20.00')
+        lines = [{'ingredient': flour.pk, 'quantity_in_grams': '10.00'} for flour in flours[:count]]
+        with CaptureQueriesContext(connection) as queries:
+            response = client.post(reverse('management:recipe-update', args=[recipe.pk]), recipe_data(recipe, lines))
+        assert response.status_code == HTTPStatus.FOUND
+        assert recipe.recipeingredient_set.count() == count
+        return len(queries)
+
+    assert save(2) == save(40)
+
+
+@pytest.mark.django_db
+def test_recipe_update_writes_only_changed_lines(client, user, ingredient):
+    recipe = Recipe.objects.create(name='Cake', description='Sponge', shape='C', diameter='20.00')
+    kept, changed, removed = (
+        recipe.recipeingredient_set.create(ingredient=ingredient, quantity_in_grams=grams) for grams in ('1.00', '2.00', '3.00')
+    )
+    RecipeCost.objects.refresh_dirty()
+    butter = Ingredient.objects.create(name='Butter', price_per_gram='1.00')
+    lines = [
+        {'id': kept.pk, 'ingredient': ingredient.pk, 'quantity_in_grams': '1.00'},
+        {'id': changed.pk, 'ingredient': ingredient.pk, 'quantity_in_grams': '4.00'},
+        {'id': removed.pk, 'ingredient': ingredient.pk, 'quantity_in_grams': '3.00', 'DELETE': 'on'},
+        {'ingredient': butter.pk, 'quantity_in_grams': '5.00'},
+    ]
+    client.force_login(user)
+    response = client.post(reverse('management:recipe-update', args=[recipe.pk]), recipe_data(recipe, lines, initial=3))
+    assert response.status_code == HTTPStatus.FOUND
+
+    assert sorted(recipe.recipeingredient_set.values_list('quantity_in_grams', flat=True)) == [1, 4, 5]
+    assert RecipeIngredient.objects.get(pk=kept.pk).updated_at == kept.updated_at
+    assert RecipeIngredient.objects.get(pk=changed.pk).updated_at > changed.updated_at
+    # The lines were written without their signals, so the formset marked the cost stale itself
+    assert RecipeCost.objects.get(recipe=recipe).is_dirty
+    RecipeCost.objects.refresh_dirty()
+    assert RecipeCost.objects.get(recipe=recipe).cost == Decimal('17.50')
+
+
+@pytest.mark.django_db
+def test_recipe_update_rejects_cycles_and_bad_quantities(client, user, ingredient):
+    dough = Recipe.objects.create(name='Dough', description='Base', shape='C', diameter='20.00')
+    tart = Recipe.objects.create(name='Tart', description='Filled', shape='C', diameter='20.00')
+    tart.recipeingredient_set.create(sub_recipe=dough, quantity_in_grams='300.00')
+    lines = [
+        {'sub_recipe': tart.pk, 'quantity_in_grams': '10.00'},
+        {'ingredient': ingredient.pk, 'quantity_in_grams': '0.00'},
+        {'ingredient': ingredient.pk, 'quantity_in_grams': '100000.00'},
+    ]
+    client.force_login(user)
+    response = client.post(reverse('management:recipe-update', args=[dough.pk]), recipe_data(dough, lines))
+    assert response.status_code == HTTPStatus.OK
+    errors = response.context['formset'].errors
+    assert 'sub_recipe' in errors[0]
+    assert 'quantity_in_grams' in errors[1] and 'quantity_in_grams' in errors[2]
+    assert not dough.recipeingredient_set.exists()
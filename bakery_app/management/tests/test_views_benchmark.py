@@ -0,0 +1,97 @@
+"""
+End-to-end benchmarks of the management views at realistic catalogue sizes. See benchmarks.py
+for the environment variables that pick sizes, write results as JSON and compare with a baseline:
+
+    BENCHMARK_SIZES=1000,10000,100000 BENCHMARK_JSON=bench.json pytest -m benchmark -k views_benchmark -s
+    BENCHMARK_BASELINE=bench.json pytest -m benchmark -k views_benchmark
+"""
+import itertools
+
+import pytest
+from django.core.cache import cache
+from django.test import RequestFactory
+from django.urls import reverse
+
+from bakery_app.management.models import Ingredient, Product, Recipe
+from bakery_app.management.tests import benchmarks
+from bakery_app.management.views import product_list_view
+
+pytestmark = pytest.mark.benchmark
+
+
+@pytest.mark.parametrize('size', benchmarks.sizes())
+def test_views_benchmark(size, client, admin_client, django_user_model):
+    benchmarks.seed(size)
+    client.force_login(django_user_model.objects.create_user(email='bench@example.com', password='12345'))
+    ingredient = Ingredient.objects.order_by('pk').first()
+    recipe = Recipe.objects.order_by('pk').first()
+    product = Product.objects.order_by('pk').first()
+    counter = itertools.count()
+    results = {}
+
+    def get(url, params=None, htmx=False, as_client=client):
+        headers = {'HTTP_HX_REQUEST': 'true'} if htmx else {}
+        return lambda: as_client.get(url, params or {}, **headers)
+
+    def post(url, data):
+        def request():
+            response = client.post(url, data(next(counter)), HTTP_HX_REQUEST='true')
+            assert response.status_code == 204, response.content[:500]
+        return request
+
+    # Table views, rendered from scratch every time
+    for label, name, params in (
+        ('product-table', 'product-table', {}),
+        ('product-table by margin', 'product-table', {'sort': '-margin_percentage', 'margin_percentage_max': '50'}),
+        ('ingredient-table', 'ingredient-table', {}),
+        ('variations-table by cost', 'variations-table', {'sort': 'adjusted_cost'}),
+    ):
+        url = reverse(f'management:{name}')
+        results[f'{label} page'] = benchmarks.measure(get(url, params), before=cache.clear)
+        results[f'{label} htmx'] = benchmarks.measure(get(url, params, htmx=True), before=cache.clear)
+    results['product-table htmx cached'] = benchmarks.measure(get(reverse('management:product-table'), htmx=True))
+
+    factory = RequestFactory()
+
+    def product_list(htmx):
+        def request():
+            request = factory.get('/', HTTP_HX_REQUEST='true' if htmx else None)
+            request.htmx = htmx
+            product_list_view(request)
+        return request
+
+    results['product_list_view page'] = benchmarks.measure(product_list(False), before=cache.clear)
+    results['product_list_view htmx'] = benchmarks.measure(product_list(True), before=cache.clear)
+
+    # HTMX modal POSTs
+    results['add_supplier POST'] = benchmarks.measure(post(reverse('management:add_supplier'), lambda n: {
+        'name': f'Bench supplier {n}', 'ruc': f'{n:013}', 'email': f'bench{n}@example.com',
+        'phone': '+593991234567', 'address': 'Quito',
+    }))
+    results['add_ingredient POST'] = benchmarks.measure(post(reverse('management:add_ingredient'), lambda n: {
+        'name': f'Bench ingredient {n}', 'supplier': ingredient.supplier_id, 'price_per_gram': '1.25',
+    }))
+    results['add_recipe POST'] = benchmarks.measure(post(reverse('management:add_recipe'), lambda n: {
+        'name': f'Bench recipe {n}', 'description': 'Benchmark', 'shape': 'C', 'diameter': '20.00',
+        'recipeingredient_set-TOTAL_FORMS': '1', 'recipeingredient_set-INITIAL_FORMS': '0',
+        'recipeingredient_set-0-ingredient': ingredient.pk, 'recipeingredient_set-0-quantity_in_grams': '100.00',
+    }))
+    results['add_product POST'] = benchmarks.measure(post(reverse('management:add_product'), lambda n: {
+        'product_type': f'Bench product {n}', 'sale_price': '20.00', 'recipe': recipe.pk,
+    }))
+    results['add_product_variation POST'] = benchmarks.measure(post(reverse('management:add_product_variation'), lambda n: {
+        'product': product.pk, 'diameter': f'{10 + n % 20}.00',
+    }))
+
+    # Admin changelists
+    for model in ('product', 'productvariation', 'ingredient', 'recipe', 'supplier'):
+        url = reverse(f'admin:management_{model}_changelist')
+        results[f'admin {model}'] = benchmarks.measure(get(url, as_client=admin_client))
+    results['admin product search'] = benchmarks.measure(
+        get(reverse('admin:management_product_changelist'), {'q': 'product 42'}, as_client=admin_client)
+    )
+
+    benchmarks.report(size, results)
+    benchmarks.write(size, results)
+    regressions = benchmarks.regressions(size, results)
+    assert not regressions, 'Slower than the baseline:\n' + '\n'.join(regressions)
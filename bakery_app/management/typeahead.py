@@ -0,0 +1,151 @@
+"""
+Typeahead selects for foreign keys to large tables.
+
+LazySelect renders only the selected option; typeahead.js fills in the rest from the typeahead
+endpoint as the user types. LazyModelChoiceField resolves its value through a ChoiceLookup when
+its form belongs to a SharedChoicesMixin formset, so every form of the formset is rendered and
+validated from one query per field instead of one (and a full option list) per form.
+"""
+from django import forms
+from django.core.exceptions import ValidationError
+from django.urls import reverse
+
+from . import search
+from .models import Ingredient, Product, Recipe
+from .pagination import KeysetPaginator
+
+PER_PAGE = 20
+
+# Typeahead source name: (model, field shown as the option label)
+SOURCES = {
+    'ingredients': (Ingredient, 'name'),
+    'recipes': (Recipe, 'name'),
+    'products': (Product, 'product_type'),
+}
+
+
+def options(source, term, cursor=None, per_page=PER_PAGE):
+    """A page of ``{'id', 'text'}`` options for ``term``, best match first, and the cursor of the next page."""
+    model, label = SOURCES[source]
+    queryset = model.objects.only('pk', label)
+    if len(term.strip()) >= search.MIN_LENGTH:
+        queryset = search.ranked(queryset, search.SEARCH_FIELDS[source], term)
+    else:
+        queryset = queryset.order_by(label, 'pk')
+    page = KeysetPaginator(queryset, per_page, cursor=cursor).page()
+    return {
+        'results': [{'id': record.pk, 'text': getattr(record, label)} for record in page],
+        'next': page.next_cursor,
+    }
+
+
+def valid_keys(field, values):
+    """``values`` as lookup keys, leaving out empty ones and any the key field would reject."""
+    opts = field.queryset.model._meta
+    key_field = opts.get_field(field.to_field_name) if field.to_field_name else opts.pk
+    keys = set()
+    for value in values:
+        if value in field.empty_values:
+            continue
+        try:
+            keys.add(key_field.to_python(value))
+        except ValidationError:
+            pass
+    return keys
+
+
+class ChoiceLookup:
+    """The objects for one field's values across a whole formset, loaded together on first use."""
+
+    def __init__(self, field, values):
+        self.field = field
+        self.values = values
+        self._objects = None
+
+    def get(self, value):
+        if self._objects is None:
+            key = self.field.to_field_name or 'pk'
+            keys = valid_keys(self.field, self.values)
+            found = self.field.queryset.filter(**{f'{key}__in': keys}) if keys else []
+            self._objects = {str(getattr(obj, key)): obj for obj in found}
+        return self._objects.get(str(value))
+
+
+class LazySelect(forms.Select):
+    """A select rendering only its selected option, with the typeahead URL of ``source`` for typeahead.js."""
+
+    def __init__(self, source=None, attrs=None):
+        super().__init__(attrs)
+        self.source = source
+
+    def get_context(self, name, value, attrs):
+        context = super().get_context(name, value, attrs)
+        if self.source:
+            context['widget']['attrs']['data-typeahead'] = reverse('management:typeahead', args=[self.source])
+        return context
+
+    def optgroups(self, name, value, attrs=None):
+        field = self.choices.field
+        selected = [item for item in value if item not in field.empty_values]
+        choices = [] if field.empty_label is None else [('', field.empty_label)]
+        choices += [(field.prepare_value(obj), field.label_from_instance(obj)) for obj in field.objects_for(selected)]
+        return [
+            (None, [self.create_option(name, option, label, str(option) in selected, index, attrs=attrs)], index)
+            for index, (option, label) in enumerate(choices)
+        ]
+
+
+class LazyModelChoiceField(forms.ModelChoiceField):
+    widget = LazySelect
+    lookup = None
+
+    def objects_for(self, values):
+        if self.lookup is not None:
+            return [obj for obj in map(self.lookup.get, values) if obj is not None]
+        keys = valid_keys(self, values)
+        return list(self.queryset.filter(**{f'{self.to_field_name or "pk"}__in': keys})) if keys else []
+
+    def to_python(self, value):
+        if self.lookup is None or value in self.empty_values or isinstance(value, self.queryset.model):
+            return super().to_python(value)
+        obj = self.lookup.get(value)
+        if obj is None:
+            raise ValidationError(self.error_messages['invalid_choice'], code='invalid_choice', params={'value': value})
+        return obj
+
+
+class SharedLookupModelForm(forms.ModelForm):
+    def _get_validation_exclusions(self):
+        # A field resolved through a ChoiceLookup is known to exist; leaving it out of model
+        # validation saves ForeignKey.validate()'s existence query for every form
+        exclude = super()._get_validation_exclusions()
+        exclude.update(
+            name for name, field in self.fields.items()
+            if isinstance(field, LazyModelChoiceField) and field.lookup is not None
+        )
+        return exclude
+
+
+class SharedChoicesMixin:
+    """Formset mixin: the LazyModelChoiceFields of all its forms share one ChoiceLookup per field."""
+
+    def _lookup_values(self, name):
+        values = [initial.get(name) for initial in self.initial or []]
+        if self.is_bound:
+            values += [self.data.get(f'{self.add_prefix(index)}-{name}') for index in range(self.total_form_count())]
+        values += [obj.serializable_value(name) for obj in self.get_queryset()]
+        return values
+
+    def _construct_form(self, i, **kwargs):
+        form = super()._construct_form(i, **kwargs)
+        lookups = self.__dict__.setdefault('_choice_lookups', {})
+        for name, field in form.fields.items():
+            if isinstance(field, LazyModelChoiceField):
+                if name not in lookups:
+                    lookups[name] = ChoiceLookup(field, self._lookup_values(name))
+                field.lookup = lookups[name]
+        return form
+
+
+class SharedChoicesInlineFormSet(SharedChoicesMixin, forms.BaseInlineFormSet):
+    pass
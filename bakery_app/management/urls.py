@@ -1,7 +1,7 @@
 from django.urls import path
 from .views import (
     SupplierListView, SupplierCreateView, SupplierUpdateView, SupplierDeleteView,
-    IngredientListView, IngredientCreateView, IngredientUpdateView, IngredientDeleteView,
+    IngredientListView, IngredientDetailView, IngredientCreateView, IngredientUpdateView, IngredientDeleteView,
     ProductListView, ProductCreateView, ProductUpdateView, ProductDeleteView,
     RecipeListView, RecipeCreateView, RecipeUpdateView,
     ProductTableView, VariationsTableView, IngredientTableView,
@@ -22,6 +22,7 @@ urlpatterns = [
     # Ingredient URLs
     path('ingredients/', IngredientListView.as_view(), name='ingredient-list'),
     path('ingredients/new/', IngredientCreateView.as_view(), name='ingredient-create'),
+    path('ingredients/<int:pk>/', IngredientDetailView.as_view(), name='ingredient-detail'),
     path('ingredients/<int:pk>/update/', IngredientUpdateView.as_view(), name='ingredient-update'),
     path('ingredients/<int:pk>/delete/', IngredientDeleteView.as_view(), name='ingredient-delete'),
 
@@ -35,6 +36,7 @@ urlpatterns = [
     path('recipes/', RecipeListView.as_view(), name='recipe-list'),
     path('recipes/new/', RecipeCreateView.as_view(), name='recipe-create'),
     path('recipes/<int:pk>/update/', RecipeUpdateView.as_view(), name='recipe-update'),
+    path('recipes/export.json', views.export_recipes, name='recipe-export'),
 
     # Modal and Table URLs
     path('add_supplier/', add_supplier, name='add_supplier'),
@@ -47,8 +49,22 @@ urlpatterns = [
     path('product/table/', ProductTableView.as_view(), name='product-table'),
     path('ingredients/table/', IngredientTableView.as_view(), name='ingredient-table'),
     path('variations/table/', VariationsTableView.as_view(), name='variations-table'),
+    path('export/<slug:table>.<slug:format>', views.export_table, name='table-export'),
+    path('api/fragment-cache/stats/', views.fragment_cache_stats, name='fragment-cache-stats'),
+    path('search/', views.live_search, name='live-search'),
+    path('typeahead/<slug:source>/', views.typeahead_options, name='typeahead'),
     path('products/', product_list_view, name='product-list'),
     path('update_variation_form/<int:product_id>/', views.update_variation_form, name='update_variation_form'),
     path('get_product_shape/<int:product_id>/', views.get_product_shape, name='get_product_shape'),
+    path('api/product-shapes/', views.product_shapes, name='product-shapes'),
+
+    # What-if pricing
+    path('price-simulation/', views.price_simulation, name='price-simulation'),
+    path('api/price-simulation/', views.price_simulation_api, name='price-simulation-api'),
+    path('suppliers/price-lists/import/', views.import_price_list, name='price-list-import'),
+
+    # Production planning
+    path('api/production-plans/', views.production_plan_api, name='production-plan-api'),
+    path('api/production-plans/<int:pk>/demand/', views.production_plan_demand_api, name='production-plan-demand-api'),
 
 ]
@@ -1,23 +1,34 @@
+import io
 import json
 from django.shortcuts import render
 from django.urls import reverse_lazy
 from django.shortcuts import render, redirect
 from django.views.generic import ListView, CreateView, UpdateView, DeleteView, DetailView
-from .models import Supplier, Ingredient, Recipe, Product, ProductVariation
+from .models import Supplier, Ingredient, Recipe, Product, ProductVariation, ProductionPlan, ProductionPlanLine
 from django.http import HttpResponse
 from .tables import ProductTable, ProductVariationTable, IngredientTable
-from django.http import JsonResponse
+from django.http import JsonResponse, StreamingHttpResponse, Http404
 from django_tables2 import SingleTableView
 from django.http import HttpResponseRedirect
 from django_tables2.views import SingleTableMixin
+from django_tables2 import RequestConfig
 from django_filters.views import FilterView
-from .filters import ProductFilter
+from .filters import IngredientFilter, ProductFilter, ProductVariationFilter
 from django.http import HttpResponse
 from .forms import RecipeForm, RecipeIngredientForm, Recipe, RecipeIngredient, SupplierForm, ProductForm, IngredientForm, ProductVariationForm
 from django.views import View
 from django.shortcuts import get_object_or_404
 from django.forms import inlineformset_factory
-from .forms import ProductVariationFormSet
+from .forms import BaseRecipeIngredientFormSet, ProductVariationFormSet
+from .forms import IngredientPriceChangeFormSet, SupplierPriceChangeFormSet, PriceSimulationForm, PriceListImportForm
+from . import costing, export, fragments, pricelists, recipebook, search, typeahead
+from .pagination import CURSOR_FIELD, KeysetPaginationMixin, KeysetPaginator
+from decimal import Decimal, InvalidOperation
+from django.views.decorators.http import require_GET, require_POST
+from django.contrib.admin.views.decorators import staff_member_required
+from django.db import transaction
+from datetime import date
+from django_htmx.http import retarget
 from django.template.loader import render_to_string
 
 # Supplier views
@@ -48,6 +59,18 @@ class IngredientListView(ListView):
     template_name = 'management/suppliers/list.html'
     context_object_name = 'ingredients'
 
+class IngredientDetailView(DetailView):
+    model = Ingredient
+    template_name = 'management/suppliers/ingredient_detail.html'
+    context_object_name = 'ingredient'
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['recipe_lines'] = RecipeIngredient.objects.for_ingredient(self.object)
+        context['products'] = Product.objects.using_ingredient(self.object).select_related('recipe').order_by('-ingredient_cost')
+        context['variation_count'] = ProductVariation.objects.using_ingredient(self.object).count()
+        return context
+
 class IngredientCreateView(CreateView):
     model = Ingredient
     form_class = IngredientForm
@@ -152,7 +175,9 @@ class RecipeListView(ListView):
 RecipeIngredientFormSet = inlineformset_factory(
     Recipe, RecipeIngredient,
     form=RecipeIngredientForm,
-    fields=['ingredient', 'quantity_in_grams'],
+    formset=BaseRecipeIngredientFormSet,
+    fk_name='recipe',
+    fields=['ingredient', 'sub_recipe', 'quantity_in_grams'],
     extra=3,
     can_delete=True
 )
@@ -197,24 +222,38 @@ class RecipeUpdateView(View):
 
 # table view
 
-class ProductTableView(SingleTableMixin, FilterView):
+# Models each table is rendered from, for the fragment cache
+PRODUCT_TABLE_MODELS = (Product, Recipe, RecipeIngredient, Ingredient)
+VARIATION_TABLE_MODELS = PRODUCT_TABLE_MODELS + (ProductVariation,)
+
+class ProductTableView(fragments.FragmentCacheMixin, KeysetPaginationMixin, SingleTableMixin, FilterView):
     model = Product
     table_class = ProductTable
     template_name = 'management/suppliers/product_table_htmx.html'
     filterset_class = ProductFilter
-    paginate_by = 10
+    table_pagination = {'per_page': 10}
+    fragment_models = PRODUCT_TABLE_MODELS
+
+    def get_queryset(self):
+        return Product.objects.with_costing()
 
-class IngredientTableView(SingleTableMixin, FilterView):
+class IngredientTableView(fragments.FragmentCacheMixin, KeysetPaginationMixin, SingleTableMixin, FilterView):
     model = Ingredient
     table_class = IngredientTable
     template_name = 'management/suppliers/ingredient_table_htmx.html'
-    filterset_class = ProductFilter
-    paginate_by = 10
+    filterset_class = IngredientFilter
+    table_pagination = {'per_page': 10}
+    fragment_models = (Ingredient,)
 
-class VariationsTableView(SingleTableMixin, FilterView):
+class VariationsTableView(fragments.FragmentCacheMixin, SingleTableMixin, FilterView):
     model = ProductVariation
     table_class = ProductVariationTable
     template_name = 'management/suppliers/variations_table.html'
+    filterset_class = ProductVariationFilter
+    fragment_models = VARIATION_TABLE_MODELS
+
+    def get_queryset(self):
+        return ProductVariation.objects.select_related('product__recipe').with_adjusted_costing()
 
 
 # modals
@@ -316,23 +355,283 @@ def add_product_variation(request):
     return render(request, 'management/suppliers/form_add_product_variation.html', {'form': form})
 
 
-def product_list_view(request):
-    filter = ProductFilter(request.GET, queryset=Product.objects.all())
+def _product_list_table(request):
+    filter = ProductFilter(request.GET, queryset=Product.objects.with_costing())
     table = ProductTable(filter.qs)
-    table.paginate(page=request.GET.get("page", 1), per_page=10)
+    RequestConfig(request, paginate={
+        'paginator_class': KeysetPaginator, 'per_page': 10, 'cursor': request.GET.get(CURSOR_FIELD),
+    }).configure(table)
+    return filter, table
+
 
+@fragments.conditional('product-list', PRODUCT_TABLE_MODELS, htmx_only=True)
+def product_list_view(request):
     if request.htmx:
-        return render(request, 'management/suppliers/product_table_partial.html', {'table': table})
-    else:
-        return render(request, 'management/suppliers/product_table_htmx.html', {'table': table, 'filter': filter})
+        def render_partial():
+            _, table = _product_list_table(request)
+            return render_to_string('management/suppliers/product_table_partial.html', {'table': table}, request)
+
+        return HttpResponse(fragments.cached_fragment('product-list', request, PRODUCT_TABLE_MODELS, render_partial))
+    filter, table = _product_list_table(request)
+    return render(request, 'management/suppliers/product_table_htmx.html', {'table': table, 'filter': filter})
+
+
+# Table exports: table class, queryset and filterset per export name
+EXPORTS = {
+    'products': (ProductTable, lambda: Product.objects.with_costing(), ProductFilter),
+    'variations': (
+        ProductVariationTable,
+        lambda: ProductVariation.objects.select_related('product__recipe').with_adjusted_costing(),
+        ProductVariationFilter,
+    ),
+    'ingredients': (IngredientTable, lambda: Ingredient.objects.all(), IngredientFilter),
+}
+
+
+@require_GET
+def export_table(request, table, format):
+    """Stream a whole table as CSV or XLSX, filtered and sorted by the same query parameters as the page."""
+    if table not in EXPORTS or format not in export.CONTENT_TYPES:
+        raise Http404
+    table_class, queryset, filterset_class = EXPORTS[table]
+    queryset = queryset()
+    if filterset_class is not None:
+        queryset = filterset_class(request.GET, queryset=queryset).qs
+    exported = RequestConfig(request, paginate=False).configure(table_class(queryset))
+    rows = export.table_rows(exported)
+    stream = export.csv_stream(rows) if format == 'csv' else export.xlsx_stream(rows, sheet=table)
+    response = StreamingHttpResponse(stream, content_type=export.CONTENT_TYPES[format])
+    response['Content-Disposition'] = f'attachment; filename="{table}-{date.today().isoformat()}.{format}"'
+    return response
+
+
+@require_GET
+@fragments.conditional('typeahead', tuple(model for model, _ in typeahead.SOURCES.values()))
+def typeahead_options(request, source):
+    """Options for the LazySelect of ``source``, a page at a time: ``?q=<term>&cursor=<next>``."""
+    if source not in typeahead.SOURCES:
+        raise Http404
+    return JsonResponse(typeahead.options(source, request.GET.get('q', ''), request.GET.get(CURSOR_FIELD)))
+
+
+@require_GET
+@staff_member_required
+def fragment_cache_stats(request):
+    return JsonResponse(fragments.stats())
+
+
+@require_GET
+@fragments.conditional('live-search', (Product, Recipe, Ingredient, Supplier))
+def live_search(request):
+    term = request.GET.get('q', '')
+    return render(request, 'management/suppliers/search_results.html', {
+        'term': term, 'results': search.catalogue(term), 'min_length': search.MIN_LENGTH,
+    })
 
+def _product_shape(product_id):
+    shape = Product.objects.filter(pk=product_id).values_list('recipe__shape', flat=True).first()
+    if shape is None:
+        raise Http404
+    return shape
+
+@require_GET
+@fragments.conditional('product-shape', (Product, Recipe))
 def update_variation_form(request, product_id):
-    product = Product.objects.get(pk=product_id)
     return JsonResponse({
-        'shape': product.recipe.shape
+        'shape': _product_shape(product_id)
     })
 
+@require_GET
+@fragments.conditional('product-shape', (Product, Recipe))
 def get_product_shape(request, product_id):
-    product = Product.objects.get(pk=product_id)
-    shape = product.recipe.shape
-    return JsonResponse({'shape': shape})
+    return JsonResponse({'shape': _product_shape(product_id)})
+
+
+PRODUCT_SHAPES_LIMIT = 500
+
+@require_GET
+@fragments.conditional('product-shapes', (Product, Recipe))
+def product_shapes(request):
+    """Shape and default dimensions of many products at once: ``?ids=1,2,3``."""
+    try:
+        ids = {int(value) for value in request.GET.get('ids', '').split(',') if value}
+    except ValueError:
+        return JsonResponse({'error': 'ids must be a comma-separated list of product ids.'}, status=400)
+    if len(ids) > PRODUCT_SHAPES_LIMIT:
+        return JsonResponse({'error': f'At most {PRODUCT_SHAPES_LIMIT} products per request.'}, status=400)
+    return JsonResponse({'shapes': Product.objects.filter(pk__in=ids).shapes() if ids else {}})
+
+
+# what-if pricing
+def _simulation_rows(simulation, target_margin, limit):
+    products = list(simulation.products(limit=limit, target_margin=target_margin))
+    variations = list(simulation.variations(limit=limit, target_margin=target_margin))
+    product_names = Product.objects.in_bulk([row['id'] for row in products])
+    variation_names = ProductVariation.objects.select_related('product').in_bulk([row['id'] for row in variations])
+    # The cached catalog is only reloaded once a write commits, so it can still hold deleted rows
+    products = [{**row, 'name': str(product_names[row['id']])} for row in products if row['id'] in product_names]
+    variations = [
+        {**row, 'name': str(variation_names[row['id']])} for row in variations if row['id'] in variation_names
+    ]
+    return products, variations
+
+
+def price_simulation(request):
+    if request.method == "POST":
+        form = PriceSimulationForm(request.POST)
+        ingredient_formset = IngredientPriceChangeFormSet(request.POST, prefix='ingredients')
+        supplier_formset = SupplierPriceChangeFormSet(request.POST, prefix='suppliers')
+        if form.is_valid() and ingredient_formset.is_valid() and supplier_formset.is_valid():
+            simulation = costing.simulate(
+                ingredient_prices={
+                    change['ingredient'].pk: change['price_per_gram'] for change in ingredient_formset.cleaned_data if change
+                },
+                supplier_percentages={
+                    change['supplier'].pk: change['percentage'] for change in supplier_formset.cleaned_data if change
+                },
+                catalog=costing.cached_catalog(),
+            )
+            target_margin = form.cleaned_data['target_margin']
+            products, variations = _simulation_rows(simulation, target_margin, limit=50)
+            return render(request, 'management/suppliers/price_simulation_results.html', {
+                'products': products,
+                'variations': variations,
+                'target_margin': target_margin,
+            })
+    else:
+        form = PriceSimulationForm()
+        ingredient_formset = IngredientPriceChangeFormSet(prefix='ingredients')
+        supplier_formset = SupplierPriceChangeFormSet(prefix='suppliers')
+    context = {
+        'form': form,
+        'ingredient_formset': ingredient_formset,
+        'supplier_formset': supplier_formset,
+    }
+    if request.htmx:
+        # Invalid submissions re-render the form in place instead of the results panel
+        return retarget(render(request, 'management/suppliers/price_simulation_form.html', context), '#price-simulation-form')
+    return render(request, 'management/suppliers/price_simulation.html', context)
+
+
+SIMULATION_LIMIT = 1000
+
+
+@require_POST
+def price_simulation_api(request):
+    """
+    JSON what-if pricing: {"ingredients": {id: price}, "suppliers": {id: percentage},
+    "target_margin": percentage, "limit": n}, with n from 1 to SIMULATION_LIMIT. Nothing is
+    written to the database.
+    """
+    try:
+        data = json.loads(request.body or '{}')
+        ingredient_prices = {int(pk): Decimal(str(price)) for pk, price in data.get('ingredients', {}).items()}
+        supplier_percentages = {pk: Decimal(str(pct)) for pk, pct in data.get('suppliers', {}).items()}
+        target_margin = data.get('target_margin')
+        target_margin = None if target_margin is None else Decimal(str(target_margin))
+        limit = int(data.get('limit', 100))
+    except (ValueError, TypeError, AttributeError, InvalidOperation):
+        return JsonResponse({'error': 'Malformed simulation request.'}, status=400)
+    if not 1 <= limit <= SIMULATION_LIMIT:
+        return JsonResponse({'error': f'limit must be between 1 and {SIMULATION_LIMIT}.'}, status=400)
+    if any(price < Decimal('0.01') for price in ingredient_prices.values()):
+        return JsonResponse({'error': 'Ingredient prices must be at least 0.01.'}, status=400)
+    if any(pct <= Decimal('-100') for pct in supplier_percentages.values()):
+        return JsonResponse({'error': 'Supplier percentages must be above -100.'}, status=400)
+
+    simulation = costing.simulate(
+        ingredient_prices=ingredient_prices, supplier_percentages=supplier_percentages, catalog=costing.cached_catalog()
+    )
+    products, variations = _simulation_rows(simulation, target_margin, limit=limit)
+    return JsonResponse({'products': products, 'variations': variations})
+
+
+@require_GET
+def export_recipes(request):
+    """The recipebook document for ?ids=1,2,3, or for every recipe without ids, as a download."""
+    recipes = Recipe.objects.all()
+    if request.GET.get('ids'):
+        try:
+            recipes = recipes.filter(pk__in=[int(pk) for pk in request.GET['ids'].split(',')])
+        except ValueError:
+            return JsonResponse({'error': 'ids must be comma-separated integers.'}, status=400)
+    response = JsonResponse(recipebook.export_recipes(recipes), json_dumps_params={'separators': (',', ':')})
+    response['Content-Disposition'] = f'attachment; filename="recipes-{date.today():%Y%m%d}.json"'
+    return response
+
+
+# Rows of each kind listed on the page; the counts cover all of them
+PRICE_LIST_IMPORT_SHOWN = 200
+
+
+def import_price_list(request):
+    if request.method == "POST":
+        form = PriceListImportForm(request.POST, request.FILES)
+        if form.is_valid():
+            upload = form.cleaned_data['file']
+            supplier = form.cleaned_data['supplier']
+            lines = io.TextIOWrapper(upload.file, encoding='utf-8-sig', newline='')
+            try:
+                report = pricelists.import_price_list(
+                    lines, supplier=supplier.pk if supplier else None, dry_run=form.cleaned_data['dry_run']
+                )
+            finally:
+                # The upload closes its own file
+                lines.detach()
+            return render(request, 'management/suppliers/price_list_import_results.html', {
+                'report': report,
+                'changes': report.changes[:PRICE_LIST_IMPORT_SHOWN],
+                'created': report.created[:PRICE_LIST_IMPORT_SHOWN],
+                'hidden_changes': max(len(report.changes) - PRICE_LIST_IMPORT_SHOWN, 0),
+                'hidden_created': max(len(report.created) - PRICE_LIST_IMPORT_SHOWN, 0),
+            })
+    else:
+        form = PriceListImportForm()
+    if request.htmx:
+        return retarget(render(request, 'management/suppliers/price_list_import_form.html', {'form': form}), '#price-list-import-form')
+    return render(request, 'management/suppliers/price_list_import.html', {'form': form})
+
+
+def _production_plan_payload(plan):
+    suppliers = []
+    for row in plan.ingredient_demand():
+        if not suppliers or suppliers[-1]['id'] != row['supplier_id']:
+            suppliers.append({'id': row['supplier_id'], 'name': row['supplier_name'], 'cost': Decimal('0.00'), 'ingredients': []})
+        suppliers[-1]['cost'] += row['cost']
+        suppliers[-1]['ingredients'].append(
+            {'id': row['ingredient_id'], 'name': row['ingredient_name'], 'grams': row['grams'], 'cost': row['cost']}
+        )
+    return {'id': plan.pk, 'name': str(plan), 'bake_date': plan.bake_date, 'suppliers': suppliers}
+
+
+@require_POST
+def production_plan_api(request):
+    """
+    Create a production plan from {"name": ..., "bake_date": "YYYY-MM-DD", "lines": [{"variation": id, "quantity": n}]}
+    and return its ingredient demand grouped by supplier.
+    """
+    try:
+        data = json.loads(request.body or '{}')
+        bake_date = date.fromisoformat(data['bake_date']) if data.get('bake_date') else date.today()
+        lines = [(int(line['variation']), int(line['quantity'])) for line in data['lines']]
+    except (ValueError, TypeError, KeyError, AttributeError):
+        return JsonResponse({'error': 'Malformed production plan.'}, status=400)
+    if not lines or any(quantity < 1 for _, quantity in lines):
+        return JsonResponse({'error': 'A plan needs at least one line and every quantity must be positive.'}, status=400)
+    variation_ids = {variation_id for variation_id, _ in lines}
+    missing = variation_ids - set(ProductVariation.objects.filter(pk__in=variation_ids).values_list('pk', flat=True))
+    if missing:
+        return JsonResponse({'error': f'Unknown product variations: {sorted(missing)}.'}, status=400)
+
+    with transaction.atomic():
+        plan = ProductionPlan.objects.create(name=str(data.get('name', ''))[:255], bake_date=bake_date)
+        ProductionPlanLine.objects.bulk_create(
+            ProductionPlanLine(plan=plan, variation_id=variation_id, quantity=quantity) for variation_id, quantity in lines
+        )
+    return JsonResponse(_production_plan_payload(plan), status=201)
+
+
+@require_GET
+def production_plan_demand_api(request, pk):
+    plan = get_object_or_404(ProductionPlan, pk=pk)
+    return JsonResponse(_production_plan_payload(plan))
@@ -1,3 +1,113 @@
 // Some custom JS for the project.
 
 // Some custom JS for the project.
+
+// Shape map of the variation form's product select (forms.ProductShapeSelect). The select embeds
+// the shapes of the products it renders; those of options the typeahead loads later are fetched
+// from the batched product-shapes endpoint, one request per page of options.
+(function () {
+  const maps = new WeakMap();
+
+  function shapeMap(select) {
+    if (!maps.has(select)) maps.set(select, JSON.parse(select.dataset.shapes || '{}'));
+    return maps.get(select);
+  }
+
+  function loadShapes(select, ids) {
+    const map = shapeMap(select);
+    const missing = ids.filter((id) => id && !(id in map));
+    if (!missing.length) return Promise.resolve(map);
+    return fetch(`${select.dataset.shapesUrl}?ids=${missing.join(',')}`)
+      .then((response) => response.json())
+      .then((data) => Object.assign(map, data.shapes));
+  }
+
+  // Show the dimensions the product's shape uses, filled with its recipe's defaults
+  window.updateFormFields = function (select) {
+    select = select || document.querySelector('select[data-shapes]');
+    if (!select || !select.value) return;
+    loadShapes(select, [select.value]).then((map) => {
+      const product = map[select.value];
+      if (!product) return;
+      for (const name of ['diameter', 'length', 'width']) {
+        const input = select.form.querySelector(`[name$="${name}"]`);
+        if (!input) continue;
+        const used = product.shape === 'C' ? name === 'diameter' : name !== 'diameter';
+        const group = input.closest('.form-group') || input;
+        group.hidden = !used;
+        if (used && !input.value && product[name] !== null) input.value = product[name];
+      }
+    });
+  };
+
+  document.addEventListener('typeahead:loaded', (event) => {
+    if (event.target.dataset.shapes !== undefined) loadShapes(event.target, event.detail.ids);
+  });
+})();
+
+// Lazy selects (management.typeahead.LazySelect) render only their selected option. A search box
+// in front of each one fetches the rest from the typeahead endpoint, a page at a time.
+(function () {
+  const MORE = '__more__';
+
+  function attach(select) {
+    if (select.dataset.typeaheadReady) return;
+    select.dataset.typeaheadReady = 'true';
+
+    const input = document.createElement('input');
+    input.type = 'search';
+    input.className = select.className;
+    input.placeholder = 'Search…';
+    input.autocomplete = 'off';
+    select.parentNode.insertBefore(input, select);
+
+    let timer = null;
+    let controller = null;
+    let next = null;
+
+    function load(append) {
+      const params = new URLSearchParams({ q: input.value });
+      if (append && next) params.set('cursor', next);
+      if (controller) controller.abort();
+      controller = new AbortController();
+      fetch(`${select.dataset.typeahead}?${params}`, { signal: controller.signal })
+        .then((response) => response.json())
+        .then((data) => {
+          for (const option of Array.from(select.options)) {
+            if (option.value === MORE || (!append && option.value && !option.selected)) option.remove();
+          }
+          const present = new Set(Array.from(select.options, (option) => option.value));
+          for (const item of data.results) {
+            if (!present.has(String(item.id))) select.add(new Option(item.text, item.id));
+          }
+          next = data.next;
+          if (next) select.add(new Option('More…', MORE));
+          const ids = data.results.map((item) => String(item.id));
+          select.dispatchEvent(new CustomEvent('typeahead:loaded', { bubbles: true, detail: { ids } }));
+        })
+        .catch(() => {});
+    }
+
+    input.addEventListener('input', () => {
+      clearTimeout(timer);
+      timer = setTimeout(() => load(false), 250);
+    });
+    select.addEventListener('focus', () => load(false), { once: true });
+    select.addEventListener('change', (event) => {
+      if (select.value !== MORE) return;
+      event.stopImmediatePropagation();
+      select.selectedIndex = 0;
+      load(true);
+    }, { capture: true });
+  }
+
+  function attachAll(root) {
+    root.querySelectorAll('select[data-typeahead]').forEach(attach);
+  }
+
+  if (window.htmx) {
+    htmx.onLoad(attachAll);
+  } else {
+    document.addEventListener('DOMContentLoaded', () => attachAll(document));
+  }
+})();
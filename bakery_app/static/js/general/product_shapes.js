@@ -0,0 +1,42 @@
+// Shape map of the variation form's product select (forms.ProductShapeSelect). The select embeds
+// the shapes of the products it renders; those of options the typeahead loads later are fetched
+// from the batched product-shapes endpoint, one request per page of options.
+(function () {
+  const maps = new WeakMap();
+
+  function shapeMap(select) {
+    if (!maps.has(select)) maps.set(select, JSON.parse(select.dataset.shapes || '{}'));
+    return maps.get(select);
+  }
+
+  function loadShapes(select, ids) {
+    const map = shapeMap(select);
+    const missing = ids.filter((id) => id && !(id in map));
+    if (!missing.length) return Promise.resolve(map);
+    return fetch(`${select.dataset.shapesUrl}?ids=${missing.join(',')}`)
+      .then((response) => response.json())
+      .then((data) => Object.assign(map, data.shapes));
+  }
+
+  // Show the dimensions the product's shape uses, filled with its recipe's defaults
+  window.updateFormFields = function (select) {
+    select = select || document.querySelector('select[data-shapes]');
+    if (!select || !select.value) return;
+    loadShapes(select, [select.value]).then((map) => {
+      const product = map[select.value];
+      if (!product) return;
+      for (const name of ['diameter', 'length', 'width']) {
+        const input = select.form.querySelector(`[name$="${name}"]`);
+        if (!input) continue;
+        const used = product.shape === 'C' ? name === 'diameter' : name !== 'diameter';
+        const group = input.closest('.form-group') || input;
+        group.hidden = !used;
+        if (used && !input.value && product[name] !== null) input.value = product[name];
+      }
+    });
+  };
+
+  document.addEventListener('typeahead:loaded', (event) => {
+    if (event.target.dataset.shapes !== undefined) loadShapes(event.target, event.detail.ids);
+  });
+})();
@@ -0,0 +1,66 @@
+// Lazy selects (management.typeahead.LazySelect) render only their selected option. A search box
+// in front of each one fetches the rest from the typeahead endpoint, a page at a time.
+(function () {
+  const MORE = '__more__';
+
+  function attach(select) {
+    if (select.dataset.typeaheadReady) return;
+    select.dataset.typeaheadReady = 'true';
+
+    const input = document.createElement('input');
+    input.type = 'search';
+    input.className = select.className;
+    input.placeholder = 'Search…';
+    input.autocomplete = 'off';
+    select.parentNode.insertBefore(input, select);
+
+    let timer = null;
+    let controller = null;
+    let next = null;
+
+    function load(append) {
+      const params = new URLSearchParams({ q: input.value });
+      if (append && next) params.set('cursor', next);
+      if (controller) controller.abort();
+      controller = new AbortController();
+      fetch(`${select.dataset.typeahead}?${params}`, { signal: controller.signal })
+        .then((response) => response.json())
+        .then((data) => {
+          for (const option of Array.from(select.options)) {
+            if (option.value === MORE || (!append && option.value && !option.selected)) option.remove();
+          }
+          const present = new Set(Array.from(select.options, (option) => option.value));
+          for (const item of data.results) {
+            if (!present.has(String(item.id))) select.add(new Option(item.text, item.id));
+          }
+          next = data.next;
+          if (next) select.add(new Option('More…', MORE));
+          const ids = data.results.map((item) => String(item.id));
+          select.dispatchEvent(new CustomEvent('typeahead:loaded', { bubbles: true, detail: { ids } }));
+        })
+        .catch(() => {});
+    }
+
+    input.addEventListener('input', () => {
+      clearTimeout(timer);
+      timer = setTimeout(() => load(false), 250);
+    });
+    select.addEventListener('focus', () => load(false), { once: true });
+    select.addEventListener('change', (event) => {
+      if (select.value !== MORE) return;
+      event.stopImmediatePropagation();
+      select.selectedIndex = 0;
+      load(true);
+    }, { capture: true });
+  }
+
+  function attachAll(root) {
+    root.querySelectorAll('select[data-typeahead]').forEach(attach);
+  }
+
+  if (window.htmx) {
+    htmx.onLoad(attachAll);
+  } else {
+    document.addEventListener('DOMContentLoaded', () => attachAll(document));
+  }
+})();
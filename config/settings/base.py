@@ -68,6 +68,7 @@ DJANGO_APPS = [
     "django.contrib.staticfiles",
     # "django.contrib.humanize", # Handy template tags
     "django.contrib.admin",
+    "django.contrib.postgres",
     "django.forms",
 ]
 THIRD_PARTY_APPS = [
@@ -76,6 +77,7 @@ THIRD_PARTY_APPS = [
     "allauth",
     "allauth.account",
     'django_tables2',
+    'django_filters',
 ]
 
 LOCAL_APPS = [
@@ -130,6 +132,7 @@ AUTH_PASSWORD_VALIDATORS = [
 MIDDLEWARE = [
     "django.middleware.security.SecurityMiddleware",
     "whitenoise.middleware.WhiteNoiseMiddleware",
+    "bakery_app.management.instrumentation.QueryBudgetMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.locale.LocaleMiddleware",
     "django.middleware.common.CommonMiddleware",
@@ -138,6 +141,7 @@ MIDDLEWARE = [
     "django.contrib.messages.middleware.MessageMiddleware",
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
     "allauth.account.middleware.AccountMiddleware",
+    "django_htmx.middleware.HtmxMiddleware",
 ]
 
 # STATIC
@@ -167,7 +171,8 @@ MEDIA_URL = "/media/"
 TEMPLATES = [
     {
         # https://docs.djangoproject.com/en/dev/ref/settings/#std:setting-TEMPLATES-BACKEND
-        "BACKEND": "django.template.backends.django.DjangoTemplates",
+        # Django's backend, timing each render for management.instrumentation.QueryBudgetMiddleware
+        "BACKEND": "bakery_app.management.instrumentation.TimedDjangoTemplates",
         # https://docs.djangoproject.com/en/dev/ref/settings/#dirs
         "DIRS": [str(APPS_DIR / "templates")],
         # https://docs.djangoproject.com/en/dev/ref/settings/#app-dirs
@@ -277,3 +282,21 @@ ACCOUNT_FORMS = {"signup": "bakery_app.users.forms.UserSignupForm"}
 
 # Your stuff...
 # ------------------------------------------------------------------------------
+# Seconds a rendered HTMX table partial stays in the cache; writes invalidate it sooner
+FRAGMENT_CACHE_TIMEOUT = env.int("FRAGMENT_CACHE_TIMEOUT", default=3600)
+# Per-request query instrumentation (management.instrumentation.QueryBudgetMiddleware): send the
+# numbers in a Server-Timing header, and warn when a view runs more queries than its budget
+SERVER_TIMING_HEADER = env.bool("SERVER_TIMING_HEADER", default=DEBUG)
+QUERY_BUDGET_DEFAULT = env.int("QUERY_BUDGET_DEFAULT", default=30)
+QUERY_BUDGETS = {
+    # Session and user, then each page of rows with its costing in a query or two
+    "management:product-table": 6,
+    "management:ingredient-table": 6,
+    "management:variations-table": 8,
+    "management:product-list": 6,
+    "management:live-search": 8,
+    "management:typeahead": 4,
+    "management:product-shapes": 4,
+    # Writes one query per batch of changed rows, so it grows with the price list
+    "management:price-list-import": None,
+}